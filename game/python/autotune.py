@@ -0,0 +1,220 @@
+"""
+Hardware-aware tuning of the local model's thread count, prompt batch size
+and context size.
+Run from the game directory with:
+    $ python -m python.autotune [--threads 2,4,8] [--batches 8,32,128,512] [--contexts 512,1024,2048]
+
+The sweep times the evaluator prompt on this machine and stores the fastest
+settings in data/cache/tuning_profiles.json, keyed by model file and CPU.
+llm_local_bind applies the stored profile whenever it loads that model.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+DEFAULT_BATCHES = (8, 32, 128, 512)
+DEFAULT_CONTEXTS = (512, 1024, 2048)
+# Tokens generated per calibration run, on top of ingesting the prompt.
+CALIBRATION_TOKENS = 16
+# A context must hold this many times the calibration prompt plus its output.
+CONTEXT_HEADROOM = 2.0
+# Settings within this fraction of the fastest are treated as equally fast;
+# among those the smallest context and fewest threads win.
+TIE_MARGIN = 0.05
+
+_FORMAT_VERSION = 1
+
+
+def cpu_signature() -> str:
+    """Identify the CPU model and core count the profile was measured on."""
+    name = platform.processor() or ""
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8", errors="replace") as fh:
+            for line in fh:
+                if line.startswith("model name"):
+                    name = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{platform.system()}/{platform.machine()}/{name}/{os.cpu_count() or 1}"
+
+
+def profile_key(model_path: str) -> str:
+    """Key a profile by model file (name, size, mtime) and CPU signature."""
+    try:
+        stat = os.stat(model_path)
+        file_id = f"{stat.st_size}:{int(stat.st_mtime)}"
+    except OSError:
+        file_id = "missing"
+    digest = hashlib.sha1()
+    for part in (os.path.basename(model_path), file_id, cpu_signature()):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _read_profiles(path: str) -> Dict[str, Dict[str, object]]:
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            payload = json.load(fh)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(payload, dict) or payload.get("format") != _FORMAT_VERSION:
+        return {}
+    profiles = payload.get("profiles")
+    return profiles if isinstance(profiles, dict) else {}
+
+
+def load_profile(path: str, model_path: str) -> Optional[Dict[str, object]]:
+    """Return the tuned settings for model_path on this machine, if any."""
+    profile = _read_profiles(path).get(profile_key(model_path))
+    return profile if isinstance(profile, dict) else None
+
+
+def save_profile(path: str, model_path: str, profile: Dict[str, object]) -> None:
+    profiles = _read_profiles(path)
+    profiles[profile_key(model_path)] = profile
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump({"format": _FORMAT_VERSION, "profiles": profiles}, fh, indent=2)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"[HOLMES] WARNING: could not write tuning profile: {e}")
+
+
+def thread_candidates(cores: Optional[int] = None) -> List[int]:
+    """Powers of two (plus 6 and 12) up to the core count, and the core count itself."""
+    cores = cores or os.cpu_count() or 1
+    candidates = {n for n in (1, 2, 4, 6, 8, 12, 16, 24, 32) if n <= cores}
+    candidates.add(cores)
+    return sorted(candidates)
+
+
+def _time_prompt(llmodel, prompt: str, n_batch: int, n_predict: int) -> float:
+    """Seconds to ingest prompt from an empty context and generate n_predict tokens."""
+    first_token_at: List[float] = []
+    tokens = [0]
+
+    def _count(token_id: int, response: str) -> bool:
+        if not first_token_at:
+            first_token_at.append(time.perf_counter())
+        tokens[0] += 1
+        return True
+
+    started = time.perf_counter()
+    llmodel.prompt_model(
+        prompt, "%1%2", _count,
+        n_predict=n_predict, top_k=1, n_batch=n_batch, reset_context=True, special=True,
+    )
+    finished = time.perf_counter()
+    if not first_token_at or tokens[0] < 2:
+        return finished - started
+    # Normalize to n_predict tokens in case the model stopped early.
+    per_token = (finished - first_token_at[0]) / (tokens[0] - 1)
+    return (first_token_at[0] - started) + per_token * (n_predict - 1)
+
+
+def choose(results: List[Dict[str, object]]) -> Dict[str, object]:
+    """Pick the smallest context, then fewest threads, among the near-fastest results."""
+    fastest = min(float(r["seconds"]) for r in results)
+    near = [r for r in results if float(r["seconds"]) <= fastest * (1.0 + TIE_MARGIN)]
+    return min(near, key=lambda r: (r["n_ctx"], r["n_threads"], r["seconds"]))
+
+
+def autotune(
+    model_name: str,
+    model_dir: str,
+    prompt: str,
+    threads: Optional[Iterable[int]] = None,
+    batches: Iterable[int] = DEFAULT_BATCHES,
+    contexts: Iterable[int] = DEFAULT_CONTEXTS,
+    repeats: int = 2,
+    log: Callable[[str], None] = print,
+) -> Dict[str, object]:
+    """Time prompt under every combination of settings and return the best profile.
+
+    The model is reloaded once per context size, largest first; the first
+    load measures the prompt length so contexts too small for it are skipped.
+    Each combination is timed `repeats` times and its fastest run counts.
+    """
+    from gpt4all import GPT4All
+
+    threads = sorted(set(threads or thread_candidates()))
+    batches = sorted(set(batches))
+    results: List[Dict[str, object]] = []
+    prompt_tokens = None
+    for n_ctx in sorted(set(contexts), reverse=True):
+        if prompt_tokens is not None and n_ctx < CONTEXT_HEADROOM * (prompt_tokens + CALIBRATION_TOKENS):
+            log(f"n_ctx={n_ctx}: too small for the calibration prompt, skipped")
+            continue
+        model = GPT4All(model_name, model_path=model_dir, allow_download=False, n_ctx=n_ctx)
+        try:
+            llmodel = model.model
+            if prompt_tokens is None:
+                llmodel.prompt_model(prompt, "%1%2", lambda *_: True,
+                                     n_predict=0, n_batch=128, reset_context=True, special=True)
+                prompt_tokens = llmodel.n_past
+                log(f"calibration prompt: {prompt_tokens} tokens")
+            for n_threads in threads:
+                llmodel.set_thread_count(n_threads)
+                for n_batch in batches:
+                    if n_batch > n_ctx:
+                        continue
+                    seconds = min(_time_prompt(llmodel, prompt, n_batch, CALIBRATION_TOKENS) for _ in range(repeats))
+                    results.append({"n_ctx": n_ctx, "n_threads": n_threads, "n_batch": n_batch, "seconds": seconds})
+                    log(f"n_ctx={n_ctx} n_threads={n_threads} n_batch={n_batch}: {seconds * 1000.0:.1f} ms")
+        finally:
+            model.close()
+    if not results:
+        raise RuntimeError("no context size is large enough for the calibration prompt")
+    best = choose(results)
+    return {
+        "n_threads": best["n_threads"],
+        "n_batch": best["n_batch"],
+        "n_ctx": best["n_ctx"],
+        "seconds": round(float(best["seconds"]), 4),
+        "prompt_tokens": prompt_tokens,
+        "model": model_name,
+        "cpu": cpu_signature(),
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from python.dialogue_logic import build_prompt
+    from python.llm_local_bind import MODEL_DIR, MODEL_NAME, TUNING_PROFILE_PATH
+
+    parser = argparse.ArgumentParser(description="Tune n_threads, n_batch and n_ctx for the local model.")
+    parser.add_argument("--threads", type=_int_list, default=None, help="comma-separated thread counts")
+    parser.add_argument("--batches", type=_int_list, default=list(DEFAULT_BATCHES), help="comma-separated n_batch values")
+    parser.add_argument("--contexts", type=_int_list, default=list(DEFAULT_CONTEXTS), help="comma-separated n_ctx values")
+    parser.add_argument("--repeats", type=int, default=2, help="timed runs per combination")
+    parser.add_argument("--dry-run", action="store_true", help="report the best settings without saving them")
+    args = parser.parse_args(argv)
+
+    # A representative evaluator request: the real prefix and a typical answer.
+    prefix, suffix = build_prompt("The people were starving while the king kept his power.", "calibration")
+    model_path = os.path.join(MODEL_DIR, MODEL_NAME)
+    profile = autotune(MODEL_NAME, MODEL_DIR, prefix + suffix,
+                       threads=args.threads, batches=args.batches, contexts=args.contexts, repeats=args.repeats)
+    print(f"best: n_threads={profile['n_threads']} n_batch={profile['n_batch']} n_ctx={profile['n_ctx']} "
+          f"({profile['seconds'] * 1000.0:.1f} ms per request)")
+    if not args.dry_run:
+        save_profile(TUNING_PROFILE_PATH, model_path, profile)
+        print(f"saved to {TUNING_PROFILE_PATH}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
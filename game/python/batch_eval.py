@@ -0,0 +1,172 @@
+"""
+Headless batch evaluation of recorded player answers.
+Run from the game directory with:
+    $ python -m python.batch_eval answers.jsonl verdicts.jsonl [--llm-only] [--workers N]
+
+Each input line is a JSON object with "interaction_id" and "player_text"
+(and optionally "expected": true/false). Each output line repeats them and
+adds "ok", "feedback", "latency_ms" and "ttft_ms" (time to the first
+generated token; null when no model call was needed). A throughput and
+latency summary is printed at the end.
+
+The game's verdict cache is neither read nor written, so every answer that
+the keyword and semantic tiers leave open reaches the model, and the run
+measures the current prompt and generation settings.
+"""
+import argparse
+import json
+import math
+import sys
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from python.game_data import GameData
+
+Task = Tuple[str, str, bool]
+Timing = Tuple[bool, str, float, Optional[float]]
+
+
+def read_answers(path: str) -> Iterator[Dict[str, object]]:
+    with open(path, "r", encoding="utf-8") as fh:
+        for line_no, line in enumerate(fh, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise SystemExit(f"{path}:{line_no}: invalid JSON: {e}")
+            if not isinstance(record, dict):
+                raise SystemExit(f"{path}:{line_no}: expected a JSON object")
+            yield record
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of values, or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def evaluate_timed(task: Task) -> Timing:
+    """Evaluate one answer and return (ok, feedback, latency, ttft) in seconds."""
+    from python.dialogue_logic import evaluate
+
+    player_text, target_id, llm_only = task
+    first_token_at = []
+
+    def on_token(text: str) -> bool:
+        if not first_token_at:
+            first_token_at.append(time.perf_counter())
+        return True
+
+    started = time.perf_counter()
+    ok, feedback = evaluate(player_text, target_id, on_token=on_token, llm_only=llm_only)
+    finished = time.perf_counter()
+    ttft = first_token_at[0] - started if first_token_at else None
+    return ok, feedback, finished - started, ttft
+
+
+def _results_in_process(tasks: List[Task], data_path: Optional[str]) -> Iterator[Timing]:
+    from python.dialogue_logic import configure, warm_up
+    from python.llm_local_bind import start_loading, wait_for_model
+
+    configure(data_path, verdict_cache=False)
+
+    # Load the model and ingest the evaluator prefix up front so that the
+    # first answer's latency is not dominated by start-up.
+    started = time.perf_counter()
+    start_loading()
+    if wait_for_model() is not None:
+        warm_up()
+        print(f"[HOLMES] model ready in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+    else:
+        print("[HOLMES] WARNING: model unavailable; only answers graded without it will pass", file=sys.stderr)
+    for task in tasks:
+        yield evaluate_timed(task)
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000.0, 2)
+
+
+def _format_ms(seconds: Optional[float]) -> str:
+    return "n/a" if seconds is None else f"{seconds * 1000.0:.1f} ms"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("answers", help="input JSONL of {interaction_id, player_text[, expected]}")
+    parser.add_argument("output", help="output JSONL of verdicts")
+    parser.add_argument("--llm-only", action="store_true",
+                        help="send every answer to the model, bypassing keyword and semantic grading")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="grade with a pool of N model processes (0: in this process)")
+    parser.add_argument("--data", default=None, help="game content JSON (default: data/game_content.json)")
+    args = parser.parse_args(argv)
+
+    game_data = GameData(args.data)
+    records = list(read_answers(args.answers))
+    tasks: List[Task] = []
+    for record in records:
+        target_id = str(record.get("interaction_id") or "")
+        if game_data.get_interaction(target_id) is None:
+            raise SystemExit(f"unknown interaction id: {target_id!r}")
+        tasks.append((str(record.get("player_text") or ""), target_id, args.llm_only))
+
+    pool = None
+    started = time.perf_counter()
+    if args.workers > 0:
+        from python.model_pool import ModelPool
+
+        pool = ModelPool(args.workers, data_path=args.data)
+        results = pool.imap(evaluate_timed, tasks)
+    else:
+        results = _results_in_process(tasks, args.data)
+
+    latencies: List[float] = []
+    ttfts: List[float] = []
+    correct = labelled = 0
+    timed_from = None
+    try:
+        with open(args.output, "w", encoding="utf-8") as out:
+            for record, (ok, feedback, latency, ttft) in zip(records, results):
+                if timed_from is None:
+                    # Throughput is measured from the first result on, so model
+                    # loading does not count against it.
+                    timed_from = time.perf_counter() - latency
+                latencies.append(latency)
+                if ttft is not None:
+                    ttfts.append(ttft)
+                if isinstance(record.get("expected"), bool):
+                    labelled += 1
+                    correct += int(record["expected"] == ok)
+                out.write(json.dumps({
+                    "interaction_id": record.get("interaction_id"),
+                    "player_text": record.get("player_text"),
+                    "expected": record.get("expected"),
+                    "ok": ok,
+                    "feedback": feedback,
+                    "latency_ms": _ms(latency),
+                    "ttft_ms": _ms(ttft),
+                }, ensure_ascii=False) + "\n")
+    finally:
+        if pool is not None:
+            pool.close()
+
+    elapsed = time.perf_counter() - (timed_from if timed_from is not None else started)
+    print(f"answers:      {len(latencies)} in {elapsed:.2f}s "
+          f"({len(latencies) / elapsed if elapsed > 0 else 0.0:.2f} req/s)")
+    print(f"model calls:  {len(ttfts)}")
+    print(f"ttft:         p50 {_format_ms(percentile(ttfts, 50))}, p95 {_format_ms(percentile(ttfts, 95))}")
+    print(f"latency:      p50 {_format_ms(percentile(latencies, 50))}, "
+          f"p95 {_format_ms(percentile(latencies, 95))}, p99 {_format_ms(percentile(latencies, 99))}")
+    if labelled:
+        print(f"accuracy:     {correct}/{labelled} ({100.0 * correct / labelled:.1f}%)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,59 +1,357 @@
-# dialogue_logic.py — GPT4All blocking inference (for debugging & testing)
-import renpy.exports as renpy_exports
-from python.llm_local_bind import generate_sync
+# dialogue_logic.py — GPT4All dialogue evaluation (run via python/inference_worker.py)
+import os
+import threading
+
+from python.game_data import DEFAULT_DATA_PATH, GameData
+from python.keyword_grader import KeywordGrader
+from python.lore_index import LoreIndex
+from python.llm_local_bind import (CACHE_DIR, EMBEDDING_CACHE_DIR, MODEL_DIR, MODEL_NAME, generate_with_prefix,
+                                   model_info, warm_prefixes)
+from python.semantic_grader import EMBEDDING_MODEL_NAME, SemanticGrader
+from python.verdict_cache import VerdictCache
+
+# Bump whenever the prompt or generation settings change so cached verdicts
+# produced by the old prompt are no longer served.
+PROMPT_VERSION = 4
+VERDICT_CACHE_PATH = os.path.join(CACHE_DIR, "verdicts.jsonl")
+SEMANTIC_REFERENCES_PATH = os.path.join(CACHE_DIR, "semantic_references.json")
+LORE_INDEX_PATH = os.path.join(CACHE_DIR, "lore_index.json")
+# Grade with embedding similarity before falling back to the chat model.
+# Disabled automatically if the embedding model cannot be loaded.
+SEMANTIC_GRADING = True
+# Ground the evaluator prompt in the most relevant stage content. Disabled
+# automatically if the embedding model cannot be loaded.
+LORE_RETRIEVAL = True
 
 SYSTEM_PROMPT = (
     "You are a historical dialogue evaluator for the game HOLMES. "
     "Judge whether the player's reply shows understanding of the scene and clues."
 )
 
-QWEN_CHAT_TEMPLATE = (
-    "<|im_start|>system\n{system}\n<|im_end|>\n"
-    "<|im_start|>user\n{user}\n<|im_end|>\n"
-    "<|im_start|>assistant\n"
+# Raw prompt layouts by the chat format the model's GGUF metadata declares.
+CHAT_TEMPLATES = {
+    "llama3": (
+        "<|start_header_id|>system<|end_header_id|>\n\n{system}<|eot_id|>"
+        "<|start_header_id|>user<|end_header_id|>\n\n{user}<|eot_id|>"
+        "<|start_header_id|>assistant<|end_header_id|>\n\n"
+    ),
+    "chatml": (
+        "<|im_start|>system\n{system}\n<|im_end|>\n"
+        "<|im_start|>user\n{user}\n<|im_end|>\n"
+        "<|im_start|>assistant\n"
+    ),
+}
+# Used when the model file cannot be read or its format is unknown.
+DEFAULT_CHAT_FORMAT = "chatml"
+
+# Static evaluator instructions. They sit before anything request-specific so
+# the whole block belongs to the prompt prefix that stays in the KV cache.
+EVALUATOR_INSTRUCTIONS = (
+    "You are a historical dialogue evaluator for the game HOLMES.\n"
+    "Evaluate the player's answer:\n"
+    "- If the response demonstrates understanding or mentions relevant clues, "
+    "start with 'Good answer:' followed by a short justification.\n"
+    "- Otherwise, start with 'Try again:' followed by a hint.\n"
+    "Always write the verdict first, then a single short sentence.\n\n"
 )
 
+# Verdict phrases the model must open with, and what they mean.
+VERDICTS = (("good answer", True), ("try again", False))
+# Tokens allowed after the verdict before generation is cut off.
+MAX_JUSTIFICATION_TOKENS = 32
+# Tokens allowed before a verdict must have appeared.
+MAX_VERDICT_TOKENS = 6
+_SENTENCE_END = (".", "!", "?")
+# Markdown and quote characters the model may wrap the verdict in.
+_VERDICT_DECORATION = " \t\r\n*_#>`\"'\u201c\u201d\u2018\u2019"
+# Shown when the model did not open with a verdict and the interaction has
+# no authored failure feedback.
+NO_VERDICT_FEEDBACK = "Try again: I could not quite follow that."
+
 GENERATION_KWARGS = {
-    "max_tokens": 120,
+    # Hard cap only; VerdictStream normally stops well before this.
+    "max_tokens": 48,
     "temp": 0.35,
     "top_p": 0.92,
     "repeat_penalty": 1.1,
-    "n_batch": 4,
 }
 
-def process_input(player_text, target_id):
-    """Run the local LLM and return (ok, feedback)."""
+# The content graded against and which shared caches are used. The game
+# keeps the defaults; offline tools change them with configure().
+_data_path = DEFAULT_DATA_PATH
+_use_verdict_cache = True
+_use_embedding_cache = True
+
+_components_lock = threading.Lock()
+_game_data = None
+_verdict_cache = None
+_keyword_grader = None
+_semantic_grader = None
+_lore_index = None
+
+
+def configure(data_path=None, verdict_cache=True, embedding_cache=True):
+    """Grade against another game content file, or without the shared caches.
+
+    Both the verdict cache and the embedding cache allow a single writer
+    process only. Meant to be called before the first evaluation;
+    components created earlier are dropped so they are rebuilt for the new
+    settings.
+    """
+    global _data_path, _use_verdict_cache, _use_embedding_cache
+    global _game_data, _verdict_cache, _keyword_grader, _semantic_grader, _lore_index
+    with _components_lock:
+        _data_path = os.path.abspath(data_path or DEFAULT_DATA_PATH)
+        _use_verdict_cache = verdict_cache
+        _use_embedding_cache = embedding_cache
+        _game_data = _verdict_cache = _keyword_grader = _semantic_grader = _lore_index = None
+
+
+def _get_game_data():
+    # Callers hold _components_lock.
+    global _game_data
+    if _game_data is None:
+        _game_data = GameData(_data_path)
+    return _game_data
+
+
+def get_verdict_cache():
+    """The verdict cache, or None if configure() turned it off."""
+    global _verdict_cache
+    with _components_lock:
+        if _verdict_cache is None and _use_verdict_cache:
+            _verdict_cache = VerdictCache(VERDICT_CACHE_PATH, _data_path, MODEL_NAME, PROMPT_VERSION)
+        return _verdict_cache
+
+
+def get_keyword_grader():
+    global _keyword_grader
+    with _components_lock:
+        if _keyword_grader is None:
+            _keyword_grader = KeywordGrader(_get_game_data())
+        return _keyword_grader
+
+
+def get_semantic_grader():
+    global _semantic_grader
+    with _components_lock:
+        if _semantic_grader is None:
+            _semantic_grader = SemanticGrader(
+                MODEL_DIR, SEMANTIC_REFERENCES_PATH, _get_game_data(),
+                embedding_cache_dir=EMBEDDING_CACHE_DIR if _use_embedding_cache else None,
+            )
+        return _semantic_grader
+
+
+def get_lore_index():
+    global _lore_index
+    semantic_grader = get_semantic_grader()
+    with _components_lock:
+        if _lore_index is None:
+            # Shares the semantic grader's embedding model.
+            _lore_index = LoreIndex(
+                LORE_INDEX_PATH, semantic_grader.get_embedder, EMBEDDING_MODEL_NAME, _get_game_data()
+            )
+        return _lore_index
+
+
+def _lore_context(target_id, text_value):
+    global LORE_RETRIEVAL
+    try:
+        return get_lore_index().context_for(target_id, text_value)
+    except Exception as e:
+        print(f"[HOLMES] WARNING: lore retrieval disabled: {e}")
+        LORE_RETRIEVAL = False
+        return []
+
+
+def _semantic_grade(target_id, text_value):
+    global SEMANTIC_GRADING
+    try:
+        return get_semantic_grader().grade(target_id, text_value)
+    except Exception as e:
+        print(f"[HOLMES] WARNING: semantic grading disabled: {e}")
+        SEMANTIC_GRADING = False
+        return None
+
+
+class VerdictStream:
+    """Response callback that reads the verdict first and stops generation early.
+
+    The verdict is known as soon as the output starts with one of VERDICTS;
+    on_verdict is called with it right away. Generation then continues only
+    until the first sentence of the justification ends or
+    MAX_JUSTIFICATION_TOKENS more tokens were produced. Output that does not
+    open with a verdict within MAX_VERDICT_TOKENS tokens is cut off too.
+    If on_token returns False the generation is aborted.
+    """
+
+    def __init__(self, on_token=None, on_verdict=None):
+        self.on_token = on_token
+        self.on_verdict = on_verdict
+        self.verdict = None
+        self.aborted = False
+        self._chunks = []
+        self._verdict_end = 0
+        self._tokens = 0
+        self._justification_tokens = 0
+
+    @property
+    def text(self):
+        return "".join(self._chunks)
+
+    def __call__(self, response):
+        self._chunks.append(response)
+        self._tokens += 1
+        if self.on_token is not None and self.on_token(response) is False:
+            # The caller no longer wants this answer (cancelled or superseded).
+            self.aborted = True
+            return False
+
+        text = self.text.lstrip(_VERDICT_DECORATION)
+        if self.verdict is None:
+            lowered = text.lower()
+            for phrase, ok in VERDICTS:
+                if lowered.startswith(phrase):
+                    self.verdict = ok
+                    self._verdict_end = len(phrase)
+                    if self.on_verdict is not None:
+                        self.on_verdict(ok)
+                    return True
+            still_possible = any(phrase.startswith(lowered) for phrase, _ in VERDICTS)
+            return still_possible and self._tokens < MAX_VERDICT_TOKENS
+
+        self._justification_tokens += 1
+        justification = text[self._verdict_end:].lstrip(_VERDICT_DECORATION + ":").rstrip(_VERDICT_DECORATION)
+        if justification.endswith(_SENTENCE_END) and len(justification) > 1:
+            return False
+        return self._justification_tokens < MAX_JUSTIFICATION_TOKENS
+
+
+def chat_template():
+    """The prompt layout matching the chat format of the loaded model file."""
+    info = model_info()
+    chat_format = info.chat_format if info is not None else None
+    if chat_format not in CHAT_TEMPLATES:
+        chat_format = DEFAULT_CHAT_FORMAT
+    return CHAT_TEMPLATES[chat_format]
+
+
+def build_prompt(text_value, target_id, lore=None):
+    """Split the evaluator prompt into its shared prefix and per-request suffix.
+
+    lore, if given, is a list of content snippets added to the context; they
+    belong to the suffix, so the cached prefix stays the same.
+    """
+    head, tail = chat_template().split("{user}")
+    prefix = head.format(system=SYSTEM_PROMPT) + EVALUATOR_INSTRUCTIONS
+    context = f"Context: Player interacts with '{target_id}'.\n"
+    if lore:
+        context += "".join(f"- {snippet}\n" for snippet in lore)
+    suffix = context + f"\nPlayer said: \"{text_value}\"\n" + tail
+    return prefix, suffix
+
+
+def evaluate(player_text, target_id, on_token=None, on_verdict=None, llm_only=False):
+    """Run the local LLM and return (ok, feedback) without touching the store.
+
+    Safe to call from the background inference worker. on_token, if given,
+    receives the feedback text incrementally while the model generates and
+    may return False to abandon the evaluation; on_verdict receives ok as
+    soon as the model has committed to a verdict. With llm_only every answer
+    goes to the model and the verdict cache is neither read nor written,
+    which is what offline regrading wants.
+    """
     text_value = (player_text or "").strip()
     if not text_value:
-        feedback = "No input provided."
-        renpy_exports.store._dialogue_feedback[0] = feedback
-        return False, feedback
-
-    user_prompt = (
-        "You are a historical dialogue evaluator for the game HOLMES.\n"
-        f"Context: Player interacts with '{target_id}'.\n\n"
-        f"Player said: \"{text_value}\"\n\n"
-        "Evaluate the answer:\n"
-        "- If the response demonstrates understanding or mentions relevant clues, "
-        "start with 'Good answer:' followed by a short justification.\n"
-        "- Otherwise, start with 'Try again:' followed by a hint.\n"
-    )
-
-    final_prompt = QWEN_CHAT_TEMPLATE.format(system=SYSTEM_PROMPT, user=user_prompt)
-
-    # Direct synchronous call to GPT4All
+        return False, "No input provided."
+
+    cache = None
+    if not llm_only:
+        # Tier 1: authored keywords settle clear hits and misses without the model.
+        graded = get_keyword_grader().grade(target_id, text_value)
+        if graded is not None:
+            return graded
+
+        # Tier 2: answers we already sent to the model.
+        cache = get_verdict_cache()
+        cached = cache.get(target_id, text_value) if cache is not None else None
+        if cached is not None:
+            return cached
+
+        # Tier 3: one embedding call against the precomputed references.
+        if SEMANTIC_GRADING:
+            graded = _semantic_grade(target_id, text_value)
+            if graded is not None:
+                return graded
+
+    # Tier 4: ambiguous answers go to the LLM, with the few snippets of
+    # stage content closest to the answer.
+    lore = _lore_context(target_id, text_value) if LORE_RETRIEVAL else None
+    prefix, suffix = build_prompt(text_value, target_id, lore)
+
+    stream = VerdictStream(on_token, on_verdict)
     try:
-        out = generate_sync(final_prompt, **GENERATION_KWARGS)
+        out = generate_with_prefix(prefix, suffix, on_token=stream, **GENERATION_KWARGS)
     except Exception as e:
-        feedback = f"[Error during inference: {e}]"
-        renpy_exports.store._dialogue_feedback[0] = feedback
-        return False, feedback
+        return False, f"[Error during inference: {e}]"
+    if stream.aborted:
+        return False, ""
 
-    feedback = out.strip() if out else "[No output from model.]"
-    ok = feedback.lower().startswith("good answer")
+    if not out or out.startswith("[Error"):
+        return False, out or "[No output from model.]"
+    if stream.verdict is None:
+        # The output was cut off before a verdict; it is no feedback to show
+        # or to cache.
+        return False, _failure_feedback(target_id) or NO_VERDICT_FEEDBACK
 
-    # Store feedback for UI access
-    renpy_exports.store._dialogue_feedback[0] = feedback
+    ok = stream.verdict
+    feedback = out.strip()
+    if cache is not None:
+        cache.put(target_id, text_value, ok, feedback)
     return ok, feedback
 
 
+def _failure_feedback(target_id):
+    with _components_lock:
+        interaction = _get_game_data().get_interaction(target_id) or {}
+    dialogue = interaction.get("dialogue") or {}
+    return dialogue.get("failure_feedback") if isinstance(dialogue, dict) else None
+
+
+def build_indexes():
+    """Embed the semantic references and the lore index, or load them from disk.
+
+    Each is disabled if the embedding model cannot be loaded.
+    """
+    global SEMANTIC_GRADING, LORE_RETRIEVAL
+    if SEMANTIC_GRADING:
+        try:
+            get_semantic_grader().build()
+        except Exception as e:
+            print(f"[HOLMES] WARNING: semantic grading disabled: {e}")
+            SEMANTIC_GRADING = False
+    if LORE_RETRIEVAL:
+        try:
+            get_lore_index().build()
+        except Exception as e:
+            print(f"[HOLMES] WARNING: lore retrieval disabled: {e}")
+            LORE_RETRIEVAL = False
+
+
+def warm_up():
+    """Prepare the evaluator prefix state and the embedding indexes ahead of the first player answer."""
+    prefix, _ = build_prompt("", "")
+    warm_prefixes([prefix])
+    build_indexes()
+
+
+def process_input(player_text, target_id):
+    """Run the local LLM synchronously and return (ok, feedback)."""
+    import renpy.exports as renpy_exports
+
+    ok, feedback = evaluate(player_text, target_id)
+
+    # Store feedback for UI access
+    renpy_exports.store._dialogue_feedback[0] = feedback
+    return ok, feedback
@@ -4,6 +4,9 @@ from copy import deepcopy
 from typing import Dict, List, Optional
 
 
+DEFAULT_DATA_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "data", "game_content.json"))
+
+
 def _default_data() -> Dict[str, object]:
     """Fallback payload used when the primary data file is missing or invalid."""
     return {
@@ -52,8 +55,7 @@ class GameData:
     """Loads and indexes static game content for quick lookup."""
 
     def __init__(self, data_path: Optional[str] = None) -> None:
-        base_dir = os.path.join(os.path.dirname(__file__), "..", "data")
-        self.data_path = os.path.abspath(data_path or os.path.join(base_dir, "game_content.json"))
+        self.data_path = os.path.abspath(data_path or DEFAULT_DATA_PATH)
         self._raw: Dict[str, object] = self._load()
         self._world: Dict[str, object] = self._raw.get("world_map", {}) if isinstance(self._raw, dict) else {}
         self._stages: List[Dict[str, object]] = list(self._world.get("stages", [])) if isinstance(self._world, dict) else []
@@ -248,6 +250,15 @@ class GameData:
                 result.setdefault("stage_id", stage_id)
         return result
 
+    def iter_interactions(self) -> List[Dict[str, object]]:
+        """All interactions across every stage, with area_id/stage_id filled in."""
+        results: List[Dict[str, object]] = []
+        for interaction_id in self._interaction_index:
+            interaction = self.get_interaction(interaction_id)
+            if interaction:
+                results.append(interaction)
+        return results
+
     # ------------------------------------------------------------------
     # Resolution helpers
     # ------------------------------------------------------------------
@@ -1 +1,5 @@
+from ._async import AsyncEmbed4All as AsyncEmbed4All, AsyncGPT4All as AsyncGPT4All
+from ._embed_cache import EmbeddingCache as EmbeddingCache
+from ._gguf import GGUFInfo as GGUFInfo, read_gguf as read_gguf
+from ._sharded import available_cores as available_cores, embed_sharded as embed_sharded
 from .gpt4all import CancellationError as CancellationError, Embed4All as Embed4All, GPT4All as GPT4All
@@ -0,0 +1,269 @@
+"""
+asyncio facade over the blocking GPT4All and Embed4All APIs.
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from types import TracebackType
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, TypeVar
+
+from ._pyllmodel import (STREAM_BUFFER_TOKENS, CancellationError, EmbCancelCallbackType, ResponseCallbackType,
+                         empty_response_callback)
+from .gpt4all import Embed4All, GPT4All
+
+if TYPE_CHECKING:
+    from typing_extensions import Self
+
+T = TypeVar('T')
+
+# How often a producer blocked on a full stream checks whether it was cancelled, in seconds
+_POLL_INTERVAL = 0.05
+_END = object()
+
+
+class _Cancelled(Exception):
+    """raised on the executor thread when a call was cancelled before it started"""
+
+
+class _AsyncModel(ABC):
+    """
+    Runs the calls of one model on a managed executor.
+
+    A model is not thread-safe, so by default every wrapper owns a single-thread executor that serializes its
+    calls. Cancelling the awaiting task asks the model to stop at its next token (or embedding batch) and only
+    completes once the model is idle again, so a cancelled call never overlaps with the next one.
+    """
+
+    def __init__(self, executor: Executor | None):
+        self._owns_executor = executor is None
+        self._executor = executor if executor is not None else _new_executor()
+
+    @abstractmethod
+    def _close(self) -> None:
+        """Free the wrapped model; runs on the executor after every pending call."""
+
+    async def _run(self, fn: Callable[[threading.Event], T]) -> T:
+        """Run fn(cancelled) on the executor; `cancelled` is set when the awaiting task is cancelled."""
+        cancelled = threading.Event()
+
+        def _call() -> T:
+            if cancelled.is_set():
+                raise _Cancelled
+            return fn(cancelled)
+
+        future = asyncio.get_running_loop().run_in_executor(self._executor, _call)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            cancelled.set()
+            await _settle(future)
+            raise
+
+    async def aclose(self) -> None:
+        """Wait for pending calls, then free the model and the executor if this wrapper created it."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._close)
+        if self._owns_executor:
+            self._executor.shutdown(wait=False)
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(
+        self, typ: type[BaseException] | None, value: BaseException | None, tb: TracebackType | None,
+    ) -> None:
+        await self.aclose()
+
+
+def _new_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(1, thread_name_prefix='gpt4all')
+
+
+async def _load(factory: Callable[[], T], executor: Executor | None) -> tuple[T, Executor]:
+    """Construct a model on `executor`, or on a new executor that is returned for the wrapper to own."""
+    own = executor is None
+    if executor is None:
+        executor = _new_executor()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, factory), executor
+    except BaseException:
+        if own:
+            executor.shutdown(wait=False)
+        raise
+
+
+async def _settle(future: asyncio.Future[Any]) -> None:
+    """Wait until an executor call has returned, ignoring further cancellation and its outcome."""
+    while not future.done():
+        try:
+            await asyncio.wait({future})
+        except asyncio.CancelledError:
+            pass
+    if not future.cancelled():
+        future.exception()  # mark as retrieved
+
+
+class AsyncGPT4All(_AsyncModel):
+    """
+    asyncio interface to a `GPT4All` model.
+
+    `generate` is awaitable and `stream` is an async iterator of response tokens. Both stop the generation when the
+    awaiting task is cancelled. Chat sessions are still managed with `model.chat_session()`.
+    """
+
+    def __init__(self, model: GPT4All, *, executor: Executor | None = None):
+        """
+        Constructor
+
+        Args:
+            model: The model to run.
+            executor: Executor to run the model calls on. Default is None, in which case a single-thread executor is
+                created and shut down by `aclose`. A shared executor must not run two calls on the same model at once.
+        """
+        super().__init__(executor)
+        self.model = model
+
+    @classmethod
+    async def load(cls, model_name: str, *, executor: Executor | None = None, **kwargs: Any) -> AsyncGPT4All:
+        """Load (and if allowed, download) a model without blocking the event loop. See `GPT4All` for kwargs."""
+        model, model_executor = await _load(partial(GPT4All, model_name, **kwargs), executor)
+        self = cls(model, executor=model_executor)
+        self._owns_executor = executor is None
+        return self
+
+    def _close(self) -> None:
+        self.model.close()
+
+    async def generate(
+        self, prompt: str, *, callback: ResponseCallbackType = empty_response_callback, **kwargs: Any,
+    ) -> str:
+        """
+        Generate a completion without blocking the event loop.
+
+        Args:
+            prompt: The prompt for the model to complete.
+            callback: Called on the executor thread with each token, as in `GPT4All.generate`.
+            kwargs: Remaining keyword arguments are passed to `GPT4All.generate`.
+
+        Returns:
+            The entire completion.
+        """
+        if kwargs.get('streaming'):
+            raise ValueError("Use AsyncGPT4All.stream for streaming generation")
+
+        def _generate(cancelled: threading.Event) -> str:
+            def _callback(token_id: int, response: str) -> bool:
+                return not cancelled.is_set() and callback(token_id, response)
+
+            return self.model.generate(prompt, callback=_callback, **kwargs)
+
+        return await self._run(_generate)
+
+    async def stream(
+        self, prompt: str, *, callback: ResponseCallbackType = empty_response_callback, **kwargs: Any,
+    ) -> AsyncIterator[str]:
+        """
+        Generate a completion and yield it token by token.
+
+        The generation runs ahead of the consumer by at most `STREAM_BUFFER_TOKENS` tokens. Leaving the `async for`
+        loop early or cancelling the consuming task stops the generation.
+
+        Args:
+            prompt: The prompt for the model to complete.
+            callback: Called on the executor thread with each token, as in `GPT4All.generate`.
+            kwargs: Remaining keyword arguments are passed to `GPT4All.generate`.
+        """
+        loop = asyncio.get_running_loop()
+        tokens: asyncio.Queue[Any] = asyncio.Queue()
+        credits = threading.Semaphore(STREAM_BUFFER_TOKENS)
+        cancelled = threading.Event()
+
+        def _callback(token_id: int, response: str) -> bool:
+            if cancelled.is_set() or not callback(token_id, response):
+                return False
+            while not credits.acquire(timeout=_POLL_INTERVAL):
+                if cancelled.is_set():
+                    return False
+            loop.call_soon_threadsafe(tokens.put_nowait, response)
+            return True
+
+        def _generate() -> None:
+            if not cancelled.is_set():
+                self.model.generate(prompt, callback=_callback, **kwargs)
+
+        future = loop.run_in_executor(self._executor, _generate)
+        future.add_done_callback(lambda _: tokens.put_nowait(_END))
+        try:
+            while True:
+                token = await tokens.get()
+                if token is _END:
+                    break
+                credits.release()
+                yield token
+            await future
+        finally:
+            if not future.done():
+                cancelled.set()
+                await _settle(future)
+
+
+class AsyncEmbed4All(_AsyncModel):
+    """
+    asyncio interface to an `Embed4All` model.
+
+    Cancelling a task awaiting `embed` cancels the embedding at the next batch.
+    """
+
+    def __init__(self, embedder: Embed4All, *, executor: Executor | None = None):
+        """
+        Constructor
+
+        Args:
+            embedder: The embedding model to run.
+            executor: See `AsyncGPT4All`.
+        """
+        super().__init__(executor)
+        self.embedder = embedder
+
+    @classmethod
+    async def load(
+        cls, model_name: str | None = None, *, executor: Executor | None = None, **kwargs: Any,
+    ) -> AsyncEmbed4All:
+        """Load an embedding model without blocking the event loop. See `Embed4All` for kwargs."""
+        embedder, model_executor = await _load(partial(Embed4All, model_name, **kwargs), executor)
+        self = cls(embedder, executor=model_executor)
+        self._owns_executor = executor is None
+        return self
+
+    def _close(self) -> None:
+        self.embedder.close()
+
+    async def embed(self, text: str | list[str], *, cancel_cb: EmbCancelCallbackType | None = None,
+                    **kwargs: Any) -> Any:
+        """
+        Generate one or more embeddings without blocking the event loop.
+
+        Args:
+            text: A text or list of texts to generate embeddings for.
+            cancel_cb: Called on the executor thread as in `Embed4All.embed`; return true to cancel.
+            kwargs: Remaining keyword arguments are passed to `Embed4All.embed`.
+
+        Raises:
+            CancellationError: If cancel_cb returned True and embedding was canceled.
+        """
+        def _embed(cancelled: threading.Event) -> Any:
+            def _cancel_cb(batch_sizes: list[int], backend: str) -> bool:
+                return cancelled.is_set() or (cancel_cb is not None and cancel_cb(batch_sizes, backend))
+
+            try:
+                return self.embedder.embed(text, cancel_cb=_cancel_cb, **kwargs)
+            except CancellationError:
+                if cancelled.is_set():
+                    raise _Cancelled from None
+                raise
+
+        return await self._run(_embed)
@@ -0,0 +1,73 @@
+"""
+Streaming embedding of large corpora in length-bucketed micro-batches.
+"""
+from __future__ import annotations
+
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator
+
+# Texts read ahead of the output. Bounds memory use however long the corpus is.
+CORPUS_WINDOW = 1024
+# Most texts sent to the backend in one call.
+CORPUS_BATCH_TEXTS = 64
+# Rough characters per token, for sizing batches without tokenizing.
+_CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """A cheap estimate of the tokens a text occupies, including BOS and EOS."""
+    return len(text) // _CHARS_PER_TOKEN + 2
+
+
+def plan_batches(lengths: list[int], max_tokens: int, max_texts: int = CORPUS_BATCH_TEXTS) -> list[list[int]]:
+    """
+    Group positions into micro-batches of texts of similar length.
+
+    A batch holds at most max_texts texts and, unless it is a single long text, at most max_tokens estimated
+    tokens. Batches come out ordered by their first position, so that results can be released in input order as
+    early as possible.
+    """
+    batches: list[list[int]] = []
+    batch: list[int] = []
+    tokens = 0
+    for i in sorted(range(len(lengths)), key=lengths.__getitem__):
+        if batch and (len(batch) >= max_texts or tokens + lengths[i] > max_tokens):
+            batches.append(batch)
+            batch, tokens = [], 0
+        batch.append(i)
+        tokens += lengths[i]
+    if batch:
+        batches.append(batch)
+    batches.sort(key=min)
+    return batches
+
+
+def embed_corpus(
+    embed_batch: Callable[[list[str]], Iterable[Any]],
+    texts: Iterable[str],
+    max_tokens: int,
+    max_texts: int = CORPUS_BATCH_TEXTS,
+    window: int = CORPUS_WINDOW,
+) -> Iterator[Any]:
+    """
+    Embed an iterable of texts and yield one vector per text, in input order.
+
+    Texts are read `window` at a time and sorted into micro-batches by `plan_batches`; each batch goes to
+    `embed_batch`, which returns its vectors in order. A vector is yielded as soon as it and all vectors before it
+    are ready, and only the current window is held in memory.
+    """
+    if window < 1:
+        raise ValueError(f"window must be positive, got {window}")
+    it = iter(texts)
+    while chunk := list(islice(it, window)):
+        results: list[Any] = [None] * len(chunk)
+        ready = [False] * len(chunk)
+        next_out = 0
+        for batch in plan_batches([estimate_tokens(t) for t in chunk], max_tokens, max_texts):
+            for i, vector in zip(batch, embed_batch([chunk[i] for i in batch])):
+                results[i] = vector
+                ready[i] = True
+            while next_out < len(chunk) and ready[next_out]:
+                vector, results[next_out] = results[next_out], None
+                next_out += 1
+                yield vector
@@ -0,0 +1,272 @@
+"""
+Segmented, resumable model downloads over parallel HTTP range requests.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable
+
+import requests
+
+DOWNLOAD_CONNECTIONS = 4
+SEGMENT_SIZE = 16 * 2**20
+BLOCK_SIZE = 2**20
+SEGMENT_RETRIES = 3
+# Files smaller than this are not worth more than one connection.
+MIN_SEGMENTED_SIZE = 2 * SEGMENT_SIZE
+DOWNLOAD_TIMEOUT = 30
+
+_STATE_VERSION = 1
+
+
+def probe_ranges(url: str) -> int | None:
+    """Return the size of the resource at url if the server answers range requests, else None."""
+    headers = {"Range": "bytes=0-0", "Accept-Encoding": "identity"}
+    with requests.get(url, stream=True, headers=headers, timeout=DOWNLOAD_TIMEOUT) as response:
+        content_range = response.headers.get("Content-Range", "")
+        if response.status_code != 206 or not content_range.startswith("bytes 0-0/"):
+            return None
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+
+
+def _preallocate(f: Any, size: int) -> None:
+    f.truncate(size)
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+        except OSError:
+            pass  # e.g. unsupported by the file system; the truncated file still works
+
+
+class SegmentedDownload:
+    """
+    Downloads a file in fixed-size segments over several connections into a preallocated `.part` file.
+
+    Completed segments are recorded in a JSON state file next to the `.part` file, so an interrupted download
+    resumes with the segments that are still missing. The MD5 is computed while downloading: blocks are hashed in
+    file order as the contiguous frontier of received bytes advances, and blocks received ahead of the frontier
+    wait in memory. Workers do not start a segment more than `window` bytes ahead of the frontier, which bounds
+    that memory. Only segments completed by an earlier, interrupted run are read back from disk.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        partial_path: str | os.PathLike[str],
+        size: int,
+        connections: int = DOWNLOAD_CONNECTIONS,
+        segment_size: int = SEGMENT_SIZE,
+        compute_md5: bool = True,
+    ):
+        self.url = url
+        self.partial_path = Path(partial_path)
+        self.state_path = self.partial_path.with_name(self.partial_path.name + ".json")
+        self.size = size
+        self.connections = max(1, connections)
+        self.segment_size = segment_size
+        self.window = 2 * self.connections * segment_size
+        self.n_segments = (size + segment_size - 1) // segment_size
+        self._md5 = hashlib.md5() if compute_md5 else None
+        self._lock = threading.Lock()
+        self._frontier_moved = threading.Condition(self._lock)
+        self._frontier = 0
+        self._pending: dict[int, bytes] = {}
+        self._done: set[int] = set()
+        self._next_segment = 0
+        self._failed: BaseException | None = None
+
+    # ------------------------------------------------------------------
+    # Resume state
+    # ------------------------------------------------------------------
+    def _state(self) -> dict[str, Any]:
+        return {"version": _STATE_VERSION, "url": self.url, "size": self.size, "segment_size": self.segment_size}
+
+    def _load_state(self) -> set[int]:
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+            if not self.partial_path.exists() or self.partial_path.stat().st_size != self.size:
+                return set()
+        except (OSError, ValueError):
+            return set()
+        if {k: state.get(k) for k in self._state()} != self._state():
+            return set()
+        return {int(i) for i in state.get("done", []) if 0 <= int(i) < self.n_segments}
+
+    def _save_state(self) -> None:
+        # called with self._lock held
+        tmp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(dict(self._state(), done=sorted(self._done)), f)
+        os.replace(tmp_path, self.state_path)
+
+    def remove_state(self) -> None:
+        try:
+            os.remove(self.state_path)
+        except OSError:
+            pass
+
+    # ------------------------------------------------------------------
+    # Hashing frontier
+    # ------------------------------------------------------------------
+    def _segment_range(self, index: int) -> tuple[int, int]:
+        start = index * self.segment_size
+        return start, min(self.size, start + self.segment_size)
+
+    def _advance(self, reader: Any) -> None:
+        # called with self._lock held
+        moved = False
+        while self._frontier < self.size:
+            data = self._pending.pop(self._frontier, None)
+            if data is None:
+                index = self._frontier // self.segment_size
+                start, end = self._segment_range(index)
+                if index not in self._done or self._frontier != start:
+                    break
+                # completed by an earlier run: the only bytes read back from disk
+                reader.seek(start)
+                data = reader.read(end - start)
+            if self._md5 is not None:
+                self._md5.update(data)
+            self._frontier += len(data)
+            moved = True
+        if moved:
+            self._frontier_moved.notify_all()
+
+    def _deliver(self, offset: int, data: bytes, reader: Any) -> None:
+        with self._lock:
+            if offset + len(data) <= self._frontier:
+                return
+            if offset < self._frontier:
+                data = data[self._frontier - offset:]
+                offset = self._frontier
+            self._pending[offset] = data
+            if offset == self._frontier:
+                self._advance(reader)
+
+    # ------------------------------------------------------------------
+    # Workers
+    # ------------------------------------------------------------------
+    def _claim_segment(self) -> int | None:
+        with self._lock:
+            while True:
+                if self._failed is not None:
+                    return None
+                while self._next_segment < self.n_segments and self._next_segment in self._done:
+                    self._next_segment += 1
+                if self._next_segment >= self.n_segments:
+                    return None
+                start, _ = self._segment_range(self._next_segment)
+                if start - self._frontier <= self.window:
+                    index = self._next_segment
+                    self._next_segment += 1
+                    return index
+                self._frontier_moved.wait(1.0)
+
+    def _fetch_segment(self, index: int, writer: Any, reader: Any, on_bytes: Callable[[int], None]) -> None:
+        start, end = self._segment_range(index)
+        headers = {"Range": f"bytes={start}-{end - 1}", "Accept-Encoding": "identity"}
+        with requests.get(self.url, stream=True, headers=headers, timeout=DOWNLOAD_TIMEOUT) as response:
+            if response.status_code != 206 or not response.headers.get("Content-Range", "").startswith(
+                f"bytes {start}-{end - 1}/"
+            ):
+                raise ValueError(f"Range request failed: HTTP {response.status_code} {response.reason}")
+            offset = start
+            for data in response.iter_content(BLOCK_SIZE):
+                if self._failed is not None:
+                    raise RuntimeError("Download aborted")
+                if offset + len(data) > end:
+                    raise ValueError("Server sent more data than requested")
+                writer.seek(offset)
+                writer.write(data)
+                self._deliver(offset, data, reader)
+                offset += len(data)
+                on_bytes(len(data))
+        if offset != end:
+            raise ValueError(f"Segment {index} ended early at byte {offset} of {end}")
+        writer.flush()
+
+    def _worker(self, on_bytes: Callable[[int], None]) -> None:
+        with open(self.partial_path, "r+b") as writer, open(self.partial_path, "rb") as reader:
+            while (index := self._claim_segment()) is not None:
+                start, end = self._segment_range(index)
+                for attempt in range(SEGMENT_RETRIES + 1):
+                    received = 0
+
+                    def _count(n: int) -> None:
+                        nonlocal received
+                        received += n
+                        on_bytes(n)
+
+                    try:
+                        self._fetch_segment(index, writer, reader, _count)
+                        break
+                    except (requests.RequestException, ValueError) as e:
+                        on_bytes(-received)
+                        with self._lock:
+                            # drop blocks of the failed attempt that are still waiting for the frontier
+                            for offset in [o for o in self._pending if start <= o < end]:
+                                del self._pending[offset]
+                        if attempt == SEGMENT_RETRIES or self._failed is not None:
+                            raise RuntimeError(f"Downloading bytes {start}-{end - 1} failed: {e}") from e
+                with self._lock:
+                    self._done.add(index)
+                    self._save_state()
+                    self._advance(reader)
+
+    def run(self, on_bytes: Callable[[int], None] = lambda n: None) -> str | None:
+        """Download all missing segments; return the MD5 hex digest (if computed) of the whole file."""
+        self._done = self._load_state()
+        if not self._done:
+            with open(self.partial_path, "wb") as f:
+                _preallocate(f, self.size)
+            with self._lock:
+                self._save_state()
+        else:
+            on_bytes(sum(e - s for s, e in map(self._segment_range, self._done)))
+            # hash the prefix completed by the earlier run, so the frontier starts at the first missing segment
+            with open(self.partial_path, "rb") as reader, self._lock:
+                self._advance(reader)
+
+        lock = threading.Lock()
+
+        def _on_bytes(n: int) -> None:
+            with lock:
+                on_bytes(n)
+
+        def _run_worker() -> None:
+            try:
+                self._worker(_on_bytes)
+            except BaseException as e:
+                with self._lock:
+                    if self._failed is None:
+                        self._failed = e
+                    self._frontier_moved.notify_all()
+                raise
+
+        workers = max(1, min(self.connections, self.n_segments - len(self._done)))
+        with ThreadPoolExecutor(workers, thread_name_prefix="gpt4all-download") as pool:
+            futures = [pool.submit(_run_worker) for _ in range(workers)]
+            try:
+                for future in futures:
+                    future.exception()
+            except BaseException as e:  # e.g. KeyboardInterrupt: stop the workers, keep the resume state
+                with self._lock:
+                    if self._failed is None:
+                        self._failed = e
+                    self._frontier_moved.notify_all()
+                raise
+        if self._failed is not None:
+            raise self._failed
+
+        with open(self.partial_path, "rb") as reader, self._lock:
+            self._advance(reader)
+        if self._frontier != self.size:
+            raise RuntimeError(f"Download incomplete: {self._frontier} of {self.size} bytes")
+        return self._md5.hexdigest() if self._md5 is not None else None
@@ -0,0 +1,340 @@
+"""
+Content-addressed on-disk cache of embedding vectors.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; vectors are then returned as lists
+    np = None
+
+if TYPE_CHECKING:
+    from ._pyllmodel import EmbCancelCallbackType, EmbedResult, LLModel
+
+EMBEDDING_CACHE_MAX_BYTES = 256 * 2**20
+# Eviction shrinks the cache to this fraction of its cap, so that it does not run again on the next insert.
+EMBEDDING_CACHE_EVICT_TO = 0.75
+
+_FORMAT_VERSION = 1
+_KEY_SIZE = 16
+_RECORD = struct.Struct(f"<{_KEY_SIZE}sI")  # key, row
+_FLOAT_SIZE = 4
+_HASH_CHUNK = 2**20
+
+
+def embedding_key(model_hash: str, prefix: str | None, dimensionality: int, long_text_mode: str, text: str) -> bytes:
+    """The content address of one embedding: everything that determines the vector."""
+    h = hashlib.blake2b(digest_size=_KEY_SIZE)
+    for part in (model_hash, repr(prefix), str(dimensionality), long_text_mode):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    h.update(text.encode("utf-8"))
+    return h.digest()
+
+
+class _Matrix:
+    """
+    The vectors of one width: an append-only float32 file and an append-only index of (key, row) records.
+
+    Vectors are written before their index records, so a torn write leaves at most unindexed rows, which the next
+    eviction drops.
+    """
+
+    def __init__(self, directory: Path, dim: int):
+        self.dim = dim
+        self.row_bytes = dim * _FLOAT_SIZE
+        self.vectors_path = directory / f"vectors-{dim}.f32"
+        self.index_path = directory / f"index-{dim}.bin"
+        self.rows: dict[bytes, int] = {}
+        self.n_rows = 0
+        self._map: mmap.mmap | None = None
+        self._mapped_rows = 0
+        self.load()
+
+    def load(self) -> None:
+        self.unmap()
+        try:
+            size = self.vectors_path.stat().st_size
+        except FileNotFoundError:
+            size = 0
+        self.n_rows = size // self.row_bytes
+        if size != self.n_rows * self.row_bytes:
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(self.n_rows * self.row_bytes)  # partial row from an interrupted append
+        try:
+            data = self.index_path.read_bytes()
+        except FileNotFoundError:
+            data = b""
+        data = data[:len(data) - len(data) % _RECORD.size]
+        self.rows = {key: row for key, row in _RECORD.iter_unpack(data) if row < self.n_rows}
+
+    def unmap(self) -> None:
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass  # a caller still holds a view; the map is closed once it is released
+            self._map = None
+            self._mapped_rows = 0
+
+    def _view(self) -> mmap.mmap:
+        if self._map is None or self._mapped_rows < self.n_rows:
+            self.unmap()
+            with open(self.vectors_path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), self.n_rows * self.row_bytes, access=mmap.ACCESS_READ)
+            self._mapped_rows = self.n_rows
+        return self._map
+
+    def read(self, rows: list[int], as_array: bool) -> list[Any]:
+        view = self._view()
+        if np is not None:
+            matrix = np.frombuffer(view, dtype=np.float32, count=self._mapped_rows * self.dim).reshape(-1, self.dim)
+            block = matrix[rows]  # one gather, a copy
+            del matrix
+            return list(block) if as_array else block.tolist()
+        floats = memoryview(view).cast("f")
+        try:
+            return [floats[r * self.dim:(r + 1) * self.dim].tolist() for r in rows]
+        finally:
+            floats.release()
+
+    def append(self, keys: list[bytes], vectors: Sequence[Any]) -> None:
+        if np is not None:
+            data = np.asarray(vectors, dtype=np.float32).reshape(len(keys), self.dim).tobytes()
+        else:
+            data = array("f", [x for v in vectors for x in v]).tobytes()
+        try:
+            on_disk = self.vectors_path.stat().st_size
+        except FileNotFoundError:
+            on_disk = 0
+        if on_disk != self.n_rows * self.row_bytes:
+            self.load()  # another process appended since we read the index
+        with open(self.vectors_path, "ab") as f:
+            f.write(data)
+        with open(self.index_path, "ab") as f:
+            f.write(b"".join(_RECORD.pack(key, self.n_rows + i) for i, key in enumerate(keys)))
+        for i, key in enumerate(keys):
+            self.rows[key] = self.n_rows + i
+        self.n_rows += len(keys)
+
+    def rewrite(self, keys: list[bytes]) -> None:
+        """Keep only the given keys, in the given order."""
+        kept = [(key, self.rows[key]) for key in keys]
+        vectors = self.read([row for _, row in kept], as_array=False) if kept else []
+        self.unmap()  # the files are replaced below, which Windows refuses while they are mapped
+        tmp_vectors = self.vectors_path.with_name(self.vectors_path.name + ".tmp")
+        tmp_index = self.index_path.with_name(self.index_path.name + ".tmp")
+        with open(tmp_vectors, "wb") as f:
+            f.write(array("f", [x for v in vectors for x in v]).tobytes())
+        with open(tmp_index, "wb") as f:
+            f.write(b"".join(_RECORD.pack(key, row) for row, (key, _) in enumerate(kept)))
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_index, self.index_path)
+        self.rows = {key: row for row, (key, _) in enumerate(kept)}
+        self.n_rows = len(kept)
+
+
+class EmbeddingCache:
+    """
+    Embedding vectors on disk, addressed by a hash of the model file, prefix, dimensionality, long text mode and
+    text.
+
+    Vectors of each width live in an append-only float32 matrix that is memory-mapped for lookups, next to a compact
+    index of 20-byte (key, row) records. Lookups are done in bulk, and only the texts that miss are sent to the model.
+    When the matrices grow past `max_bytes`, the least recently used vectors are evicted: by use in this process,
+    then by insertion order.
+
+    One process should write to a cache directory at a time; concurrent appends are detected but not serialized.
+    """
+
+    def __init__(self, directory: str | os.PathLike[str], max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._matrices: dict[int, _Matrix] = {}
+        for path in self.directory.glob("vectors-*.f32"):
+            dim = path.stem.split("-", 1)[1]
+            if dim.isdigit() and int(dim) > 0:
+                self._matrices[int(dim)] = _Matrix(self.directory, int(dim))
+        self._used: dict[bytes, int] = {}
+        self._clock = 0
+        self._manifest_path = self.directory / "manifest.json"
+        self._model_hashes: dict[str, Any] = self._read_manifest()
+
+    # ------------------------------------------------------------------
+    # Model identity
+    # ------------------------------------------------------------------
+    def _read_manifest(self) -> dict[str, Any]:
+        try:
+            with open(self._manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(manifest, dict) or manifest.get("format") != _FORMAT_VERSION:
+            return {}
+        hashes = manifest.get("model_hashes")
+        return hashes if isinstance(hashes, dict) else {}
+
+    def _write_manifest(self) -> None:
+        tmp_path = self._manifest_path.with_name(f"{self._manifest_path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"format": _FORMAT_VERSION, "model_hashes": self._model_hashes}, f)
+            os.replace(tmp_path, self._manifest_path)
+        except OSError as e:
+            print(f"Could not write the embedding cache manifest: {e}", file=sys.stderr)
+
+    def model_hash(self, model_path: str | os.PathLike[str]) -> str:
+        """SHA-256 of the model file, remembered per path, size and mtime so the file is read once."""
+        path = os.path.abspath(model_path)
+        stat = os.stat(path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        with self._lock:
+            known = self._model_hashes.get(path)
+            if isinstance(known, dict) and known.get("stamp") == stamp:
+                return known["sha256"]
+            h = hashlib.sha256()
+            with open(path, "rb") as f:
+                while chunk := f.read(_HASH_CHUNK):
+                    h.update(chunk)
+            self._model_hashes[path] = {"stamp": stamp, "sha256": h.hexdigest()}
+            self._write_manifest()
+            return h.hexdigest()
+
+    # ------------------------------------------------------------------
+    # Lookup and insertion
+    # ------------------------------------------------------------------
+    def __len__(self) -> int:
+        return sum(len(m.rows) for m in self._matrices.values())
+
+    @property
+    def size(self) -> int:
+        """Bytes of vector data on disk."""
+        return sum(m.n_rows * m.row_bytes for m in self._matrices.values())
+
+    def get_many(self, keys: Sequence[bytes], as_array: bool = False) -> tuple[list[Any], list[int]]:
+        """
+        Look up many keys at once.
+
+        Returns:
+            The vectors in key order, with None for misses (float32 NumPy rows with as_array=True, else lists), and
+            the positions of the misses.
+        """
+        vectors: list[Any] = [None] * len(keys)
+        with self._lock:
+            for matrix in self._matrices.values():
+                found = [(i, matrix.rows[k]) for i, k in enumerate(keys) if vectors[i] is None and k in matrix.rows]
+                if not found:
+                    continue
+                for (i, _), vector in zip(found, matrix.read([row for _, row in found], as_array)):
+                    vectors[i] = vector
+                    self._touch(keys[i])
+        return vectors, [i for i, v in enumerate(vectors) if v is None]
+
+    def put_many(self, keys: Sequence[bytes], vectors: Sequence[Any]) -> None:
+        """Store vectors (all of the same width) under their keys, then evict if the cache is over its cap."""
+        if not keys:
+            return
+        dim = len(vectors[0])
+        with self._lock:
+            new: dict[bytes, Any] = {}
+            for key, vector in zip(keys, vectors):
+                if key not in new and not any(key in m.rows for m in self._matrices.values()):
+                    new[key] = vector
+            if not new:
+                return
+            matrix = self._matrices.get(dim)
+            if matrix is None:
+                matrix = self._matrices[dim] = _Matrix(self.directory, dim)
+            matrix.append(list(new), list(new.values()))
+            for key in new:
+                self._touch(key)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _touch(self, key: bytes) -> None:
+        self._clock += 1
+        self._used[key] = self._clock
+
+    def _evict(self) -> None:
+        budget = int(self.max_bytes * EMBEDDING_CACHE_EVICT_TO)
+        # most recently used first; untouched entries by insertion order, newest first
+        entries = sorted(
+            ((self._used.get(key, 0), row, key, matrix) for matrix in self._matrices.values()
+             for key, row in matrix.rows.items()),
+            key=lambda e: (e[0], e[1]), reverse=True,
+        )
+        keep: dict[int, list[bytes]] = {dim: [] for dim in self._matrices}
+        used = 0
+        for _, _, key, matrix in entries:
+            if used + matrix.row_bytes > budget:
+                break
+            keep[matrix.dim].append(key)
+            used += matrix.row_bytes
+        for dim, keys in keep.items():
+            # oldest first, so that insertion order stays the recency order for the next process
+            self._matrices[dim].rewrite(keys[::-1])
+        self._used = {key: t for key, t in self._used.items() if any(key in m.rows for m in self._matrices.values())}
+
+    # ------------------------------------------------------------------
+    # Embedding
+    # ------------------------------------------------------------------
+    def embed(
+        self, model: LLModel, model_path: str | os.PathLike[str], text: str | list[str], prefix: str | None,
+        dimensionality: int, long_text_mode: str, do_mean: bool, atlas: bool, cancel_cb: EmbCancelCallbackType | None,
+        as_array: bool = False,
+    ) -> EmbedResult[Any]:
+        """
+        Embed like `LLModel.generate_embeddings`, sending only the texts not in the cache to the model.
+
+        n_prompt_tokens counts the tokens of those texts only.
+        """
+        if not text:
+            raise ValueError("text must not be None or empty")
+        if as_array and np is None:
+            raise ImportError("as_array=True requires numpy")
+        texts = [text] if isinstance(text, str) else text
+        model_hash = self.model_hash(model_path)
+        keys = [embedding_key(model_hash, prefix, dimensionality, long_text_mode, t) for t in texts]
+        vectors, missing = self.get_many(keys, as_array=as_array)
+
+        n_prompt_tokens = 0
+        if missing:
+            # each distinct text is embedded once
+            first: dict[bytes, int] = {}
+            for i in missing:
+                first.setdefault(keys[i], i)
+            result = model.generate_embeddings(
+                [texts[i] for i in first.values()], prefix, dimensionality, do_mean, atlas, cancel_cb,
+                as_array=as_array,
+            )
+            computed = dict(zip(first, result["embeddings"]))
+            n_prompt_tokens = result["n_prompt_tokens"]
+            self.put_many(list(computed), list(computed.values()))
+            for i in missing:
+                vectors[i] = computed[keys[i]]
+
+        if isinstance(text, str):
+            embeddings: Any = vectors[0]
+        elif as_array:
+            embeddings = np.stack(vectors).astype(np.float32, copy=False)
+        else:
+            embeddings = vectors
+        return {"embeddings": embeddings, "n_prompt_tokens": n_prompt_tokens}
+
+    def close(self) -> None:
+        with self._lock:
+            for matrix in self._matrices.values():
+                matrix.unmap()
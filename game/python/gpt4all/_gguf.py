@@ -0,0 +1,250 @@
+"""
+Read GGUF metadata and tensor descriptions without loading the model.
+"""
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+from typing import Any, NamedTuple
+
+GGUF_MAGIC = b"GGUF"
+GGUF_DEFAULT_ALIGNMENT = 32
+# Arrays longer than this (e.g. the tokenizer vocabulary) are skipped instead of decoded; see `GGUFArray`.
+MAX_ARRAY_LENGTH = 1024
+
+# value types
+_UINT8, _INT8, _UINT16, _INT16, _UINT32, _INT32, _FLOAT32, _BOOL, _STRING, _ARRAY, _UINT64, _INT64, _FLOAT64 = range(13)
+
+_SCALARS: dict[int, struct.Struct] = {
+    _UINT8: struct.Struct("<B"),
+    _INT8: struct.Struct("<b"),
+    _UINT16: struct.Struct("<H"),
+    _INT16: struct.Struct("<h"),
+    _UINT32: struct.Struct("<I"),
+    _INT32: struct.Struct("<i"),
+    _FLOAT32: struct.Struct("<f"),
+    _BOOL: struct.Struct("<?"),
+    _UINT64: struct.Struct("<Q"),
+    _INT64: struct.Struct("<q"),
+    _FLOAT64: struct.Struct("<d"),
+}
+_U32 = _SCALARS[_UINT32]
+_U64 = _SCALARS[_UINT64]
+
+# chat formats recognized by `GGUFInfo.chat_format`, by a marker token of their chat template
+_CHAT_FORMATS = (("llama3", "<|start_header_id|>"), ("chatml", "<|im_start|>"))
+
+
+class GGUFArray(NamedTuple):
+    """Stand-in for an array value longer than `max_array_length`: its element type and length only."""
+    item_type: int
+    length: int
+
+
+class GGUFTensor(NamedTuple):
+    name: str
+    shape: tuple[int, ...]
+    ggml_type: int
+    offset: int  # from the start of the file
+
+
+class GGUFInfo:
+    """
+    The header of a GGUF file: its key-value metadata and tensor descriptions.
+
+    Attributes:
+        path: The file that was read.
+        version: GGUF format version.
+        metadata: Metadata values by key; large arrays are `GGUFArray` placeholders.
+        tensors: Tensor descriptions in file order.
+        data_offset: Offset of the tensor data, i.e. the size of the header including padding.
+        file_size: Size of the file in bytes.
+    """
+
+    def __init__(
+        self, path: str, version: int, metadata: dict[str, Any], tensors: list[GGUFTensor], data_offset: int,
+        file_size: int,
+    ):
+        self.path = path
+        self.version = version
+        self.metadata = metadata
+        self.tensors = tensors
+        self.data_offset = data_offset
+        self.file_size = file_size
+
+    def __repr__(self) -> str:
+        return (f"GGUFInfo(path={self.path!r}, architecture={self.architecture!r}, "
+                f"context_length={self.context_length!r}, tensors={len(self.tensors)})")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.metadata.get(key, default)
+
+    def arch_get(self, key: str, default: Any = None) -> Any:
+        """Look up an architecture-specific key, e.g. `arch_get("context_length")` for `llama.context_length`."""
+        return self.metadata.get(f"{self.architecture}.{key}", default)
+
+    @property
+    def architecture(self) -> str | None:
+        return self.metadata.get("general.architecture")
+
+    @property
+    def name(self) -> str | None:
+        return self.metadata.get("general.name")
+
+    @property
+    def context_length(self) -> int | None:
+        """The context length the model was trained with."""
+        value = self.arch_get("context_length")
+        return int(value) if value is not None else None
+
+    @property
+    def chat_template(self) -> str | None:
+        """The Jinja chat template embedded in the model, if any."""
+        return self.metadata.get("tokenizer.chat_template")
+
+    @property
+    def chat_format(self) -> str | None:
+        """The family of the embedded chat template ("llama3" or "chatml"), or None if unknown."""
+        template = self.chat_template or ""
+        for chat_format, marker in _CHAT_FORMATS:
+            if marker in template:
+                return chat_format
+        return None
+
+    @property
+    def weights_size(self) -> int:
+        """Bytes of tensor data, i.e. the memory the weights occupy once loaded."""
+        return max(0, self.file_size - self.data_offset)
+
+    def kv_cache_size(self, n_ctx: int, bytes_per_value: int = 2) -> int | None:
+        """
+        Estimate the bytes of KV cache a context of n_ctx tokens needs (f16 by default).
+
+        Returns None if the architecture does not describe its attention layout.
+        """
+        n_layer = self.arch_get("block_count")
+        n_embd = self.arch_get("embedding_length")
+        n_head = self.arch_get("attention.head_count")
+        if not (n_layer and n_embd and n_head):
+            return None
+        n_head_kv = self.arch_get("attention.head_count_kv", n_head)
+        if isinstance(n_head, (GGUFArray, list)) or isinstance(n_head_kv, (GGUFArray, list)):
+            return None  # per-layer head counts
+        head_dim = n_embd // n_head
+        key_dim = self.arch_get("attention.key_length", head_dim)
+        value_dim = self.arch_get("attention.value_length", head_dim)
+        return n_layer * n_ctx * n_head_kv * (key_dim + value_dim) * bytes_per_value
+
+    def memory_estimate(self, n_ctx: int) -> int:
+        """Rough bytes of memory the model needs with a context of n_ctx tokens: weights plus KV cache."""
+        return self.weights_size + (self.kv_cache_size(n_ctx) or 0)
+
+
+class _Reader:
+    __slots__ = ("buf", "pos")
+
+    def __init__(self, buf: Any):
+        self.buf = buf
+        self.pos = 0
+
+    def scalar(self, fmt: struct.Struct) -> Any:
+        value, = fmt.unpack_from(self.buf, self.pos)
+        self.pos += fmt.size
+        return value
+
+    def string(self) -> str:
+        n = self.scalar(_U64)
+        end = self.pos + n
+        if end > len(self.buf):
+            raise ValueError("GGUF string runs past the end of the file")
+        value = bytes(self.buf[self.pos:end]).decode("utf-8", errors="replace")
+        self.pos = end
+        return value
+
+    def value(self, vtype: int, max_array_length: int) -> Any:
+        if (fmt := _SCALARS.get(vtype)) is not None:
+            return self.scalar(fmt)
+        if vtype == _STRING:
+            return self.string()
+        if vtype != _ARRAY:
+            raise ValueError(f"Unknown GGUF value type {vtype}")
+        item_type = self.scalar(_U32)
+        length = self.scalar(_U64)
+        if length > max_array_length:
+            self.skip_array(item_type, length)
+            return GGUFArray(item_type, length)
+        if (fmt := _SCALARS.get(item_type)) is not None:
+            values = list(struct.unpack_from(f"<{length}{fmt.format[1:]}", self.buf, self.pos))
+            self.pos += length * fmt.size
+            return values
+        return [self.value(item_type, max_array_length) for _ in range(length)]
+
+    def skip_array(self, item_type: int, length: int) -> None:
+        if (fmt := _SCALARS.get(item_type)) is not None:
+            self.pos += length * fmt.size
+        elif item_type == _STRING:
+            # hot loop for vocabularies of 100k+ tokens
+            unpack_from, buf, pos = _U64.unpack_from, self.buf, self.pos
+            for _ in range(length):
+                pos += 8 + unpack_from(buf, pos)[0]
+            self.pos = pos
+        else:
+            for _ in range(length):
+                self.value(item_type, 0)
+
+
+def read_gguf(path: str | os.PathLike[str], max_array_length: int = MAX_ARRAY_LENGTH) -> GGUFInfo:
+    """
+    Read the metadata and tensor descriptions of a GGUF file.
+
+    The file is memory-mapped and only its header pages are touched, so this takes milliseconds even for
+    multi-gigabyte models. Arrays longer than `max_array_length` (typically the tokenizer vocabulary and merges)
+    are skipped and appear as `GGUFArray` placeholders.
+
+    Raises:
+        ValueError: If the file is not a GGUF file or its header is truncated or malformed.
+    """
+    path = os.fspath(path)
+    with open(path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        if file_size < 24:
+            raise ValueError(f"Not a GGUF file: {path!r}")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            try:
+                return _parse(path, buf, file_size, max_array_length)
+            except struct.error as e:
+                raise ValueError(f"Truncated GGUF header in {path!r}") from e
+
+
+def _parse(path: str, buf: Any, file_size: int, max_array_length: int) -> GGUFInfo:
+    if buf[:4] != GGUF_MAGIC:
+        raise ValueError(f"Not a GGUF file: {path!r}")
+    r = _Reader(buf)
+    r.pos = 4
+    version = r.scalar(_U32)
+    if version & 0xFFFF == 0:
+        raise ValueError(f"Big-endian GGUF files are not supported: {path!r}")
+    if version < 2:
+        raise ValueError(f"Unsupported GGUF version {version}: {path!r}")
+    n_tensors = r.scalar(_U64)
+    n_kv = r.scalar(_U64)
+
+    metadata: dict[str, Any] = {}
+    for _ in range(n_kv):
+        key = r.string()
+        metadata[key] = r.value(r.scalar(_U32), max_array_length)
+
+    raw_tensors = []
+    for _ in range(n_tensors):
+        name = r.string()
+        n_dims = r.scalar(_U32)
+        shape = struct.unpack_from(f"<{n_dims}Q", buf, r.pos)
+        r.pos += 8 * n_dims
+        ggml_type = r.scalar(_U32)
+        raw_tensors.append((name, shape, ggml_type, r.scalar(_U64)))
+
+    alignment = metadata.get("general.alignment", GGUF_DEFAULT_ALIGNMENT) or GGUF_DEFAULT_ALIGNMENT
+    data_offset = -(-r.pos // alignment) * alignment
+    tensors = [GGUFTensor(name, shape, t, data_offset + off) for name, shape, t, off in raw_tensors]
+    return GGUFInfo(path, version, metadata, tensors, data_offset, file_size)
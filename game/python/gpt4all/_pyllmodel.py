@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import codecs
 import ctypes
 import os
 import platform
@@ -9,7 +10,8 @@ import sys
 import textwrap
 import threading
 from enum import Enum
-from queue import Queue
+from functools import partial
+from queue import Empty, Full, Queue
 from typing import TYPE_CHECKING, Any, Callable, Generic, Iterable, Literal, NoReturn, TypeVar, overload
 
 if sys.version_info >= (3, 9):
@@ -23,6 +25,11 @@ if (3, 9) <= sys.version_info < (3, 11):
 else:
     from typing import TypedDict
 
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; only embeddings with as_array=True need it
+    np = None
+
 if TYPE_CHECKING:
     from typing_extensions import TypeAlias
 
@@ -135,6 +142,15 @@ llmodel.llmodel_required_mem.restype = ctypes.c_size_t
 llmodel.llmodel_isModelLoaded.argtypes = [ctypes.c_void_p]
 llmodel.llmodel_isModelLoaded.restype = ctypes.c_bool
 
+llmodel.llmodel_get_state_size.argtypes = [ctypes.c_void_p]
+llmodel.llmodel_get_state_size.restype = ctypes.c_uint64
+
+llmodel.llmodel_save_state_data.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint8)]
+llmodel.llmodel_save_state_data.restype = ctypes.c_uint64
+
+llmodel.llmodel_restore_state_data.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint8)]
+llmodel.llmodel_restore_state_data.restype = ctypes.c_uint64
+
 PromptCallback = ctypes.CFUNCTYPE(ctypes.c_bool, ctypes.c_int32)
 ResponseCallback = ctypes.CFUNCTYPE(ctypes.c_bool, ctypes.c_int32, ctypes.c_char_p)
 EmbCancelCallback = ctypes.CFUNCTYPE(ctypes.c_bool, ctypes.POINTER(ctypes.c_uint), ctypes.c_uint, ctypes.c_char_p)
@@ -200,6 +216,7 @@ llmodel.llmodel_model_backend_name.restype = ctypes.c_char_p
 llmodel.llmodel_model_gpu_device_name.argtypes = [ctypes.c_void_p]
 llmodel.llmodel_model_gpu_device_name.restype = ctypes.c_char_p
 
+PromptCallbackType = Callable[[int], bool]
 ResponseCallbackType = Callable[[int, str], bool]
 RawResponseCallbackType = Callable[[int, bytes], bool]
 EmbCancelCallbackType: TypeAlias = 'Callable[[list[int], str], bool]'
@@ -209,11 +226,234 @@ def empty_response_callback(token_id: int, response: str) -> bool:
     return True
 
 
+def _empty_prompt_callback(token_id: int) -> bool:
+    return True
+
+
+class _ResponsePipeline:
+    """
+    The ctypes trampolines of one model, created once and reused by every prompt.
+
+    Building a CFUNCTYPE object per call costs more than decoding a token, so the response trampoline stays fixed
+    and forwards to whichever handler the current prompt installed. Text is decoded with an incremental UTF-8
+    decoder, which holds back an incomplete multi-byte sequence until the following token completes it.
+    """
+
+    __slots__ = ('handler', 'prompt_handler', '_decode', '_reset', 'c_prompt_callback', 'c_response_callback')
+
+    def __init__(self) -> None:
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._decode = decoder.decode
+        self._reset = decoder.reset
+        self.handler: ResponseCallbackType = empty_response_callback
+        self.prompt_handler: PromptCallbackType = _empty_prompt_callback
+        self.c_prompt_callback = PromptCallback(self._on_prompt)
+        self.c_response_callback = ResponseCallback(self._on_response)
+
+    def start(self, handler: ResponseCallbackType, prompt_handler: PromptCallbackType | None = None) -> None:
+        self._reset()
+        self.handler = handler
+        self.prompt_handler = prompt_handler or _empty_prompt_callback
+
+    def _on_prompt(self, token_id: int) -> bool:
+        return self.prompt_handler(token_id)
+
+    def _on_response(self, token_id: int, response: bytes | None) -> bool:
+        if not response:
+            return self.handler(token_id, '')
+        text = self._decode(response)
+        if not text:
+            return True  # wait for the rest of a multi-byte sequence
+        return self.handler(token_id, text)
+
+
 # Symbol to terminate from generator
 class Sentinel(Enum):
     TERMINATING_SYMBOL = 0
 
 
+# Tokens a streaming generation may run ahead of its consumer before it blocks
+STREAM_BUFFER_TOKENS = 64
+# How often a blocked producer checks whether its stream was aborted, in seconds
+_STREAM_POLL_INTERVAL = 0.05
+
+_STREAM_PENDING, _STREAM_RUNNING, _STREAM_DONE = range(3)
+
+
+class _StreamChannel:
+    """
+    The producer side of a streaming generation, shared between the model's worker thread and a `TokenStream`.
+
+    It deliberately holds no reference to the `TokenStream`, so an abandoned stream can be collected (and its
+    generation aborted) while the worker is still producing into the channel.
+    """
+
+    def __init__(self, callback: ResponseCallbackType, maxsize: int):
+        self.callback = callback
+        self.queue: Queue[str | Sentinel | Exception] = Queue(maxsize)
+        self.aborted = threading.Event()
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+        self._state = _STREAM_PENDING
+        self._thread: threading.Thread | None = None
+
+    def _put(self, item: str | Sentinel | Exception) -> bool:
+        # blocks while the consumer lags behind, which pauses the generation
+        while not self.aborted.is_set():
+            try:
+                self.queue.put(item, timeout=_STREAM_POLL_INTERVAL)
+                return True
+            except Full:
+                pass
+        return False
+
+    def on_token(self, token_id: int, response: str) -> bool:
+        if self.aborted.is_set() or not self.callback(token_id, response):
+            return False
+        return self._put(response)
+
+    def run(self, prompt_fn: Callable[[ResponseCallbackType], None]) -> None:
+        with self._lock:
+            if self._state != _STREAM_PENDING:
+                return
+            self._state = _STREAM_RUNNING
+            self._thread = threading.current_thread()
+        end: Sentinel | Exception = Sentinel.TERMINATING_SYMBOL
+        try:
+            prompt_fn(self.on_token)
+        except Exception as e:
+            end = e
+        self._put(end)
+        with self._lock:
+            self._state = _STREAM_DONE
+        self.done.set()
+
+    def discard(self, end: Sentinel | Exception = Sentinel.TERMINATING_SYMBOL) -> None:
+        """End a stream whose generation has not started and never will."""
+        with self._lock:
+            if self._state != _STREAM_PENDING:
+                return
+            self._state = _STREAM_DONE
+        self.queue.put_nowait(end)
+        self.done.set()
+
+    def abort(self, wait: bool = True) -> None:
+        """Stop the generation at the next token and, if `wait`, until the model is idle again."""
+        self.aborted.set()
+        with self._lock:
+            if self._state == _STREAM_PENDING:
+                self._state = _STREAM_DONE
+                self.done.set()
+                return
+            running_here = self._thread is threading.current_thread()
+        if wait and not running_here:
+            self.done.wait()
+
+
+class TokenStream:
+    """
+    Iterator over the response of a streaming generation.
+
+    Tokens pass through a bounded queue, so a consumer that stops reading also stops the generation once
+    `STREAM_BUFFER_TOKENS` tokens are buffered. `close()` - or leaving a `with` block, or dropping the last
+    reference to the stream - aborts the generation at the next token and returns once the model is idle.
+    """
+
+    def __init__(self, channel: _StreamChannel):
+        self._channel = channel
+        self._finished = False
+
+    def __iter__(self) -> TokenStream:
+        return self
+
+    def __next__(self) -> str:
+        if self._finished:
+            raise StopIteration
+        item = self._channel.queue.get()
+        if isinstance(item, str):
+            return item
+        self._finished = True
+        if isinstance(item, Exception):
+            raise item
+        raise StopIteration
+
+    def __enter__(self) -> TokenStream:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        if hasattr(self, '_channel'):
+            self.close()
+
+    @property
+    def aborted(self) -> bool:
+        return self._channel.aborted.is_set()
+
+    def close(self) -> None:
+        """Abort the generation if it is still running and wait until the model is idle."""
+        self._finished = True
+        if not self._channel.done.is_set():
+            self._channel.abort()
+
+
+class _StreamWorker:
+    """
+    A single long-lived thread that runs the streaming generations of one model in submission order.
+
+    Jobs carry the bound prompt function, so the thread only references the model while a generation is queued or
+    running and an unused model can still be garbage collected.
+    """
+
+    def __init__(self) -> None:
+        self._jobs: Queue[tuple[Callable[[ResponseCallbackType], None], _StreamChannel] | None] = Queue()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._current: _StreamChannel | None = None
+
+    def submit(self, prompt_fn: Callable[[ResponseCallbackType], None], channel: _StreamChannel) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._serve, name='gpt4all-stream', daemon=True)
+                self._thread.start()
+            self._jobs.put((prompt_fn, channel))
+
+    def _serve(self) -> None:
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            prompt_fn, channel = job
+            del job
+            self._current = channel
+            try:
+                channel.run(prompt_fn)
+            finally:
+                self._current = None
+                del prompt_fn, channel
+
+    def stop(self) -> None:
+        """Abort the running generation, end the queued ones and shut the thread down."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            current = self._current
+            if current is not None:
+                current.abort(wait=False)
+            while True:
+                try:
+                    job = self._jobs.get_nowait()
+                except Empty:
+                    break
+                if job is not None:
+                    job[1].discard(ValueError("Attempted operation on a closed LLModel"))
+            self._jobs.put(None)
+        if thread is not threading.current_thread():
+            thread.join()
+
+
 class EmbedResult(Generic[EmbeddingsType], TypedDict):
     embeddings: EmbeddingsType
     n_prompt_tokens: int
@@ -223,6 +463,24 @@ class CancellationError(Exception):
     """raised when embedding is canceled"""
 
 
+class ModelState:
+    """
+    A snapshot of a model's internal state (KV cache, RNG, logits) together with the prompt context needed to
+    continue generating from it.
+
+    `data` may be larger than `size`; only the first `size` bytes are meaningful. This lets callers hand the same
+    buffer back to `LLModel.save_state` to avoid reallocating it.
+    """
+
+    __slots__ = ('data', 'size', 'n_past', 'tokens')
+
+    def __init__(self, data: bytearray, size: int, n_past: int, tokens: list[int]):
+        self.data = data
+        self.size = size
+        self.n_past = n_past
+        self.tokens = tokens
+
+
 class LLModel:
     """
     Base class and universal wrapper for GPT4All language models
@@ -245,8 +503,8 @@ class LLModel:
         self.n_ctx = n_ctx
         self.ngl = ngl
         self.context: LLModelPromptContext | None = None
-        self.buffer = bytearray()
-        self.buff_expecting_cont_bytes: int = 0
+        self._pipeline = _ResponsePipeline()
+        self._stream_worker = _StreamWorker()
 
         # Construct a model implementation
         err = ctypes.c_char_p()
@@ -270,6 +528,8 @@ class LLModel:
             self.close()
 
     def close(self) -> None:
+        if hasattr(self, '_stream_worker'):
+            self._stream_worker.stop()
         if self.model is not None:
             llmodel.llmodel_model_destroy(self.model)
             self.model = None
@@ -397,6 +657,83 @@ class LLModel:
         self.context.repeat_last_n = repeat_last_n
         self.context.context_erase = context_erase
 
+    @property
+    def n_past(self) -> int:
+        """Number of tokens currently held in the model's context (KV cache)."""
+        return 0 if self.context is None else self.context.n_past
+
+    def context_tokens(self) -> list[int]:
+        """The token ids currently in the context window, oldest first."""
+        if self.context is None or not self.context.tokens:
+            return []
+        return self.context.tokens[:self.context.tokens_size]
+
+    def rewind_context(self, n_past: int) -> None:
+        """
+        Discard everything after the first `n_past` tokens of the context.
+
+        The next call to `prompt_model` with `reset_context=False` continues from that point, reusing the KV cache
+        of the tokens that were kept instead of ingesting them again.
+        """
+        if self.context is None:
+            raise ValueError("Cannot rewind a context that was never created")
+        if not 0 <= n_past <= self.context.n_past:
+            raise ValueError(f"Cannot rewind to {n_past} tokens, context holds {self.context.n_past}")
+        self.context.n_past = n_past
+
+    def state_size(self) -> int:
+        """Upper bound, in bytes, of the buffer needed by `save_state`."""
+        if self.model is None:
+            self._raise_closed()
+        return llmodel.llmodel_get_state_size(self.model)
+
+    def save_state(self, buffer: bytearray | None = None) -> ModelState:
+        """
+        Capture the current model state.
+
+        Args:
+            buffer: A buffer to write the state into. It is reused if it is large enough, otherwise a new one is
+                allocated.
+
+        Returns:
+            A ModelState that can be passed to `restore_state`.
+        """
+        if self.model is None:
+            self._raise_closed()
+        needed = self.state_size()
+        if buffer is None or len(buffer) < needed:
+            buffer = bytearray(needed)
+        c_buffer = (ctypes.c_uint8 * len(buffer)).from_buffer(buffer)
+        written = llmodel.llmodel_save_state_data(self.model, c_buffer)
+        del c_buffer  # release the export so the buffer can be resized by the caller
+        n_past = self.n_past
+        return ModelState(buffer, written, n_past, self.context_tokens()[:n_past])
+
+    def restore_state(self, state: ModelState) -> bool:
+        """
+        Restore a state captured by `save_state` on a model loaded from the same file with the same `n_ctx`.
+
+        The C API does not expose the backend's token cache, so the saved token ids are written back into it in
+        place. That is only possible once the cache holds at least `state.n_past` entries, i.e. after this model has
+        processed a prompt of that length; until then nothing is changed and False is returned.
+
+        Returns:
+            True if the state was restored, False if it could not be applied yet.
+        """
+        if self.model is None:
+            self._raise_closed()
+        if self.context is None or self.context.tokens_size < state.n_past:
+            return False
+        c_buffer = (ctypes.c_uint8 * state.size).from_buffer(state.data)
+        read = llmodel.llmodel_restore_state_data(self.model, c_buffer)
+        del c_buffer
+        if read != state.size:
+            raise RuntimeError(f"Failed to restore model state: read {read} of {state.size} bytes")
+        for i, token in enumerate(state.tokens):
+            self.context.tokens[i] = token
+        self.context.n_past = state.n_past
+        return True
+
     @overload
     def generate_embeddings(
         self, text: str, prefix: str | None, dimensionality: int, do_mean: bool, atlas: bool,
@@ -412,13 +749,27 @@ class LLModel:
         self, text: str | list[str], prefix: str | None, dimensionality: int, do_mean: bool, atlas: bool,
         cancel_cb: EmbCancelCallbackType | None,
     ) -> EmbedResult[list[Any]]: ...
+    @overload
+    def generate_embeddings(
+        self, text: str | list[str], prefix: str | None, dimensionality: int, do_mean: bool, atlas: bool,
+        cancel_cb: EmbCancelCallbackType | None, as_array: bool,
+    ) -> Any: ...
 
     def generate_embeddings(
         self, text: str | list[str], prefix: str | None, dimensionality: int, do_mean: bool, atlas: bool,
-        cancel_cb: EmbCancelCallbackType | None,
-    ) -> EmbedResult[list[Any]]:
+        cancel_cb: EmbCancelCallbackType | None, as_array: bool = False,
+    ) -> Any:
+        """
+        Embed one or more texts.
+
+        The output buffer of the backend is copied out in one piece before it is freed: with as_array=True into a
+        contiguous float32 NumPy array of shape (n_texts, n_embd) (or (n_embd,) for a single text), otherwise into
+        lists of floats.
+        """
         if not text:
             raise ValueError("text must not be None or empty")
+        if as_array and np is None:
+            raise ImportError("as_array=True requires numpy")
 
         if self.model is None:
             self._raise_closed()
@@ -453,13 +804,17 @@ class LLModel:
                 raise CancellationError(msg)
             raise RuntimeError(f'Failed to generate embeddings: {msg}')
 
-        # extract output
-        n_embd = embedding_size.value // len(text)
-        embedding_array = [
-            embedding_ptr[i:i + n_embd]
-            for i in range(0, embedding_size.value, n_embd)
-        ]
-        llmodel.llmodel_free_embedding(embedding_ptr)
+        # extract output before the C buffer is freed; as_array copies it in one piece
+        try:
+            size = embedding_size.value
+            n_embd = size // len(text)
+            c_floats = (ctypes.c_float * size).from_address(ctypes.addressof(embedding_ptr.contents))
+            if as_array:
+                embedding_array: Any = np.frombuffer(c_floats, dtype=np.float32).reshape(len(text), n_embd).copy()
+            else:
+                embedding_array = [c_floats[i:i + n_embd] for i in range(0, size, n_embd)]
+        finally:
+            llmodel.llmodel_free_embedding(embedding_ptr)
 
         embeddings = embedding_array[0] if single_text else embedding_array
         return {'embeddings': embeddings, 'n_prompt_tokens': token_count.value}
@@ -480,6 +835,8 @@ class LLModel:
         context_erase: float = 0.75,
         reset_context: bool = False,
         special: bool = False,
+        fake_reply: str | None = None,
+        prompt_callback: PromptCallbackType | None = None,
     ):
         """
         Generate response from model from a prompt.
@@ -490,6 +847,10 @@ class LLModel:
             Question, task, or conversation for model to respond to
         callback(token_id:int, response:str): bool
             The model sends response tokens to callback
+        fake_reply: str | None
+            Ingest this text as the model's reply instead of generating one
+        prompt_callback(token_id:int): bool
+            Called with each token the model ingests; returning False stops processing
 
         Returns
         -------
@@ -499,8 +860,7 @@ class LLModel:
         if self.model is None:
             self._raise_closed()
 
-        self.buffer.clear()
-        self.buff_expecting_cont_bytes = 0
+        self._pipeline.start(callback, prompt_callback)
 
         self._set_context(
             n_predict=n_predict,
@@ -519,98 +879,27 @@ class LLModel:
             self.model,
             ctypes.c_char_p(prompt.encode()),
             ctypes.c_char_p(prompt_template.encode()),
-            PromptCallback(self._prompt_callback),
-            ResponseCallback(self._callback_decoder(callback)),
+            self._pipeline.c_prompt_callback,
+            self._pipeline.c_response_callback,
             True,
             self.context,
             special,
-            ctypes.c_char_p(),
+            ctypes.c_char_p(fake_reply.encode() if fake_reply is not None else None),
         )
 
 
     def prompt_model_streaming(
         self, prompt: str, prompt_template: str, callback: ResponseCallbackType = empty_response_callback, **kwargs
-    ) -> Iterable[str]:
+    ) -> TokenStream:
+        """
+        Start generating a response on the model's streaming worker and return an iterator over its tokens.
+
+        Generation runs ahead of the consumer by at most `STREAM_BUFFER_TOKENS` tokens. Closing the returned
+        `TokenStream`, or abandoning it, aborts the generation.
+        """
         if self.model is None:
             self._raise_closed()
 
-        output_queue: Queue[str | Sentinel] = Queue()
-
-        # Put response tokens into an output queue
-        def _generator_callback_wrapper(callback: ResponseCallbackType) -> ResponseCallbackType:
-            def _generator_callback(token_id: int, response: str):
-                nonlocal callback
-
-                if callback(token_id, response):
-                    output_queue.put(response)
-                    return True
-
-                return False
-
-            return _generator_callback
-
-        def run_llmodel_prompt(prompt: str, prompt_template: str, callback: ResponseCallbackType, **kwargs):
-            self.prompt_model(prompt, prompt_template, callback, **kwargs)
-            output_queue.put(Sentinel.TERMINATING_SYMBOL)
-
-        # Kick off llmodel_prompt in separate thread so we can return generator
-        # immediately
-        thread = threading.Thread(
-            target=run_llmodel_prompt,
-            args=(prompt, prompt_template, _generator_callback_wrapper(callback)),
-            kwargs=kwargs,
-        )
-        thread.start()
-
-        # Generator
-        while True:
-            response = output_queue.get()
-            if isinstance(response, Sentinel):
-                break
-            yield response
-
-    def _callback_decoder(self, callback: ResponseCallbackType) -> RawResponseCallbackType:
-        def _raw_callback(token_id: int, response: bytes) -> bool:
-            nonlocal self, callback
-
-            decoded = []
-
-            for byte in response:
-                
-                bits = "{:08b}".format(byte)
-                (high_ones, _, _) = bits.partition('0')
-
-                if len(high_ones) == 1: 
-                    # continuation byte
-                    self.buffer.append(byte)
-                    self.buff_expecting_cont_bytes -= 1
-
-                else: 
-                    # beginning of a byte sequence
-                    if len(self.buffer) > 0:
-                        decoded.append(self.buffer.decode(errors='replace'))
-
-                        self.buffer.clear()
-
-                    self.buffer.append(byte)
-                    self.buff_expecting_cont_bytes = max(0, len(high_ones) - 1)
-
-                if self.buff_expecting_cont_bytes <= 0: 
-                    # received the whole sequence or an out of place continuation byte
-                    decoded.append(self.buffer.decode(errors='replace'))
-
-                    self.buffer.clear()
-                    self.buff_expecting_cont_bytes = 0
-                    
-            if len(decoded) == 0 and self.buff_expecting_cont_bytes > 0:
-                # wait for more continuation bytes
-                return True
-            
-            return callback(token_id, ''.join(decoded))     
-
-        return _raw_callback
-
-    # Empty prompt callback
-    @staticmethod
-    def _prompt_callback(token_id: int) -> bool:
-        return True
+        channel = _StreamChannel(callback, STREAM_BUFFER_TOKENS)
+        self._stream_worker.submit(partial(self.prompt_model, prompt, prompt_template, **kwargs), channel)
+        return TokenStream(channel)
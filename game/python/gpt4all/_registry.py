@@ -0,0 +1,168 @@
+"""
+Offline-first cache of the GPT4All model registry (models3.json).
+"""
+from __future__ import annotations
+
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+import requests
+
+MODELS_URL = "https://gpt4all.io/models/models3.json"
+# Seconds a fetched registry is used without asking the server again.
+REGISTRY_TTL = 24 * 60 * 60
+REGISTRY_TIMEOUT = 10
+# Set to 1 to never touch the network for registry metadata.
+OFFLINE_ENV = "GPT4ALL_OFFLINE"
+
+_FORMAT_VERSION = 1
+
+
+def offline_from_env() -> bool:
+    return os.environ.get(OFFLINE_ENV, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+class ModelRegistry:
+    """
+    The model list, cached on disk together with its HTTP validators.
+
+    A cached list younger than `ttl` is used as is. An older one is revalidated with a conditional request
+    (If-None-Match / If-Modified-Since), so an unchanged registry costs a 304 and no download. Network failures
+    fall back to the cached list, however old. In offline mode the network is never used.
+
+    `find` goes further for model construction: a model already described by the cache is returned immediately,
+    and a stale cache is revalidated on a background thread.
+    """
+
+    def __init__(
+        self,
+        cache_path: str | os.PathLike[str],
+        url: str = MODELS_URL,
+        ttl: float = REGISTRY_TTL,
+        offline: bool | None = None,
+    ):
+        self.cache_path = Path(cache_path)
+        self.url = url
+        self.ttl = ttl
+        self.offline = offline_from_env() if offline is None else offline
+        self._lock = threading.Lock()
+        self._revalidation: threading.Thread | None = None
+
+    def _read(self) -> dict[str, Any] | None:
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get("format") != _FORMAT_VERSION or entry.get("url") != self.url:
+            return None
+        if not isinstance(entry.get("models"), list):
+            return None
+        return entry
+
+    def _write(self, entry: dict[str, Any]) -> None:
+        tmp_path = self.cache_path.with_name(f"{self.cache_path.name}.{os.getpid()}.tmp")
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"Could not cache the model registry: {e}", file=sys.stderr)
+
+    def _is_fresh(self, entry: dict[str, Any]) -> bool:
+        return time.time() - float(entry.get("fetched_at", 0)) < self.ttl
+
+    def _fetch(self, cached: dict[str, Any] | None) -> dict[str, Any]:
+        headers = {}
+        if cached is not None:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+        resp = requests.get(self.url, headers=headers, timeout=REGISTRY_TIMEOUT)
+        if resp.status_code == 304 and cached is not None:
+            entry = dict(cached, fetched_at=time.time())
+        elif resp.status_code == 200:
+            entry = {
+                "format": _FORMAT_VERSION,
+                "url": self.url,
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "fetched_at": time.time(),
+                "models": resp.json(),
+            }
+        else:
+            raise ValueError(f'Request failed: HTTP {resp.status_code} {resp.reason}')
+        self._write(entry)
+        return entry
+
+    def models(self, refresh: bool = False) -> list[dict[str, Any]]:
+        """
+        Return the model list, revalidating the cache if it is stale (or `refresh` is set).
+
+        Raises:
+            ValueError: If the registry is not cached and cannot be fetched (including in offline mode).
+        """
+        with self._lock:
+            cached = self._read()
+            if cached is not None and (self.offline or (not refresh and self._is_fresh(cached))):
+                return cached["models"]
+            if self.offline:
+                raise ValueError(f"Model registry is not cached and {OFFLINE_ENV} is set")
+            try:
+                return self._fetch(cached)["models"]
+            except (requests.RequestException, ValueError) as e:
+                if cached is None:
+                    if isinstance(e, ValueError):
+                        raise
+                    raise ValueError(f"Could not fetch the model registry: {e}") from e
+                print(f"Using cached model registry, revalidation failed: {e}", file=sys.stderr)
+                return cached["models"]
+
+    def find(self, filename: str) -> dict[str, Any] | None:
+        """
+        Return the registry entry for a model file, or None if the registry does not list it.
+
+        Known models are answered from the cache without waiting for the network; a stale cache is revalidated in
+        the background. Only an unknown model (or an empty cache) waits for a fetch.
+        """
+        cached = self._read()
+        if cached is not None:
+            entry = _lookup(cached["models"], filename)
+            if entry is not None:
+                if not self.offline and not self._is_fresh(cached):
+                    self._revalidate_in_background()
+                return entry
+            if self.offline or self._is_fresh(cached):
+                return None
+        try:
+            return _lookup(self.models(refresh=cached is not None), filename)
+        except ValueError as e:
+            print(f"Model registry unavailable: {e}", file=sys.stderr)
+            return None
+
+    def _revalidate_in_background(self) -> None:
+        if self._revalidation is not None and self._revalidation.is_alive():
+            return
+
+        def _revalidate() -> None:
+            try:
+                self.models(refresh=True)
+            except ValueError:
+                pass
+
+        self._revalidation = threading.Thread(target=_revalidate, name="gpt4all-registry", daemon=True)
+        self._revalidation.start()
+
+
+def _lookup(models: list[dict[str, Any]], filename: str) -> dict[str, Any] | None:
+    for m in models:
+        if m.get("filename") == filename:
+            return dict(m)
+    return None
@@ -0,0 +1,208 @@
+"""
+Multi-process embedding of large corpora into a memory-mapped matrix, with resumable per-shard checkpoints.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Callable, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional for the package; sharded embedding needs it
+    np = None
+
+# Texts per shard: the unit of work handed to a worker and of checkpointing.
+SHARD_SIZE = 4096
+# Threads per worker when the number of processes is chosen automatically. Embedding models are small and
+# batch-bound, so more processes with fewer threads each scale better than for chat generation.
+THREADS_PER_WORKER = 2
+
+_FORMAT_VERSION = 1
+
+_embedder: Any = None
+
+
+def available_cores() -> int:
+    """CPU cores this process may run on (respects affinity masks and containers)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _default_embedder(model_name: str, model_path: str | None, n_threads: int, kwargs: dict[str, Any]) -> Any:
+    from .gpt4all import Embed4All
+
+    return Embed4All(model_name, model_path=model_path, n_threads=n_threads, allow_download=False, **kwargs)
+
+
+def _init_worker(factory: Callable[..., Any], args: tuple[Any, ...]) -> None:
+    global _embedder
+    _embedder = factory(*args)
+
+
+def _shard_digest(texts: Sequence[str]) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for text in texts:
+        h.update(text.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _checkpoint_path(checkpoint_dir: Path, index: int) -> Path:
+    return checkpoint_dir / f"shard-{index:06d}.json"
+
+
+def _embed_shard(task: tuple[int, int, list[str], str, str, str, dict[str, Any]]) -> tuple[int, int]:
+    index, start, texts, digest, output_path, checkpoint_dir, embed_kwargs = task
+    out = np.load(output_path, mmap_mode="r+")
+    try:
+        # rows go straight into the shared file; the shard is never gathered in memory
+        for row, vector in enumerate(_embedder.embed_corpus(texts, as_array=True, **embed_kwargs)):
+            out[start + row] = vector
+        out.flush()
+    finally:
+        del out
+    checkpoint = _checkpoint_path(Path(checkpoint_dir), index)
+    tmp_path = checkpoint.with_name(checkpoint.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"start": start, "rows": len(texts), "digest": digest}, f)
+    os.replace(tmp_path, checkpoint)
+    return index, len(texts)
+
+
+def _embedding_dim(model_name: str, model_path: str | os.PathLike[str] | None) -> int:
+    from .gpt4all import GPT4All
+
+    # from the GGUF header, without loading the model in this process
+    info = GPT4All.retrieve_model(model_name, model_path=model_path, allow_download=False)["gguf"]
+    dim = info.arch_get("embedding_length") if info is not None else None
+    if not isinstance(dim, int) or dim <= 0:
+        raise ValueError(f"Cannot tell the embedding size of {model_name!r}; pass dimensionality")
+    return dim
+
+
+def embed_sharded(
+    texts: Sequence[str],
+    output_path: str | os.PathLike[str],
+    model_name: str | None = None,
+    *,
+    model_path: str | os.PathLike[str] | None = None,
+    processes: int | None = None,
+    n_threads: int | None = None,
+    shard_size: int = SHARD_SIZE,
+    prefix: str | None = None,
+    dimensionality: int | None = None,
+    long_text_mode: str = "mean",
+    progress: Callable[[int, int], None] | None = None,
+    embedder_factory: Callable[..., Any] | None = None,
+    embedder_args: tuple[Any, ...] | None = None,
+    **kwargs: Any,
+) -> Any:
+    """
+    Embed texts with several worker processes into a float32 `.npy` file of shape (len(texts), dim).
+
+    The texts are cut into shards of `shard_size`, each with a fixed row offset in the output. Every worker loads
+    its own `Embed4All` and writes the rows of its shards directly into the memory-mapped output, so no process
+    ever holds all vectors. A finished shard leaves a checkpoint in `<output_path>.shards/`. Running again with the
+    same texts and settings only embeds the shards without one. Changed settings or a different number of texts
+    start over.
+
+    Args:
+        texts: The corpus; it must support len() and slicing.
+        output_path: Where to write the matrix, in NumPy's `.npy` format.
+        model_name: Embedding model, by default the one `Embed4All` uses. It must already be downloaded.
+        model_path: Directory of the model file.
+        processes: Worker processes. Default is None, in which case the cores are split into workers of
+            `THREADS_PER_WORKER` threads.
+        n_threads: CPU threads per worker. Default is None, in which case the cores are divided among the workers.
+        shard_size: Texts per shard.
+        prefix, dimensionality, long_text_mode: As in `Embed4All.embed`. Without dimensionality the output width
+            is read from the model's GGUF metadata.
+        progress: Called in this process as (texts_done, texts_total) whenever a shard finishes.
+        embedder_factory: A picklable callable that builds the embedder in each worker from `embedder_args`.
+            Defaults to loading `Embed4All` with `kwargs`.
+        embedder_args: Arguments for `embedder_factory`.
+
+    Returns:
+        The output opened read-only as a NumPy memmap.
+
+    Raises:
+        ImportError: If numpy is not installed.
+    """
+    if np is None:
+        raise ImportError("embed_sharded requires numpy")
+    if shard_size < 1:
+        raise ValueError(f"shard_size must be positive, got {shard_size}")
+    from .gpt4all import DEFAULT_EMBED_MODEL
+
+    model_name = model_name or DEFAULT_EMBED_MODEL
+    output_path = Path(output_path)
+    checkpoint_dir = output_path.with_name(output_path.name + ".shards")
+    n_texts = len(texts)
+    dim = dimensionality if dimensionality is not None else _embedding_dim(model_name, model_path)
+
+    manifest = {
+        "format": _FORMAT_VERSION,
+        "n_texts": n_texts,
+        "dim": dim,
+        "shard_size": shard_size,
+        "model": model_name,
+        "prefix": prefix,
+        "dimensionality": dimensionality,
+        "long_text_mode": long_text_mode,
+    }
+    manifest_path = checkpoint_dir / "manifest.json"
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            resumable = json.load(f) == manifest and output_path.exists()
+    except (OSError, ValueError):
+        resumable = False
+    if not resumable:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        checkpoint_dir.mkdir(parents=True)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        out = np.lib.format.open_memmap(output_path, mode="w+", dtype=np.float32, shape=(n_texts, dim))
+        del out
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+
+    tasks = []
+    done = 0
+    embed_kwargs = {"prefix": prefix, "dimensionality": dimensionality, "long_text_mode": long_text_mode}
+    for index, start in enumerate(range(0, n_texts, shard_size)):
+        shard = list(texts[start:start + shard_size])
+        digest = _shard_digest(shard)
+        try:
+            with open(_checkpoint_path(checkpoint_dir, index), encoding="utf-8") as f:
+                if json.load(f).get("digest") == digest:
+                    done += len(shard)
+                    continue
+        except (OSError, ValueError):
+            pass
+        tasks.append((index, start, shard, digest, str(output_path), str(checkpoint_dir), embed_kwargs))
+
+    if progress is not None:
+        progress(done, n_texts)
+    if tasks:
+        cores = available_cores()
+        if processes is None:
+            processes = max(1, cores // THREADS_PER_WORKER)
+        processes = max(1, min(processes, len(tasks)))
+        n_threads = n_threads or max(1, cores // processes)
+        if embedder_factory is None:
+            embedder_factory = _default_embedder
+            embedder_args = (model_name, None if model_path is None else str(model_path), n_threads, kwargs)
+        # spawn, not fork: the caller may run threads that a forked child would inherit in a bad state
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(processes, initializer=_init_worker, initargs=(embedder_factory, embedder_args or ())) as pool:
+            for _, rows in pool.imap_unordered(_embed_shard, tasks):
+                done += rows
+                if progress is not None:
+                    progress(done, n_texts)
+    return np.load(output_path, mmap_mode="r")
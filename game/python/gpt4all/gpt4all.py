@@ -8,12 +8,13 @@ import os
 import platform
 import re
 import sys
+import threading
 import time
 import warnings
 from contextlib import contextmanager
 from pathlib import Path
 from types import TracebackType
-from typing import TYPE_CHECKING, Any, Iterable, Literal, Protocol, overload
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, Literal, Protocol, overload
 
 import requests
 from requests.exceptions import ChunkedEncodingError
@@ -45,6 +46,11 @@ from urllib3.exceptions import IncompleteRead, ProtocolError
 
 from ._pyllmodel import (CancellationError as CancellationError, EmbCancelCallbackType, EmbedResult as EmbedResult,
                          LLModel, ResponseCallbackType, empty_response_callback)
+from ._corpus import CORPUS_BATCH_TEXTS, CORPUS_WINDOW, embed_corpus
+from ._download import DOWNLOAD_CONNECTIONS, MIN_SEGMENTED_SIZE, SegmentedDownload, probe_ranges
+from ._embed_cache import EmbeddingCache
+from ._gguf import GGUFInfo, read_gguf
+from ._registry import ModelRegistry
 
 if TYPE_CHECKING:
     from typing_extensions import Self, TypeAlias
@@ -57,6 +63,33 @@ DEFAULT_MODEL_DIRECTORY = Path.home() / ".cache" / "gpt4all"
 
 DEFAULT_PROMPT_TEMPLATE = "### Human:\n{0}\n\n### Assistant:\n"
 
+# Prompt templates for models the registry does not describe, by the format of their embedded chat template.
+CHAT_FORMAT_PROMPT_TEMPLATES = {
+    "llama3": "<|start_header_id|>user<|end_header_id|>\n\n{0}<|eot_id|>"
+              "<|start_header_id|>assistant<|end_header_id|>\n\n{1}<|eot_id|>",
+    "chatml": "<|im_start|>user\n{0}<|im_end|>\n<|im_start|>assistant\n{1}<|im_end|>\n",
+}
+
+DEFAULT_EMBED_MODEL = 'all-MiniLM-L6-v2.gguf2.f16.gguf'
+
+REGISTRY_CACHE_FILENAME = "models3.json"
+
+_registries: dict[Path, ModelRegistry] = {}
+
+
+def model_registry() -> ModelRegistry:
+    """The registry cache kept in the current `DEFAULT_MODEL_DIRECTORY`."""
+    cache_path = Path(DEFAULT_MODEL_DIRECTORY) / REGISTRY_CACHE_FILENAME
+    if cache_path not in _registries:
+        _registries[cache_path] = ModelRegistry(cache_path)
+    return _registries[cache_path]
+
+
+# Default chat session budget, as a fraction of the context window; the rest is headroom for the next turn.
+CHAT_TOKEN_BUDGET = 0.75
+# When a session exceeds its budget, old turns are dropped until it uses at most this fraction of the budget.
+CHAT_COMPACT_TO = 0.5
+
 ConfigType: TypeAlias = 'dict[str, Any]'
 MessageType: TypeAlias = 'dict[str, str]'
 
@@ -68,18 +101,23 @@ class Embed4All:
 
     MIN_DIMENSIONALITY = 64
 
-    def __init__(self, model_name: str | None = None, *, n_threads: int | None = None, device: str | None = None, **kwargs: Any):
+    def __init__(
+        self, model_name: str | None = None, *, n_threads: int | None = None, device: str | None = None,
+        cache: EmbeddingCache | None = None, **kwargs: Any,
+    ):
         """
         Constructor
 
         Args:
             n_threads: number of CPU threads used by GPT4All. Default is None, then the number of threads are determined automatically.
             device: The processing unit on which the embedding model will run. See the `GPT4All` constructor for more info.
+            cache: An on-disk cache of embeddings. Texts found in it are not sent to the model again, across runs.
             kwargs: Remaining keyword arguments are passed to the `GPT4All` constructor.
         """
         if model_name is None:
-            model_name = 'all-MiniLM-L6-v2.gguf2.f16.gguf'
+            model_name = DEFAULT_EMBED_MODEL
         self.gpt4all = GPT4All(model_name, n_threads=n_threads, device=device, **kwargs)
+        self.cache = cache
 
     def __enter__(self) -> Self:
         return self
@@ -129,18 +167,18 @@ class Embed4All:
         cancel_cb: EmbCancelCallbackType | None = ...,
     ) -> EmbedResult[list[Any]]: ...
 
-    # return type unknown
+    # return type unknown, or a NumPy array
     @overload
     def embed(
         self, text: str | list[str], *, prefix: str | None = ..., dimensionality: int | None = ...,
         long_text_mode: str = ..., return_dict: bool = ..., atlas: bool = ...,
-        cancel_cb: EmbCancelCallbackType | None = ...,
+        cancel_cb: EmbCancelCallbackType | None = ..., as_array: bool = ...,
     ) -> Any: ...
 
     def embed(
         self, text: str | list[str], *, prefix: str | None = None, dimensionality: int | None = None,
         long_text_mode: str = "mean", return_dict: bool = False, atlas: bool = False,
-        cancel_cb: EmbCancelCallbackType | None = None,
+        cancel_cb: EmbCancelCallbackType | None = None, as_array: bool = False,
     ) -> Any:
         """
         Generate one or more embeddings.
@@ -157,10 +195,13 @@ class Embed4All:
             atlas: Try to be fully compatible with the Atlas API. Currently, this means texts longer than 8192 tokens
                 with long_text_mode="mean" will raise an error. Disabled by default.
             cancel_cb: Called with arguments (batch_sizes, backend_name). Return true to cancel embedding.
+            as_array: Return the embeddings as a float32 NumPy array of shape (n_texts, dim), or (dim,) for a single
+                text, instead of lists of floats. Much cheaper for large batches. Requires numpy.
 
         Returns:
             With return_dict=False, an embedding or list of embeddings of your text(s).
-            With return_dict=True, a dict with keys 'embeddings' and 'n_prompt_tokens'.
+            With return_dict=True, a dict with keys 'embeddings' and 'n_prompt_tokens'. With a cache, n_prompt_tokens
+            only counts the texts that were not cached.
 
         Raises:
             CancellationError: If cancel_cb returned True and embedding was canceled.
@@ -179,9 +220,48 @@ class Embed4All:
             do_mean = {"mean": True, "truncate": False}[long_text_mode]
         except KeyError:
             raise ValueError(f"Long text mode must be one of 'mean' or 'truncate', got {long_text_mode!r}")
-        result = self.gpt4all.model.generate_embeddings(text, prefix, dimensionality, do_mean, atlas, cancel_cb)
+        if self.cache is not None:
+            result = self.cache.embed(
+                self.gpt4all.model, self.gpt4all.config["path"], text, prefix, dimensionality, long_text_mode, do_mean,
+                atlas, cancel_cb, as_array=as_array,
+            )
+        else:
+            result = self.gpt4all.model.generate_embeddings(
+                text, prefix, dimensionality, do_mean, atlas, cancel_cb, as_array=as_array,
+            )
         return result if return_dict else result['embeddings']
 
+    def embed_corpus(
+        self, texts: Iterable[str], *, prefix: str | None = None, dimensionality: int | None = None,
+        long_text_mode: str = "mean", atlas: bool = False, cancel_cb: EmbCancelCallbackType | None = None,
+        as_array: bool = False, window: int = CORPUS_WINDOW, batch_texts: int = CORPUS_BATCH_TEXTS,
+    ) -> Iterator[Any]:
+        """
+        Embed a stream of texts, yielding one embedding per text in input order.
+
+        Up to `window` texts are read ahead and sorted by length into micro-batches that fit the model's context, so
+        texts of similar length are embedded together. Memory use is bounded by the window, not by the corpus.
+
+        Args:
+            texts: Any iterable of texts, e.g. a generator over a file.
+            prefix, dimensionality, long_text_mode, atlas, as_array: As in `embed`.
+            cancel_cb: Called by the backend as in `embed`, once per backend batch, so it doubles as a progress hook.
+                Return true to cancel; the iterator then raises `CancellationError`.
+            window: Number of texts read ahead of the output.
+            batch_texts: Most texts per call into the backend.
+        """
+        max_tokens = self.gpt4all.model.n_ctx
+        if (trained_ctx := self.gpt4all.config.get("contextLength")) is not None:
+            max_tokens = min(max_tokens, int(trained_ctx))
+
+        def embed_batch(batch: list[str]) -> Any:
+            return self.embed(
+                batch, prefix=prefix, dimensionality=dimensionality, long_text_mode=long_text_mode, atlas=atlas,
+                cancel_cb=cancel_cb, as_array=as_array,
+            )
+
+        return embed_corpus(embed_batch, texts, max_tokens, max_texts=batch_texts, window=window)
+
 
 class GPT4All:
     """
@@ -229,6 +309,9 @@ class GPT4All:
 
         self.model_type = model_type
         self._history: list[MessageType] | None = None
+        self._history_tokens: list[int] = []
+        self._token_budget = 0
+        self._compaction: threading.Thread | None = None
         self._current_prompt_template: str = "{0}"
 
         device_init = None
@@ -256,6 +339,9 @@ class GPT4All:
 
         # Retrieve model and download if allowed
         self.config: ConfigType = self.retrieve_model(model_name, model_path=model_path, allow_download=allow_download, verbose=verbose)
+        if (trained_ctx := self.config.get("contextLength")) is not None and n_ctx > int(trained_ctx):
+            warnings.warn(f"n_ctx={n_ctx} exceeds the context length the model was trained with ({trained_ctx}); "
+                          "output quality may degrade past it")
         self.model = LLModel(self.config["path"], n_ctx, ngl, backend)
         if device_init is not None:
             self.model.init_gpu(device_init)
@@ -274,6 +360,7 @@ class GPT4All:
 
     def close(self) -> None:
         """Delete the model instance and free associated system resources."""
+        self._wait_for_compaction()
         self.model.close()
 
     @property
@@ -291,17 +378,20 @@ class GPT4All:
         return None if self._history is None else list(self._history)
 
     @staticmethod
-    def list_models() -> list[ConfigType]:
+    def list_models(refresh: bool = False) -> list[ConfigType]:
         """
         Fetch model list from https://gpt4all.io/models/models3.json.
 
+        The list is cached next to the downloaded models and revalidated with a conditional request once it is
+        older than a day. With GPT4ALL_OFFLINE=1 only the cached list is used.
+
+        Args:
+            refresh: Revalidate the cached list even if it is recent.
+
         Returns:
             Model list in JSON format.
         """
-        resp = requests.get("https://gpt4all.io/models/models3.json")
-        if resp.status_code != 200:
-            raise ValueError(f'Request failed: HTTP {resp.status_code} {resp.reason}')
-        return resp.json()
+        return model_registry().models(refresh=refresh)
 
     @classmethod
     def retrieve_model(
@@ -322,7 +412,8 @@ class GPT4All:
             verbose: If True (default), print debug messages.
 
         Returns:
-            Model config.
+            Model config. Besides the registry entry it holds "path", "gguf" (the `GGUFInfo` of the model file, or
+            None if it could not be read) and "contextLength" (the context length the model was trained with).
         """
 
         model_filename = append_extension_if_missing(model_name)
@@ -330,15 +421,13 @@ class GPT4All:
         # get the config for the model
         config: ConfigType = {}
         if allow_download:
-            available_models = cls.list_models()
-
-            for m in available_models:
-                if model_filename == m["filename"]:
-                    tmpl = m.get("promptTemplate", DEFAULT_PROMPT_TEMPLATE)
-                    # change to Python-style formatting
-                    m["promptTemplate"] = tmpl.replace("%1", "{0}", 1).replace("%2", "{1}", 1)
-                    config.update(m)
-                    break
+            # answered from the registry cache when the model is already known to it
+            m = model_registry().find(model_filename)
+            if m is not None:
+                tmpl = m.get("promptTemplate", DEFAULT_PROMPT_TEMPLATE)
+                # change to Python-style formatting
+                m["promptTemplate"] = tmpl.replace("%1", "{0}", 1).replace("%2", "{1}", 1)
+                config.update(m)
 
         # Validate download directory
         if model_path is None:
@@ -368,6 +457,20 @@ class GPT4All:
         else:
             raise FileNotFoundError(f"Model file does not exist: {model_dest!r}")
 
+        # the file's own metadata fills in what the registry does not say
+        try:
+            info: GGUFInfo | None = read_gguf(config["path"])
+        except (OSError, ValueError) as e:
+            if verbose:
+                print(f"Could not read the model metadata: {e}", file=sys.stderr)
+            info = None
+        config["gguf"] = info
+        if info is not None:
+            if info.context_length is not None:
+                config.setdefault("contextLength", info.context_length)
+            if "promptTemplate" not in config and info.chat_format in CHAT_FORMAT_PROMPT_TEMPLATES:
+                config["promptTemplate"] = CHAT_FORMAT_PROMPT_TEMPLATES[info.chat_format]
+
         return config
 
     @staticmethod
@@ -378,10 +481,14 @@ class GPT4All:
         url: str | None = None,
         expected_size: int | None = None,
         expected_md5: str | None = None,
+        connections: int = DOWNLOAD_CONNECTIONS,
     ) -> str | os.PathLike[str]:
         """
         Download model from https://gpt4all.io.
 
+        If the server supports range requests, large files are downloaded in segments over several connections and
+        an interrupted download resumes where it stopped. The MD5 is computed while downloading.
+
         Args:
             model_filename: Filename of model (with .gguf extension).
             model_path: Path to download model to.
@@ -389,6 +496,7 @@ class GPT4All:
             url: the models remote url (e.g. may be hosted on HF)
             expected_size: The expected size of the download.
             expected_md5: The expected MD5 hash of the download.
+            connections: Maximum number of parallel connections. 1 disables segmented downloads.
 
         Returns:
             Model file destination.
@@ -398,78 +506,18 @@ class GPT4All:
         if url is None:
             url = f"https://gpt4all.io/models/gguf/{model_filename}"
 
-        def make_request(offset=None):
-            headers = {}
-            if offset:
-                print(f"\nDownload interrupted, resuming from byte position {offset}", file=sys.stderr)
-                headers['Range'] = f'bytes={offset}-'  # resume incomplete response
-                headers["Accept-Encoding"] = "identity"  # Content-Encoding changes meaning of ranges
-            response = requests.get(url, stream=True, headers=headers)
-            if response.status_code not in (200, 206):
-                raise ValueError(f'Request failed: HTTP {response.status_code} {response.reason}')
-            if offset and (response.status_code != 206 or str(offset) not in response.headers.get('Content-Range', '')):
-                raise ValueError('Connection was interrupted and server does not support range requests')
-            if (enc := response.headers.get("Content-Encoding")) is not None:
-                raise ValueError(f"Expected identity Content-Encoding, got {enc}")
-            return response
-
-        response = make_request()
-
-        total_size_in_bytes = int(response.headers.get("content-length", 0))
-        block_size = 2**20  # 1 MB
-
         partial_path = Path(model_path) / (model_filename + ".part")
 
-        with open(partial_path, "w+b") as partf:
+        size = None
+        if connections > 1:
             try:
-                with tqdm(desc="Downloading", total=total_size_in_bytes, unit="iB", unit_scale=True) as progress_bar:
-                    while True:
-                        last_progress = progress_bar.n
-                        try:
-                            for data in response.iter_content(block_size):
-                                partf.write(data)
-                                progress_bar.update(len(data))
-                        except ChunkedEncodingError as cee:
-                            if cee.args and isinstance(pe := cee.args[0], ProtocolError):
-                                if len(pe.args) >= 2 and isinstance(ir := pe.args[1], IncompleteRead):
-                                    assert progress_bar.n <= ir.partial  # urllib3 may be ahead of us but never behind
-                                    # the socket was closed during a read - retry
-                                    response = make_request(progress_bar.n)
-                                    continue
-                            raise
-                        if total_size_in_bytes != 0 and progress_bar.n < total_size_in_bytes:
-                            if progress_bar.n == last_progress:
-                                raise RuntimeError("Download not making progress, aborting.")
-                            # server closed connection prematurely - retry
-                            response = make_request(progress_bar.n)
-                            continue
-                        break
-
-                # verify file integrity
-                file_size = partf.tell()
-                if expected_size is not None and file_size != expected_size:
-                    raise ValueError(f"Expected file size of {expected_size} bytes, got {file_size}")
-                if expected_md5 is not None:
-                    partf.seek(0)
-                    hsh = hashlib.md5()
-                    with tqdm(desc="Verifying", total=file_size, unit="iB", unit_scale=True) as bar:
-                        while chunk := partf.read(block_size):
-                            hsh.update(chunk)
-                            bar.update(len(chunk))
-                    if hsh.hexdigest() != expected_md5.lower():
-                        raise ValueError(f"Expected MD5 hash of {expected_md5!r}, got {hsh.hexdigest()!r}")
-            except:
-                if verbose:
-                    print("Cleaning up the interrupted download...", file=sys.stderr)
-                try:
-                    os.remove(partial_path)
-                except OSError:
-                    pass
-                raise
-
-            # flush buffers and sync the inode
-            partf.flush()
-            _fsync(partf)
+                size = probe_ranges(url)
+            except requests.RequestException:
+                pass
+        if size is not None and size >= MIN_SEGMENTED_SIZE:
+            _download_segmented(url, partial_path, size, connections, expected_size, expected_md5, verbose)
+        else:
+            _download_stream(url, partial_path, expected_size, expected_md5, verbose)
 
         # move to final destination
         download_path = Path(model_path) / model_filename
@@ -554,7 +602,17 @@ class GPT4All:
             n_predict=n_predict if n_predict is not None else max_tokens,
         )
 
+        prompt_tokens = 0
+        turn_start: int | None = None
+
+        def _count_prompt_token(token_id: int) -> bool:
+            nonlocal prompt_tokens
+            prompt_tokens += 1
+            return True
+
         if self._history is not None:
+            self._wait_for_compaction()
+            self._fit_context(prompt, generate_kwargs["n_predict"], n_batch)
             # check if there is only one message, i.e. system prompt:
             reset = len(self._history) == 1
             self._history.append({"role": "user", "content": prompt})
@@ -567,7 +625,10 @@ class GPT4All:
                     self.model.prompt_model(self._history[0]["content"], "%1%2",
                                             empty_response_callback,
                                             n_batch=n_batch, n_predict=0, reset_context=True, special=True)
+                    self._history_tokens = [self.model.n_past]
                 prompt_template = self._current_prompt_template.format("%1", "%2")
+                turn_start = self.model.n_past
+                generate_kwargs["prompt_callback"] = _count_prompt_token
             else:
                 warnings.warn(
                     "_format_chat_prompt_template is deprecated. Please use a chat session with a prompt template.",
@@ -594,34 +655,45 @@ class GPT4All:
             self._history.append({"role": "assistant", "content": ""})
             output_collector = self._history
 
-        def _callback_wrapper(
-            callback: ResponseCallbackType,
-            output_collector: list[MessageType],
-        ) -> ResponseCallbackType:
-            def _callback(token_id: int, response: str) -> bool:
-                nonlocal callback, output_collector
-
-                output_collector[-1]["content"] += response
+        # Tokens are collected in a list and joined once at the end; growing the message string on every token
+        # is quadratic in the length of the response.
+        chunks: list[str] = []
+        append_chunk = chunks.append
 
-                return callback(token_id, response)
+        def _callback(token_id: int, response: str) -> bool:
+            append_chunk(response)
+            return callback(token_id, response)
 
-            return _callback
+        def _store_response() -> str:
+            output_collector[-1]["content"] = "".join(chunks)
+            if turn_start is not None:
+                self._record_turn(turn_start, prompt_tokens, n_batch)
+            return output_collector[-1]["content"]
 
         # Send the request to the model
         if streaming:
-            return self.model.prompt_model_streaming(
+            def _stream() -> Iterator[str]:
+                try:
+                    yield from self.model.prompt_model_streaming(
+                        prompt,
+                        prompt_template,
+                        _callback,
+                        **generate_kwargs,
+                    )
+                finally:
+                    _store_response()
+
+            return _stream()
+
+        try:
+            self.model.prompt_model(
                 prompt,
                 prompt_template,
-                _callback_wrapper(callback, output_collector),
+                _callback,
                 **generate_kwargs,
             )
-
-        self.model.prompt_model(
-            prompt,
-            prompt_template,
-            _callback_wrapper(callback, output_collector),
-            **generate_kwargs,
-        )
+        finally:
+            _store_response()
 
         return output_collector[-1]["content"]
 
@@ -630,13 +702,21 @@ class GPT4All:
         self,
         system_prompt: str | None = None,
         prompt_template: str | None = None,
+        token_budget: int | None = None,
     ):
         """
         Context manager to hold an inference optimized chat session with a GPT4All model.
 
+        The session tracks how many context tokens each message occupies. Once a reply brings it over
+        `token_budget`, the oldest turns are dropped from the history and the remaining ones re-ingested on a
+        background thread, so the next prompt finds room in the context instead of triggering the backend's
+        context shift in the middle of a reply.
+
         Args:
             system_prompt: An initial instruction for the model.
             prompt_template: Template for the prompts with {0} being replaced by the user message.
+            token_budget: Tokens the session may occupy before old turns are dropped. Default is None, in which case
+                `CHAT_TOKEN_BUDGET` of the context window is used.
         """
 
         if system_prompt is None:
@@ -653,14 +733,86 @@ class GPT4All:
             raise ValueError("Prompt template containing a literal '%1' is not supported. For a prompt "
                              "placeholder, please use '{0}' instead.")
 
+        self._wait_for_compaction()
         self._history = [{"role": "system", "content": system_prompt}]
+        self._history_tokens = []
+        self._token_budget = token_budget if token_budget is not None else int(self.model.n_ctx * CHAT_TOKEN_BUDGET)
         self._current_prompt_template = prompt_template
         try:
             yield self
         finally:
+            self._wait_for_compaction()
             self._history = None
+            self._history_tokens = []
             self._current_prompt_template = "{0}"
 
+    def _wait_for_compaction(self) -> None:
+        if self._compaction is not None:
+            self._compaction.join()
+            self._compaction = None
+
+    def _tracking_tokens(self) -> bool:
+        return self._history is not None and len(self._history_tokens) == len(self._history)
+
+    def _record_turn(self, turn_start: int, prompt_tokens: int, n_batch: int) -> None:
+        """Attribute the context tokens of the last turn to its messages; compact in the background if needed."""
+        if self._history is None or len(self._history_tokens) != len(self._history) - 2:
+            return
+        turn_tokens = self.model.n_past - turn_start
+        shifted = turn_tokens < prompt_tokens  # the backend erased context during the turn
+        self._history_tokens += [prompt_tokens, max(0, turn_tokens - prompt_tokens)]
+        if shifted or sum(self._history_tokens) > self._token_budget:
+            self._compaction = threading.Thread(
+                target=self._compact_history, args=(n_batch,), name='gpt4all-compaction', daemon=True,
+            )
+            self._compaction.start()
+
+    def _fit_context(self, prompt: str, n_predict: int, n_batch: int) -> None:
+        """Compact now if the next turn could overflow the context (a fallback; normally done in the background)."""
+        if not self._tracking_tokens() or len(self._history_tokens) < 2:
+            return
+        # a pessimistic guess, the C API offers no tokenizer: about two bytes per token plus template tokens
+        reserve = len(prompt.encode()) // 2 + 16 + n_predict
+        if sum(self._history_tokens) + reserve > self.model.n_ctx:
+            self._compact_history(n_batch, reserve)
+
+    def _compact_history(self, n_batch: int, reserve: int = 0) -> None:
+        """Drop the oldest turns until the session fits its compaction target, then re-ingest the rest."""
+        history, tokens = self._history, self._history_tokens
+        if history is None or len(tokens) != len(history):
+            return
+        target = min(int(self._token_budget * CHAT_COMPACT_TO), self.model.n_ctx - reserve)
+        total = sum(tokens)
+        end = 1
+        while end < len(history) and total > target:
+            total -= tokens[end] + tokens[end + 1]
+            end += 2
+        del history[1:end]
+        del tokens[1:end]
+        if len(history) == 1:
+            return  # the next prompt ingests the system prompt from scratch
+        try:
+            self._ingest_history(n_batch)
+        except Exception as e:
+            warnings.warn(f"Could not rebuild the chat context, starting over: {e}")
+            del history[1:]
+            del tokens[1:]
+
+    def _ingest_history(self, n_batch: int) -> None:
+        history, tokens = self._history, self._history_tokens
+        assert history is not None
+        self.model.prompt_model(history[0]["content"], "%1%2", empty_response_callback,
+                                n_batch=n_batch, n_predict=0, reset_context=True, special=True)
+        tokens[0] = self.model.n_past
+        prompt_template = self._current_prompt_template.format("%1", "%2")
+        for i in range(1, len(history), 2):
+            start = self.model.n_past
+            self.model.prompt_model(history[i]["content"], prompt_template, empty_response_callback,
+                                    n_batch=n_batch, fake_reply=history[i + 1]["content"])
+            # a fake reply is ingested like the prompt, so the whole turn is attributed to the user message
+            tokens[i] = self.model.n_past - start
+            tokens[i + 1] = 0
+
     @staticmethod
     def list_gpus() -> list[str]:
         """
@@ -709,6 +861,108 @@ class GPT4All:
         return full_prompt
 
 
+def _download_stream(
+    url: str, partial_path: Path, expected_size: int | None, expected_md5: str | None, verbose: bool,
+) -> None:
+    """Download over one connection, resuming with a range request if the connection drops."""
+
+    def make_request(offset=None):
+        headers = {}
+        if offset:
+            print(f"\nDownload interrupted, resuming from byte position {offset}", file=sys.stderr)
+            headers['Range'] = f'bytes={offset}-'  # resume incomplete response
+            headers["Accept-Encoding"] = "identity"  # Content-Encoding changes meaning of ranges
+        response = requests.get(url, stream=True, headers=headers)
+        if response.status_code not in (200, 206):
+            raise ValueError(f'Request failed: HTTP {response.status_code} {response.reason}')
+        if offset and (response.status_code != 206 or str(offset) not in response.headers.get('Content-Range', '')):
+            raise ValueError('Connection was interrupted and server does not support range requests')
+        if (enc := response.headers.get("Content-Encoding")) is not None:
+            raise ValueError(f"Expected identity Content-Encoding, got {enc}")
+        return response
+
+    response = make_request()
+
+    total_size_in_bytes = int(response.headers.get("content-length", 0))
+    block_size = 2**20  # 1 MB
+    # hashed as it is written: the data arrives in order, even across resumed requests
+    hsh = hashlib.md5()
+
+    with open(partial_path, "w+b") as partf:
+        try:
+            with tqdm(desc="Downloading", total=total_size_in_bytes, unit="iB", unit_scale=True) as progress_bar:
+                while True:
+                    last_progress = progress_bar.n
+                    try:
+                        for data in response.iter_content(block_size):
+                            partf.write(data)
+                            hsh.update(data)
+                            progress_bar.update(len(data))
+                    except ChunkedEncodingError as cee:
+                        if cee.args and isinstance(pe := cee.args[0], ProtocolError):
+                            if len(pe.args) >= 2 and isinstance(ir := pe.args[1], IncompleteRead):
+                                assert progress_bar.n <= ir.partial  # urllib3 may be ahead of us but never behind
+                                # the socket was closed during a read - retry
+                                response = make_request(progress_bar.n)
+                                continue
+                        raise
+                    if total_size_in_bytes != 0 and progress_bar.n < total_size_in_bytes:
+                        if progress_bar.n == last_progress:
+                            raise RuntimeError("Download not making progress, aborting.")
+                        # server closed connection prematurely - retry
+                        response = make_request(progress_bar.n)
+                        continue
+                    break
+
+            # verify file integrity
+            file_size = partf.tell()
+            if expected_size is not None and file_size != expected_size:
+                raise ValueError(f"Expected file size of {expected_size} bytes, got {file_size}")
+            if expected_md5 is not None and hsh.hexdigest() != expected_md5.lower():
+                raise ValueError(f"Expected MD5 hash of {expected_md5!r}, got {hsh.hexdigest()!r}")
+        except:
+            if verbose:
+                print("Cleaning up the interrupted download...", file=sys.stderr)
+            try:
+                os.remove(partial_path)
+            except OSError:
+                pass
+            raise
+
+        # flush buffers and sync the inode
+        partf.flush()
+        _fsync(partf)
+
+
+def _download_segmented(
+    url: str, partial_path: Path, size: int, connections: int, expected_size: int | None, expected_md5: str | None,
+    verbose: bool,
+) -> None:
+    """Download over parallel range requests; on a transient failure the .part file is kept for resuming."""
+    if expected_size is not None and size != expected_size:
+        raise ValueError(f"Expected file size of {expected_size} bytes, got {size}")
+    download = SegmentedDownload(url, partial_path, size, connections, compute_md5=expected_md5 is not None)
+    try:
+        with tqdm(desc="Downloading", total=size, unit="iB", unit_scale=True) as progress_bar:
+            digest = download.run(progress_bar.update)
+    except BaseException:
+        if verbose:
+            print("Download interrupted, it will resume from here on the next attempt.", file=sys.stderr)
+        raise
+    if expected_md5 is not None and digest != expected_md5.lower():
+        download.remove_state()
+        try:
+            os.remove(partial_path)
+        except OSError:
+            pass
+        raise ValueError(f"Expected MD5 hash of {expected_md5!r}, got {digest!r}")
+
+    # sync the inode before the state that allows resuming goes away
+    with open(partial_path, "r+b") as partf:
+        _fsync(partf)
+    download.remove_state()
+
+
 def append_extension_if_missing(model_name):
     if not model_name.endswith((".bin", ".gguf")):
         model_name += ".gguf"
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+import sys
+import time
+
+from gpt4all import GPT4All
+from gpt4all._pyllmodel import _ResponsePipeline
+
+
+def time_pipeline(n_tokens, pipeline):
+    # mix of ASCII pieces and multi-byte characters split across tokens, as byte-level BPE produces them
+    pieces = [b' the', b' detective', b'\xe2\x80', b'\x94', b' caf', b'\xc3\xa9'] * (n_tokens // 6)
+    chunks = []
+    pipeline.start(lambda token_id, response: chunks.append(response) is None)
+    callback = pipeline.c_response_callback
+    start_time = time.perf_counter()
+    for i, piece in enumerate(pieces):
+        callback(i, piece)
+    elapsed_time = time.perf_counter() - start_time
+    text = ''.join(chunks)
+    assert '�' not in text, text[:64]
+    print(f"Pipeline report: {1e6 * elapsed_time / len(pieces):.2f} us/token over {len(pieces)} tokens")
+
+
+def time_generation(model, max_tokens):
+    start_time = time.perf_counter()
+    output = model.generate('Tell me a long story about a detective.', max_tokens=max_tokens, temp=0)
+    elapsed_time = time.perf_counter() - start_time
+    print(f"Model report: {max_tokens / elapsed_time:.1f} tokens/second, {len(output)} characters")
+
+
+if __name__ == "__main__":
+    pipeline = _ResponsePipeline()
+    for n in [2**n for n in range(10, 17)]:
+        time_pipeline(n, pipeline)
+    if len(sys.argv) > 1:
+        model = GPT4All(sys.argv[1])
+        for max_tokens in (64, 256):
+            time_generation(model, max_tokens)
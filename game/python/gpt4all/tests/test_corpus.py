@@ -0,0 +1,39 @@
+import random
+
+from gpt4all._corpus import embed_corpus, estimate_tokens, plan_batches
+
+
+def test_plan_batches_groups_by_length():
+    lengths = [30, 2, 31, 3, 200, 2, 29]
+    batches = plan_batches(lengths, max_tokens=64, max_texts=3)
+    assert sorted(i for b in batches for i in b) == list(range(len(lengths)))
+    for batch in batches:
+        assert len(batch) <= 3
+        assert len(batch) == 1 or sum(lengths[i] for i in batch) <= 64
+    assert [4] in batches  # too long for company
+    assert {1, 3, 5} in [set(b) for b in batches]
+    assert [min(b) for b in batches] == sorted(min(b) for b in batches)
+
+
+def test_embed_corpus_order_and_window():
+    rng = random.Random(0)
+    texts = ["x" * rng.randrange(0, 400) + str(i) for i in range(500)]
+    read = []
+    calls = []
+
+    def source():
+        for t in texts:
+            read.append(t)
+            yield t
+
+    def embed_batch(batch):
+        calls.append(batch)
+        assert sum(estimate_tokens(t) for t in batch) <= 128 or len(batch) == 1
+        return [[float(len(t)), t] for t in batch]
+
+    out = []
+    for vector in embed_corpus(embed_batch, source(), max_tokens=128, max_texts=16, window=50):
+        out.append(vector[1])
+        assert len(read) - len(out) < 50  # only the current window is buffered
+    assert out == texts
+    assert all(len(batch) <= 16 for batch in calls)
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from gpt4all._download import SegmentedDownload, probe_ranges
+
+SEGMENT = 64 * 1024
+PAYLOAD = os.urandom(10 * SEGMENT + 123)
+
+
+class _FileHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    ranges = True
+    requests: list = []
+
+    def do_GET(self):
+        type(self).requests.append(self.headers.get("Range"))
+        header = self.headers.get("Range")
+        if self.ranges and header and header.startswith("bytes="):
+            first, _, last = header[len("bytes="):].partition("-")
+            start, end = int(first), min(int(last or len(PAYLOAD) - 1), len(PAYLOAD) - 1)
+            body = PAYLOAD[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")
+        else:
+            body = PAYLOAD
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    _FileHandler.ranges = True
+    _FileHandler.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _FileHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/model.gguf"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_segmented_download(server, tmp_path: Path):
+    assert probe_ranges(server) == len(PAYLOAD)
+    part = tmp_path / "model.gguf.part"
+    progress = []
+    download = SegmentedDownload(server, part, len(PAYLOAD), connections=4, segment_size=SEGMENT)
+    assert download.run(progress.append) == hashlib.md5(PAYLOAD).hexdigest()
+    assert part.read_bytes() == PAYLOAD
+    assert sum(progress) == len(PAYLOAD)
+    download.remove_state()
+    assert not download.state_path.exists()
+
+
+def test_segmented_download_resumes(server, tmp_path: Path):
+    part = tmp_path / "model.gguf.part"
+    done = [0, 1, 2, 5]
+    # an earlier run finished some segments and left the rest of the file empty
+    data = bytearray(len(PAYLOAD))
+    for i in done:
+        data[i * SEGMENT:(i + 1) * SEGMENT] = PAYLOAD[i * SEGMENT:(i + 1) * SEGMENT]
+    part.write_bytes(bytes(data))
+    download = SegmentedDownload(server, part, len(PAYLOAD), connections=3, segment_size=SEGMENT)
+    with open(download.state_path, "w") as f:
+        json.dump(dict(download._state(), done=done), f)
+
+    assert download.run() == hashlib.md5(PAYLOAD).hexdigest()
+    assert part.read_bytes() == PAYLOAD
+    fetched = {int(r[len("bytes="):].split("-")[0]) // SEGMENT for r in _FileHandler.requests}
+    assert fetched.isdisjoint(done)
+
+
+def test_no_range_support(server, tmp_path: Path):
+    _FileHandler.ranges = False
+    assert probe_ranges(server) is None
@@ -0,0 +1,94 @@
+from pathlib import Path
+
+import pytest
+
+from gpt4all._embed_cache import EmbeddingCache, embedding_key
+
+DIM = 8
+
+
+class _CountingModel:
+    """Stands in for LLModel: deterministic vectors, counts the texts it embeds."""
+
+    def __init__(self):
+        self.texts = []
+
+    def generate_embeddings(self, text, prefix, dimensionality, do_mean, atlas, cancel_cb, as_array=False):
+        self.texts.extend(text)
+        vectors = [[float(len(t) + i) for i in range(DIM)] for t in text]
+        if as_array:
+            import numpy as np
+            vectors = np.asarray(vectors, dtype=np.float32)
+        return {"embeddings": vectors, "n_prompt_tokens": len(text)}
+
+
+def _embed(cache, model, model_file, texts, **kwargs):
+    return cache.embed(model, model_file, texts, None, -1, "mean", True, False, None, **kwargs)
+
+
+@pytest.fixture
+def model_file(tmp_path: Path) -> Path:
+    path = tmp_path / "embed.gguf"
+    path.write_bytes(b"GGUF" + bytes(100))
+    return path
+
+
+def test_cache_hits_skip_the_model(tmp_path: Path, model_file: Path):
+    model = _CountingModel()
+    cache = EmbeddingCache(tmp_path / "cache")
+    first = _embed(cache, model, model_file, ["a", "bb", "a"])
+    assert model.texts == ["a", "bb"]  # duplicates are embedded once
+    assert first["embeddings"][0] == first["embeddings"][2] == [float(1 + i) for i in range(DIM)]
+
+    # a new process: everything comes from disk
+    cache.close()
+    model.texts = []
+    cache = EmbeddingCache(tmp_path / "cache")
+    result = _embed(cache, model, model_file, ["bb", "a", "ccc"])
+    assert model.texts == ["ccc"]
+    assert result["embeddings"] == [first["embeddings"][1], first["embeddings"][0], [float(3 + i) for i in range(DIM)]]
+    assert result["n_prompt_tokens"] == 1
+    assert _embed(cache, model, model_file, "bb")["embeddings"] == first["embeddings"][1]
+
+
+def test_cache_key_covers_model_and_options(tmp_path: Path, model_file: Path):
+    cache = EmbeddingCache(tmp_path / "cache")
+    h = cache.model_hash(model_file)
+    assert cache.model_hash(model_file) == h
+    keys = {
+        embedding_key(h, None, -1, "mean", "a"),
+        embedding_key(h, "search_query", -1, "mean", "a"),
+        embedding_key(h, None, 64, "mean", "a"),
+        embedding_key(h, None, -1, "truncate", "a"),
+        embedding_key("other", None, -1, "mean", "a"),
+    }
+    assert len(keys) == 5
+
+    model_file.write_bytes(b"GGUF" + bytes(200))
+    assert cache.model_hash(model_file) != h
+
+
+def test_cache_eviction(tmp_path: Path, model_file: Path):
+    model = _CountingModel()
+    row = DIM * 4
+    cache = EmbeddingCache(tmp_path / "cache", max_bytes=10 * row)
+    _embed(cache, model, model_file, [f"t{i}" for i in range(8)])
+    _embed(cache, model, model_file, ["t0"])  # recently used, survives eviction
+    _embed(cache, model, model_file, [f"u{i}" for i in range(4)])
+    assert cache.size <= 10 * row
+    assert len(cache) == 7
+
+    model.texts = []
+    _embed(cache, model, model_file, ["t0", "u3"])
+    assert model.texts == []
+    assert len(EmbeddingCache(tmp_path / "cache")) == 7
+
+
+def test_cache_as_array(tmp_path: Path, model_file: Path):
+    np = pytest.importorskip("numpy")
+    model = _CountingModel()
+    cache = EmbeddingCache(tmp_path / "cache")
+    _embed(cache, model, model_file, ["a", "bb"])
+    result = _embed(cache, model, model_file, ["bb", "ccc", "a"], as_array=True)
+    assert result["embeddings"].shape == (3, DIM) and result["embeddings"].dtype == np.float32
+    assert result["embeddings"][2].tolist() == [float(1 + i) for i in range(DIM)]
@@ -0,0 +1,95 @@
+import struct
+from pathlib import Path
+
+import pytest
+
+from gpt4all._gguf import MAX_ARRAY_LENGTH, GGUFArray, _parse, read_gguf
+
+LLAMA3_TEMPLATE = "{% for m in messages %}<|start_header_id|>{{ m.role }}<|end_header_id|>{% endfor %}"
+
+
+def _string(s: str) -> bytes:
+    data = s.encode()
+    return struct.pack("<Q", len(data)) + data
+
+
+def _kv(key: str, vtype: int, payload: bytes) -> bytes:
+    return _string(key) + struct.pack("<I", vtype) + payload
+
+
+def write_gguf(path: Path, vocab_size: int = 5000) -> None:
+    kvs = [
+        _kv("general.architecture", 8, _string("llama")),
+        _kv("general.name", 8, _string("Tiny Llama")),
+        _kv("llama.context_length", 4, struct.pack("<I", 131072)),
+        _kv("llama.block_count", 4, struct.pack("<I", 2)),
+        _kv("llama.embedding_length", 4, struct.pack("<I", 64)),
+        _kv("llama.attention.head_count", 4, struct.pack("<I", 4)),
+        _kv("llama.attention.head_count_kv", 4, struct.pack("<I", 2)),
+        _kv("llama.rope.freq_base", 6, struct.pack("<f", 500000.0)),
+        _kv("tokenizer.chat_template", 8, _string(LLAMA3_TEMPLATE)),
+        _kv("tokenizer.ggml.tokens", 9, struct.pack("<IQ", 8, vocab_size)
+            + b"".join(_string(f"tok{i}") for i in range(vocab_size))),
+        _kv("tokenizer.ggml.scores", 9, struct.pack("<IQ", 6, vocab_size) + bytes(4 * vocab_size)),
+        _kv("tokenizer.ggml.eos_token_ids", 9, struct.pack("<IQ", 5, 2) + struct.pack("<2i", 1, 2)),
+    ]
+    tensors = [
+        _string("token_embd.weight") + struct.pack("<I2QIQ", 2, 64, vocab_size, 0, 0),
+        _string("output_norm.weight") + struct.pack("<I1QIQ", 1, 64, 0, 64 * vocab_size * 4),
+    ]
+    header = b"GGUF" + struct.pack("<IQQ", 3, len(tensors), len(kvs)) + b"".join(kvs) + b"".join(tensors)
+    padding = -len(header) % 32
+    with open(path, "wb") as f:
+        f.write(header + bytes(padding) + bytes(64 * vocab_size * 4 + 64 * 4))
+
+
+def test_read_gguf(tmp_path: Path):
+    path = tmp_path / "tiny.gguf"
+    write_gguf(path)
+    info = read_gguf(path)
+
+    assert info.version == 3
+    assert info.architecture == "llama"
+    assert info.name == "Tiny Llama"
+    assert info.context_length == 131072
+    assert info.chat_format == "llama3"
+    assert info.get("llama.rope.freq_base") == 500000.0
+    assert info.get("tokenizer.ggml.eos_token_ids") == [1, 2]
+    assert info.get("tokenizer.ggml.tokens") == GGUFArray(8, 5000)
+    assert info.get("tokenizer.ggml.scores") == GGUFArray(6, 5000)
+
+    assert [t.name for t in info.tensors] == ["token_embd.weight", "output_norm.weight"]
+    assert info.tensors[0].shape == (64, 5000)
+    assert info.data_offset % 32 == 0
+    assert info.tensors[1].offset == info.data_offset + 64 * 5000 * 4
+    assert info.weights_size == 64 * 5000 * 4 + 64 * 4
+    # 2 layers * 1024 tokens * 2 kv heads * (16 + 16) dims * 2 bytes
+    assert info.kv_cache_size(1024) == 2 * 1024 * 2 * 32 * 2
+
+    assert read_gguf(path, max_array_length=10**6).get("tokenizer.ggml.tokens")[4999] == "tok4999"
+
+
+def test_read_gguf_only_touches_the_header(tmp_path: Path):
+    path = tmp_path / "vocab.gguf"
+    write_gguf(path, vocab_size=128000)
+    info = read_gguf(path)
+    assert info.get("tokenizer.ggml.tokens") == GGUFArray(8, 128000)
+
+    # The header bytes alone parse to the same result for a file of any size, so the tensor data is never read.
+    header = path.read_bytes()[:info.data_offset]
+    again = _parse(str(path), header, 2**40, MAX_ARRAY_LENGTH)
+    assert again.metadata == info.metadata
+    assert again.tensors == info.tensors
+    assert again.weights_size == 2**40 - info.data_offset
+
+
+def test_read_gguf_rejects_other_files(tmp_path: Path):
+    path = tmp_path / "model.bin"
+    path.write_bytes(b"ggml" + bytes(100))
+    with pytest.raises(ValueError):
+        read_gguf(path)
+
+    write_gguf(path)
+    path.write_bytes(path.read_bytes()[:200])
+    with pytest.raises(ValueError):
+        read_gguf(path)
@@ -1,8 +1,10 @@
+import asyncio
 import sys
+import threading
 from io import StringIO
 from pathlib import Path
 
-from gpt4all import GPT4All, Embed4All
+from gpt4all import AsyncGPT4All, GPT4All, Embed4All
 import time
 import pytest
 
@@ -33,6 +35,70 @@ def test_inference():
         print(model.current_chat_session)
 
 
+def test_state_save_restore():
+    model = GPT4All(model_name='orca-mini-3b-gguf2-q4_0.gguf')
+    llmodel = model.model
+    llmodel.prompt_model('The capital of France is', '%1%2', lambda *_: True, n_predict=0, reset_context=True)
+    state = llmodel.save_state()
+    assert 0 < state.size <= llmodel.state_size()
+    assert state.n_past == llmodel.n_past
+
+    def complete():
+        tokens = []
+        llmodel.prompt_model(' ', '%1%2', lambda _, r: tokens.append(r) or True, n_predict=5, top_k=1)
+        return ''.join(tokens)
+
+    first = complete()
+    assert llmodel.restore_state(state)
+    assert llmodel.n_past == state.n_past
+    assert complete() == first
+
+
+def test_streaming_close():
+    model = GPT4All(model_name='orca-mini-3b-gguf2-q4_0.gguf')
+    threads = threading.active_count()
+    for _ in range(3):
+        with model.model.prompt_model_streaming('write me a poem about dogs', '%1', n_predict=200) as stream:
+            next(stream)
+        assert stream.aborted
+    # the model is idle again and all streams share one worker thread
+    assert model.generate('hello', max_tokens=5, top_k=1)
+    assert threading.active_count() <= threads + 1
+    model.close()
+    assert threading.active_count() <= threads
+
+
+def test_async_generate():
+    async def run():
+        async with await AsyncGPT4All.load('orca-mini-3b-gguf2-q4_0.gguf') as model:
+            text = await model.generate('hello', max_tokens=8, top_k=1)
+            streamed = [token async for token in model.stream('hello', max_tokens=8, top_k=1)]
+            assert ''.join(streamed) == text
+
+            task = asyncio.create_task(model.generate('write me a poem about dogs', max_tokens=500))
+            await asyncio.sleep(0.5)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            # the cancelled generation has stopped and the model is usable again
+            assert await model.generate('hello', max_tokens=8, top_k=1) == text
+
+    asyncio.run(run())
+
+
+def test_chat_session_token_budget():
+    model = GPT4All(model_name='orca-mini-3b-gguf2-q4_0.gguf')
+    with model.chat_session(token_budget=200):
+        for _ in range(8):
+            model.generate('Tell me one fact about Rome.', max_tokens=30, top_k=1)
+            # compaction runs in the background once a reply crosses the budget
+            model._wait_for_compaction()
+            assert model.model.n_past <= 200
+        # old turns were dropped, the latest one is always kept
+        assert 1 < len(model.current_chat_session) < 17
+        assert model.current_chat_session[-1]['role'] == 'assistant'
+
+
 def do_long_input(model):
     long_input = " ".join(["hello how are you"] * 40)
 
@@ -104,6 +170,16 @@ def test_embedding():
     assert len(output) == 384
 
 
+def test_embedding_as_array():
+    np = pytest.importorskip("numpy")
+    texts = ['The quick brown fox', 'jumps over the lazy dog', 'The quick brown fox jumps over the lazy dog']
+    embedder = Embed4All()
+    output = embedder.embed(texts, as_array=True)
+    assert output.shape == (3, 384) and output.dtype == np.float32 and output.flags['C_CONTIGUOUS']
+    assert np.allclose(output, np.asarray(embedder.embed(texts), dtype=np.float32))
+    assert embedder.embed(texts[0], as_array=True).shape == (384,)
+
+
 def test_empty_embedding():
     text = ''
     embedder = Embed4All()
@@ -0,0 +1,83 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from gpt4all._registry import ModelRegistry
+
+MODELS = [{"filename": "tiny.gguf", "filesize": "4", "md5sum": "00", "promptTemplate": "%1 %2"}]
+
+
+class _RegistryHandler(BaseHTTPRequestHandler):
+    etag = '"v1"'
+    models = MODELS
+    requests: list = []
+
+    def do_GET(self):
+        type(self).requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = json.dumps(self.models).encode()
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    _RegistryHandler.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _RegistryHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd, f"http://127.0.0.1:{httpd.server_address[1]}/models3.json"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_registry_ttl_and_revalidation(server, tmp_path: Path):
+    httpd, url = server
+    registry = ModelRegistry(tmp_path / "models3.json", url=url, ttl=60)
+    assert registry.models() == MODELS
+    assert registry.models() == MODELS  # fresh: served from disk
+    assert len(_RegistryHandler.requests) == 1
+
+    registry.ttl = 0
+    assert registry.models() == MODELS  # stale: conditional request, 304
+    assert _RegistryHandler.requests[-1]["If-None-Match"] == '"v1"'
+    assert len(_RegistryHandler.requests) == 2
+
+
+def test_registry_offline(server, tmp_path: Path):
+    httpd, url = server
+    with pytest.raises(ValueError):
+        ModelRegistry(tmp_path / "models3.json", url=url, offline=True).models()
+    ModelRegistry(tmp_path / "models3.json", url=url).models()
+
+    offline = ModelRegistry(tmp_path / "models3.json", url=url, ttl=0, offline=True)
+    assert offline.find("tiny.gguf")["md5sum"] == "00"
+    assert offline.find("unknown.gguf") is None
+    assert len(_RegistryHandler.requests) == 1
+
+
+def test_registry_find_does_not_wait_for_network(server, tmp_path: Path):
+    httpd, url = server
+    ModelRegistry(tmp_path / "models3.json", url=url).models()
+    httpd.shutdown()  # the server is gone, the cache is stale
+    httpd.server_close()
+
+    registry = ModelRegistry(tmp_path / "models3.json", url=url, ttl=0)
+    start = time.monotonic()
+    assert registry.find("tiny.gguf")["filename"] == "tiny.gguf"
+    assert time.monotonic() - start < 1
+    # failed revalidation keeps the cached list
+    assert registry.models() == MODELS
@@ -0,0 +1,53 @@
+import json
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from gpt4all._sharded import embed_sharded
+
+DIM = 4
+
+
+class _LengthEmbedder:
+    """Stands in for Embed4All in the workers: the vector of a text is derived from its length."""
+
+    def embed_corpus(self, texts, as_array=False, **kwargs):
+        for text in texts:
+            if text == "fail":
+                raise RuntimeError("embedding failed")
+            yield np.full(DIM, float(len(text)), dtype=np.float32)
+
+
+def _factory():
+    return _LengthEmbedder()
+
+
+def test_embed_sharded(tmp_path: Path):
+    texts = ["x" * i for i in range(1, 51)]
+    seen = []
+    out = embed_sharded(texts, tmp_path / "vectors.npy", processes=2, shard_size=8, dimensionality=DIM,
+                        progress=lambda done, total: seen.append((done, total)), embedder_factory=_factory)
+    assert out.shape == (50, DIM) and out.dtype == np.float32
+    assert out[:, 0].tolist() == [float(i) for i in range(1, 51)]
+    assert seen[0] == (0, 50) and seen[-1] == (50, 50)
+    assert len(list((tmp_path / "vectors.npy.shards").glob("shard-*.json"))) == 7
+
+
+def test_embed_sharded_resumes(tmp_path: Path):
+    texts = ["x" * i for i in range(1, 25)]
+    texts[20] = "fail"
+    with pytest.raises(RuntimeError):
+        embed_sharded(texts, tmp_path / "vectors.npy", processes=1, shard_size=8, dimensionality=DIM,
+                      embedder_factory=_factory)
+    checkpoints = tmp_path / "vectors.npy.shards"
+    assert {p.name for p in checkpoints.glob("shard-*.json")} == {"shard-000000.json", "shard-000001.json"}
+
+    texts[20] = "x" * 21
+    seen = []
+    out = embed_sharded(texts, tmp_path / "vectors.npy", processes=1, shard_size=8, dimensionality=DIM,
+                        progress=lambda done, total: seen.append(done), embedder_factory=_factory)
+    assert seen == [16, 24]  # the first two shards were not embedded again
+    assert out[:, 0].tolist() == [float(i) for i in range(1, 25)]
+    assert json.loads((checkpoints / "shard-000002.json").read_text())["rows"] == 8
@@ -0,0 +1,199 @@
+# inference_worker.py — background dialogue evaluation for Ren'Py screens
+import itertools
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+EvaluateFn = Callable[[str, str, Callable[[str], bool], Callable[[bool], None]], Tuple[bool, str]]
+
+
+class EvaluationRequest:
+    """A queued player answer and the state the screen can observe."""
+
+    def __init__(self, request_id: int, player_text: str, target_id: str) -> None:
+        self.request_id = request_id
+        self.player_text = player_text
+        self.target_id = target_id
+        self.status = PENDING
+        self.ok = False
+        self.verdict: Optional[bool] = None
+        self.feedback = ""
+        self.error: Optional[str] = None
+        self.submitted_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._chunks: List[str] = []
+        self.revision = 0
+        self._cancelled = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self) -> None:
+        """Ask the generation to stop at the next token boundary."""
+        self._cancelled.set()
+
+    def append_token(self, text: str) -> bool:
+        """Called on the worker thread for every piece of streamed output.
+
+        Returns False once the request was cancelled, which the response
+        callback passes on to the model to stop generating.
+        """
+        if self.cancelled:
+            return False
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        self._chunks.append(text)
+        self.revision += 1
+        return True
+
+    def set_verdict(self, ok: bool) -> None:
+        """Called on the worker thread once the model committed to a verdict."""
+        self.verdict = ok
+
+    @property
+    def partial_text(self) -> str:
+        return "".join(self._chunks)
+
+
+class InferenceWorker:
+    """Runs dialogue evaluations one at a time on a daemon thread.
+
+    The Ren'Py interaction thread only ever enqueues requests and polls their
+    state, so rendering keeps going while the model is busy.
+    """
+
+    def __init__(self, evaluate: EvaluateFn, warm_up: Optional[Callable[[], None]] = None) -> None:
+        self._evaluate = evaluate
+        self._warm_up = warm_up
+        self._queue: "queue.Queue[int]" = queue.Queue()
+        self._requests: Dict[int, EvaluationRequest] = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="holmes-inference", daemon=True)
+            self._thread.start()
+
+    def submit(self, player_text: str, target_id: str) -> int:
+        """Queue an evaluation and return its request id.
+
+        Any earlier request for the same target that has not finished is
+        superseded: queued ones are dropped and a running one is cancelled,
+        so only the latest answer per target reaches the model.
+        """
+        self.start()
+        request_id = next(self._ids)
+        with self._lock:
+            for request in self._requests.values():
+                if request.target_id == target_id and not request.finished:
+                    request.cancel()
+            self._requests[request_id] = EvaluationRequest(request_id, player_text, target_id)
+        self._queue.put(request_id)
+        return request_id
+
+    def cancel(self, request_id: Optional[int]) -> None:
+        """Stop a request in any state and forget it; its result is never consumed."""
+        with self._lock:
+            request = self._requests.pop(request_id, None)
+        if request is not None:
+            request.cancel()
+
+    def cancel_target(self, target_id: str) -> None:
+        """Cancel every unfinished request for target_id."""
+        with self._lock:
+            for request in self._requests.values():
+                if request.target_id == target_id and not request.finished:
+                    request.cancel()
+
+    def poll(self, request_id: Optional[int]) -> Optional[EvaluationRequest]:
+        if request_id is None:
+            return None
+        with self._lock:
+            return self._requests.get(request_id)
+
+    def is_pending(self, request_id: Optional[int]) -> bool:
+        request = self.poll(request_id)
+        return request is not None and not request.finished
+
+    def discard(self, request_id: Optional[int]) -> None:
+        """Forget a finished request once its result has been consumed."""
+        with self._lock:
+            request = self._requests.get(request_id)
+            if request is not None and request.finished:
+                del self._requests[request_id]
+
+    # ------------------------------------------------------------------
+    # Worker thread
+    # ------------------------------------------------------------------
+    def _run(self) -> None:
+        if self._warm_up is not None:
+            try:
+                self._warm_up()
+            except Exception as e:
+                print(f"[HOLMES] ERROR while warming up the evaluator: {e}")
+        while True:
+            request_id = self._queue.get()
+            request = self.poll(request_id)
+            if request is None:
+                continue
+            if request.cancelled:
+                self._finish_cancelled(request)
+                continue
+            request.status = RUNNING
+            request.started_at = time.monotonic()
+            try:
+                ok, feedback = self._evaluate(
+                    request.player_text, request.target_id, request.append_token, request.set_verdict,
+                )
+                if request.cancelled:
+                    self._finish_cancelled(request)
+                    continue
+                request.ok = bool(ok)
+                request.feedback = feedback
+                request.status = DONE
+            except Exception as e:
+                print(f"[HOLMES] ERROR in inference worker: {e}")
+                request.error = str(e)
+                request.feedback = f"[Error during inference: {e}]"
+                request.status = FAILED
+            finally:
+                request.finished_at = time.monotonic()
+
+    def _finish_cancelled(self, request: EvaluationRequest) -> None:
+        # Nobody waits for a cancelled request, so it is not kept around.
+        request.status = CANCELLED
+        with self._lock:
+            self._requests.pop(request.request_id, None)
+
+
+_worker: Optional[InferenceWorker] = None
+_worker_lock = threading.Lock()
+
+
+def get_worker() -> InferenceWorker:
+    """Return the process-wide worker, creating it on first use."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            from python.dialogue_logic import evaluate, warm_up
+
+            _worker = InferenceWorker(evaluate, warm_up)
+        return _worker
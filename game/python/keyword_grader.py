@@ -0,0 +1,129 @@
+# keyword_grader.py — instant verdicts from the authored interaction keywords
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+from python.game_data import GameData
+
+# Shortest stem we are willing to compare by prefix ("hunger" ~ "hungry").
+MIN_ROOT = 4
+# A keyword is negated when one of this many words before it is a negator.
+NEGATION_WINDOW = 3
+# A clear hit also needs this many content words, of which keywords make up
+# at most MAX_KEYWORD_SHARE, so a bare list of keywords is left to the LLM.
+MIN_PASS_CONTENT_WORDS = 4
+MAX_KEYWORD_SHARE = 0.5
+
+_WORD = re.compile(r"[^\W\d_]+", re.UNICODE)
+# Words with their apostrophes kept, so "isn't" can be read as a negation.
+_TOKEN = re.compile(r"[^\W\d_]+(?:['\u2019][^\W\d_]+)*", re.UNICODE)
+_SUFFIXES = (
+    "ations", "ation", "ities", "ity", "ments", "ment", "ness", "ings", "ing",
+    "ies", "ied", "ers", "er", "ed", "es", "ly", "s", "y",
+)
+_STOPWORDS = frozenset(
+    "a an and are as at be but by do does for from have he her his i if in is it its "
+    "me my no not of on or our she so that the their them they this to us was we were "
+    "what who why will with you your yes ok okay maybe idk dunno".split()
+)
+_NEGATORS = frozenset("not no never none nor neither nothing nobody without hardly".split())
+
+Verdict = Tuple[bool, str]
+
+
+def stem(word: str) -> str:
+    """Case-fold and strip one common English suffix, keeping at least three letters."""
+    word = word.casefold()
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[: -len(suffix)]
+    return word
+
+
+def _is_negator(token: str) -> bool:
+    token = token.casefold().replace("\u2019", "'")
+    return token in _NEGATORS or token.endswith("n't")
+
+
+def _stems_match(a: str, b: str) -> bool:
+    if a == b:
+        return True
+    shorter, longer = (a, b) if len(a) <= len(b) else (b, a)
+    return len(shorter) >= MIN_ROOT and longer.startswith(shorter)
+
+
+class KeywordGrader:
+    """Grades answers against every interaction's keywords with one shared index.
+
+    The index maps the first MIN_ROOT letters of each keyword stem to the
+    (interaction, keyword) pairs that use it, so grading an answer costs one
+    dict lookup per word regardless of how many interactions exist. Answers
+    that hit enough keywords inside a sentence of real content pass, answers
+    with no keyword and almost no content fail, and everything in between
+    (including any answer that negates a keyword) is left for the LLM.
+    """
+
+    def __init__(self, game_data: Optional[GameData] = None, pass_hits: int = 2) -> None:
+        self.pass_hits = pass_hits
+        self._index: Dict[str, List[Tuple[str, int, str]]] = {}
+        self._keyword_counts: Dict[str, int] = {}
+        self._feedback: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+        game_data = game_data or GameData()
+        for interaction in game_data.iter_interactions():
+            interaction_id = str(interaction.get("id"))
+            dialogue = interaction.get("dialogue") or {}
+            if not isinstance(dialogue, dict):
+                continue
+            keywords = [k for k in dialogue.get("keywords", []) or [] if isinstance(k, str) and k.strip()]
+            self._keyword_counts[interaction_id] = len(keywords)
+            self._feedback[interaction_id] = (dialogue.get("success_feedback"), dialogue.get("failure_feedback"))
+            for position, keyword in enumerate(keywords):
+                for word in _WORD.findall(keyword):
+                    keyword_stem = stem(word)
+                    self._index.setdefault(keyword_stem[:MIN_ROOT], []).append((interaction_id, position, keyword_stem))
+
+    def _matches(self, target_id: str, answer: str) -> Tuple[Set[int], Set[int], int]:
+        """Positions of the target's keywords used plainly and after a negator, and the words that hit one."""
+        hits: Set[int] = set()
+        negated: Set[int] = set()
+        keyword_words = 0
+        last_negator = None
+        for i, token in enumerate(_TOKEN.findall(answer or "")):
+            if _is_negator(token):
+                last_negator = i
+                continue
+            is_negated = last_negator is not None and i - last_negator <= NEGATION_WINDOW
+            matched = False
+            for word in _WORD.findall(token):
+                word_stem = stem(word)
+                for interaction_id, position, keyword_stem in self._index.get(word_stem[:MIN_ROOT], ()):
+                    if interaction_id == target_id and _stems_match(word_stem, keyword_stem):
+                        (negated if is_negated else hits).add(position)
+                        matched = True
+            keyword_words += matched
+        return hits, negated, keyword_words
+
+    def matched_keywords(self, target_id: str, answer: str) -> Set[int]:
+        """Positions of the target's keywords that appear in the answer without a negator before them."""
+        return self._matches(target_id, answer)[0]
+
+    def grade(self, target_id: str, answer: str) -> Optional[Verdict]:
+        """Return (ok, feedback) for a clear hit or miss, or None when the LLM should decide."""
+        n_keywords = self._keyword_counts.get(target_id, 0)
+        if n_keywords == 0:
+            return None
+        success, failure = self._feedback.get(target_id, (None, None))
+        hits, negated, keyword_words = self._matches(target_id, answer)
+        if negated:
+            # "not hunger" is no hit but not a clear miss either.
+            return None
+        content = [w for w in _WORD.findall(answer or "") if w.casefold() not in _STOPWORDS]
+        if (
+            len(hits) >= min(self.pass_hits, n_keywords)
+            and success
+            and len(content) >= MIN_PASS_CONTENT_WORDS
+            and keyword_words <= MAX_KEYWORD_SHARE * len(content)
+        ):
+            return True, success
+        if not hits and failure and len(content) <= 1:
+            return False, failure
+        return None
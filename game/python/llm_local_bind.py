@@ -1,6 +1,8 @@
 # llm_local_bind.py — minimal GPT4All bootstrap for Ren'Py
 import os
 import sys
+import threading
+import time
 
 _current = os.path.abspath(os.path.dirname(__file__))
 _game_root = os.path.abspath(os.path.join(_current, os.pardir))
@@ -9,44 +11,251 @@ for path in (_current, _game_root):
     if path not in sys.path:
         sys.path.insert(0, path)
 
-try:
-    from gpt4all import GPT4All
-except Exception as e:
-    print(f"[HOLMES] ERROR: cannot import GPT4All — {e}")
-    print("[HOLMES] Expected path:", os.path.join(_current, "gpt4all"))
-    GPT4All = None
+from python.autotune import load_profile
+from python.prefix_cache import PrefixCache
 
 MODEL_NAME = "Llama-3.2-1B-Instruct-Q4_0.gguf"
 MODEL_DIR = os.path.join(_current, "llm")
 MODEL_PATH = os.path.join(MODEL_DIR, MODEL_NAME)
+CACHE_DIR = os.path.join(_game_root, "data", "cache")
+# Content-addressed embedding vectors shared by everything that embeds text.
+EMBEDDING_CACHE_DIR = os.path.join(CACHE_DIR, "embeddings")
+# Written by `python -m python.autotune`, applied on every load.
+TUNING_PROFILE_PATH = os.path.join(CACHE_DIR, "tuning_profiles.json")
+# Used until the machine has been tuned.
+DEFAULT_N_CTX = 2048
+DEFAULT_N_BATCH = 128
 DEFAULT_GENERATE_KWARGS = {
     "max_tokens": 128,
     "temp": 0.35,
     "top_p": 0.92,
     "repeat_penalty": 1.1,
-    "n_batch": 4,
 }
 
-_model = None
-if GPT4All is not None:
-    try:
-        _model = GPT4All(model_name=MODEL_NAME, model_path=MODEL_DIR, allow_download=False)
-        print(f"[HOLMES] GPT4All model loaded successfully from: {MODEL_PATH}")
-    except Exception as e:
-        print(f"[HOLMES] ERROR while loading GPT4All model: {e}")
+# Loader states, in the order a successful load goes through them.
+LOAD_IDLE = "idle"
+LOAD_IMPORTING = "importing"
+LOAD_READING = "reading"
+LOAD_READY = "ready"
+LOAD_FAILED = "failed"
+
+_LOAD_PROGRESS = {
+    LOAD_IDLE: 0.0,
+    LOAD_IMPORTING: 0.1,
+    LOAD_READING: 0.3,
+    LOAD_READY: 1.0,
+    LOAD_FAILED: 1.0,
+}
+
 
-def generate_sync(prompt: str, **generate_kwargs):
+class ModelLoader:
+    """Loads the GPT4All model on a daemon thread and reports its progress.
+
+    Importing this module is cheap; nothing touches the GGUF file until
+    start() is called (normally at game boot from init_data.rpy).
+    """
+
+    def __init__(self, model_name: str, model_dir: str, n_threads=None) -> None:
+        self.model_name = model_name
+        self.model_dir = model_dir
+        self.n_threads = n_threads
+        self.n_ctx = DEFAULT_N_CTX
+        self.n_batch = DEFAULT_N_BATCH
+        self.profile = None
+        self.info = None
+        self.state = LOAD_IDLE
+        self.error = None
+        self.model = None
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread = None
+
+    @property
+    def progress(self) -> float:
+        return _LOAD_PROGRESS.get(self.state, 0.0)
+
+    def is_ready(self) -> bool:
+        return self.state == LOAD_READY
+
+    def start(self) -> None:
+        """Begin loading in the background; later calls are no-ops."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.started_at = time.monotonic()
+            self._thread = threading.Thread(target=self._load, name="holmes-model-loader", daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout=None):
+        """Block until loading finished or timeout elapsed; return the model or None."""
+        self.start()
+        self._done.wait(timeout)
+        return self.model
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "progress": self.progress,
+            "error": self.error,
+        }
+
+    def _apply_profile(self) -> None:
+        # An explicit n_threads (e.g. from the model pool) wins over the profile.
+        profile = load_profile(TUNING_PROFILE_PATH, os.path.join(self.model_dir, self.model_name))
+        if not profile:
+            return
+        self.profile = profile
+        if self.n_threads is None:
+            self.n_threads = profile.get("n_threads")
+        self.n_ctx = int(profile.get("n_ctx") or self.n_ctx)
+        self.n_batch = int(profile.get("n_batch") or self.n_batch)
+        print(f"[HOLMES] Using tuned settings: n_threads={self.n_threads} n_batch={self.n_batch} n_ctx={self.n_ctx}")
+
+    def _apply_metadata(self) -> None:
+        # The GGUF header costs milliseconds to read; the full load takes seconds.
+        self.info = model_info(os.path.join(self.model_dir, self.model_name))
+        if self.info is None:
+            return
+        trained_ctx = self.info.context_length
+        if trained_ctx is not None and self.n_ctx > trained_ctx:
+            print(f"[HOLMES] n_ctx={self.n_ctx} exceeds the model's context length, using {trained_ctx}")
+            self.n_ctx = trained_ctx
+        needed_mib = self.info.memory_estimate(self.n_ctx) / 2**20
+        print(f"[HOLMES] Loading {self.info.name or self.model_name} ({self.info.architecture}), "
+              f"about {needed_mib:.0f} MiB with n_ctx={self.n_ctx}")
+
+    def _load(self) -> None:
+        try:
+            self.state = LOAD_IMPORTING
+            try:
+                from gpt4all import GPT4All
+            except Exception as e:
+                print(f"[HOLMES] ERROR: cannot import GPT4All — {e}")
+                print("[HOLMES] Expected path:", os.path.join(_current, "gpt4all"))
+                raise
+
+            self.state = LOAD_READING
+            self._apply_profile()
+            self._apply_metadata()
+            self.model = GPT4All(
+                model_name=self.model_name,
+                model_path=self.model_dir,
+                allow_download=False,
+                n_threads=self.n_threads,
+                n_ctx=self.n_ctx,
+            )
+            self.state = LOAD_READY
+            print(f"[HOLMES] GPT4All model loaded successfully from: {os.path.join(self.model_dir, self.model_name)}")
+        except Exception as e:
+            print(f"[HOLMES] ERROR while loading GPT4All model: {e}")
+            self.error = str(e)
+            self.state = LOAD_FAILED
+        finally:
+            self.finished_at = time.monotonic()
+            self._done.set()
+
+
+_model_info = {}
+_model_info_lock = threading.Lock()
+
+
+def model_info(model_path: str = MODEL_PATH):
+    """
+    Return the GGUF metadata (gpt4all.GGUFInfo) of a model file without
+    loading the model, or None if the file is missing or unreadable.
+    The result is cached per path.
+    """
+    with _model_info_lock:
+        if model_path not in _model_info:
+            try:
+                from gpt4all import read_gguf
+
+                _model_info[model_path] = read_gguf(model_path)
+            except Exception as e:
+                print(f"[HOLMES] WARNING: cannot read model metadata from {model_path}: {e}")
+                _model_info[model_path] = None
+        return _model_info[model_path]
+
+
+_loader = ModelLoader(MODEL_NAME, MODEL_DIR)
+_prefix_cache = PrefixCache(n_batch=_loader.n_batch)
+
+
+def start_loading(n_threads=None) -> None:
+    """
+    Kick off background model loading (safe to call repeatedly).
+    n_threads sets the CPU thread count if loading has not started yet;
+    by default GPT4All picks it.
+    """
+    if n_threads is not None and _loader.state == LOAD_IDLE:
+        _loader.n_threads = n_threads
+    _loader.start()
+
+
+def is_model_ready() -> bool:
+    return _loader.is_ready()
+
+
+def get_load_status() -> dict:
+    """Return {"state", "progress", "error"} describing the model loader."""
+    return _loader.status()
+
+
+def wait_for_model(timeout=None):
+    """Wait up to timeout seconds for the model; returns it, or None if unavailable."""
+    return _loader.wait(timeout)
+
+
+def _unavailable_message() -> str:
+    if _loader.state == LOAD_FAILED:
+        return "[Error] GPT4All not available or failed to load."
+    return "[Error] GPT4All model is still loading."
+
+
+def _stream_callback(on_token):
+    def _callback(token_id: int, response: str) -> bool:
+        if response:
+            return on_token(response) is not False
+        return True
+
+    return _callback
+
+
+def _finish_output(text_output: str, prompt: str) -> str:
+    print(f"[HOLMES] GPT4All output: {text_output}")
+
+    if not text_output:
+        snippet = prompt[:120].replace("\n", " ") + ("..." if len(prompt) > 120 else "")
+        print(f"[HOLMES] WARNING: GPT4All returned empty output for prompt: {snippet}")
+        return "[Error] Local model produced no output."
+
+    return text_output.strip()
+
+
+def generate_sync(prompt: str, on_token=None, load_timeout=None, **generate_kwargs):
     """
     Generate a response from the local GPT4All model using the prompt provided.
     Accepts optional keyword arguments for GPT4All.generate.
+    If on_token is given it is called with each decoded piece of text as the
+    model produces it and may return False to stop generation; the output
+    produced so far is still returned at the end.
+    Waits up to load_timeout seconds (forever by default) for a model that
+    is still loading in the background.
     """
-    if _model is None:
-        return "[Error] GPT4All not available or failed to load."
+    model = wait_for_model(load_timeout)
+    if model is None:
+        return _unavailable_message()
 
     try:
         params = DEFAULT_GENERATE_KWARGS.copy()
+        params["n_batch"] = _loader.n_batch
         params.update(generate_kwargs)
-        raw_output = _model.generate(prompt, **params)
+        if on_token is not None:
+            params["callback"] = _stream_callback(on_token)
+        with _prefix_cache.lock:
+            raw_output = model.generate(prompt, **params)
         if isinstance(raw_output, str):
             text_output = raw_output
         else:
@@ -54,15 +263,49 @@ def generate_sync(prompt: str, **generate_kwargs):
                 text_output = "".join(raw_output)
             except TypeError:
                 text_output = str(raw_output)
-        print(f"[HOLMES] GPT4All output: {text_output}")
+        return _finish_output(text_output, prompt)
+    except Exception as e:
+        print(f"[HOLMES] ERROR during inference: {e}")
+        return f"[Error during inference: {e}]"
+
 
-        if not text_output:
-            snippet = prompt[:120].replace("\n", " ") + ("..." if len(prompt) > 120 else "")
-            print(f"[HOLMES] WARNING: GPT4All returned empty output for prompt: {snippet}")
-            return "[Error] Local model produced no output."
+def generate_with_prefix(prefix: str, suffix: str, on_token=None, load_timeout=None, **generate_kwargs):
+    """
+    Same contract as generate_sync for the prompt prefix + suffix, but the
+    prefix is ingested once and its KV state reused by later calls, so each
+    request only pays for the suffix. Both parts are raw text and may contain
+    the chat template's special tokens.
+    """
+    model = wait_for_model(load_timeout)
+    if model is None:
+        return _unavailable_message()
 
-        return text_output.strip()
+    try:
+        params = DEFAULT_GENERATE_KWARGS.copy()
+        params["n_batch"] = _loader.n_batch
+        params.update(generate_kwargs)
+        if on_token is not None:
+            params["callback"] = _stream_callback(on_token)
+        text_output = _prefix_cache.generate(model, prefix, suffix, **params)
+        return _finish_output(text_output, prefix + suffix)
     except Exception as e:
         print(f"[HOLMES] ERROR during inference: {e}")
         return f"[Error during inference: {e}]"
 
+
+def warm_prefixes(prefixes, load_timeout=None) -> bool:
+    """
+    Make sure each prompt prefix has an in-memory state snapshot, so later
+    generate_with_prefix calls skip its ingestion.
+    Returns False if the model is unavailable.
+    """
+    model = wait_for_model(load_timeout)
+    if model is None:
+        return False
+    try:
+        # The loader's n_batch may have been tuned when the model was loaded.
+        _prefix_cache.warm(model, prefixes, n_batch=_loader.n_batch)
+        return True
+    except Exception as e:
+        print(f"[HOLMES] ERROR while warming prompt prefixes: {e}")
+        return False
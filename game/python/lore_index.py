@@ -0,0 +1,219 @@
+# lore_index.py — retrieve the game content most relevant to an answer, for grounded prompts
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from python.game_data import GameData
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; fall back to plain Python vectors
+    np = None
+
+# Snippets added to a prompt, and the most characters they may take together.
+TOP_K = 3
+MAX_CONTEXT_CHARS = 600
+# Longer texts are split at sentence ends into chunks of about this size.
+MAX_CHUNK_CHARS = 320
+
+_FORMAT_VERSION = 1
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+Chunk = Dict[str, Optional[str]]
+
+
+def _split(text: str, max_chars: int = MAX_CHUNK_CHARS) -> List[str]:
+    """Split text at sentence ends into pieces of at most about max_chars."""
+    pieces: List[str] = []
+    current = ""
+    for sentence in _SENTENCE_END.split(text.strip()):
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def lore_chunks(game_data: GameData) -> List[Chunk]:
+    """Every retrievable piece of content, tagged with its stage and area (None for stage-wide content)."""
+    chunks: List[Chunk] = []
+
+    def add(text, stage_id, area_id=None, source=None):
+        if isinstance(text, str) and text.strip():
+            for piece in _split(text):
+                chunks.append({"text": piece, "stage_id": stage_id, "area_id": area_id, "source": source})
+
+    for stage in game_data.stages():
+        if not isinstance(stage, dict) or not stage.get("id"):
+            continue
+        stage_id = str(stage["id"])
+        if stage.get("description"):
+            add(f"{stage.get('title', stage_id)}: {stage['description']}", stage_id)
+        for card in game_data.get_stage_context_cards(stage_id):
+            if card.get("text"):
+                add(f"{card.get('title', '')}: {card['text']}".lstrip(": "), stage_id)
+        for area in game_data.get_stage_areas(stage_id):
+            if not area.get("id"):
+                continue
+            area_id = str(area["id"])
+            if area.get("summary"):
+                add(f"{area.get('title', area_id)}: {area['summary']}", stage_id, area_id)
+            for interaction in area.get("interactions", []) or []:
+                dialogue = interaction.get("dialogue") if isinstance(interaction, dict) else None
+                if isinstance(dialogue, dict) and dialogue.get("text"):
+                    speaker = dialogue.get("header") or interaction.get("title") or "Someone"
+                    add(f"{speaker} says: \"{dialogue['text']}\"", stage_id, area_id, str(interaction.get("id")))
+    return chunks
+
+
+def _normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+class LoreIndex:
+    """Vector index over stage descriptions, context cards, area summaries and NPC lines.
+
+    The content is chunked and embedded once, in one streaming pass, and the
+    normalized vectors are persisted next to the other caches; they are
+    rebuilt only when game content or the embedding model change. A search
+    is one embedding of the query plus one matrix-vector product over the
+    rows of the requested stage and area.
+    """
+
+    def __init__(
+        self,
+        index_path: str,
+        get_embedder: Callable[[], object],
+        model_name: str,
+        game_data: Optional[GameData] = None,
+    ) -> None:
+        self.index_path = index_path
+        self.get_embedder = get_embedder
+        self.model_name = model_name
+        self._game_data = game_data or GameData()
+        self._lock = threading.Lock()
+        self._chunks: Optional[List[Chunk]] = None
+        self._matrix = None
+
+    def _content_key(self, chunks: List[Chunk]) -> str:
+        digest = hashlib.sha1()
+        digest.update(self.model_name.encode("utf-8"))
+        for chunk in chunks:
+            for field in ("stage_id", "area_id", "source", "text"):
+                digest.update(b"\0" + str(chunk.get(field)).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _set_matrix(self, chunks: List[Chunk], vectors) -> None:
+        if np is not None:
+            matrix = np.asarray(vectors, dtype=np.float32)
+            if matrix.size:
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                norms[norms == 0.0] = 1.0
+                matrix = matrix / norms
+            self._matrix = matrix
+        else:
+            self._matrix = [_normalize(v) for v in vectors]
+        self._chunks = chunks
+
+    def _load(self, key: str) -> bool:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as fh:
+                payload = json.load(fh)
+        except (OSError, ValueError):
+            return False
+        if payload.get("format") != _FORMAT_VERSION or payload.get("key") != key:
+            return False
+        self._set_matrix(payload["chunks"], payload["vectors"])
+        return True
+
+    def build(self) -> None:
+        """Embed every chunk (or load the index from disk) if not done yet."""
+        with self._lock:
+            if self._chunks is not None:
+                return
+            chunks = lore_chunks(self._game_data)
+            key = self._content_key(chunks)
+            if self._load(key):
+                return
+            embedder = self.get_embedder()
+            vectors = list(embedder.embed_corpus(c["text"] for c in chunks))
+            self._set_matrix(chunks, vectors)
+            # Per-process temp name: pool workers and the game read this file.
+            tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+                with open(tmp_path, "w", encoding="utf-8") as fh:
+                    json.dump({"format": _FORMAT_VERSION, "key": key, "chunks": chunks, "vectors": vectors}, fh)
+                os.replace(tmp_path, self.index_path)
+            except OSError as e:
+                print(f"[HOLMES] WARNING: could not write lore index: {e}")
+
+    def _rows(self, stage_id: Optional[str], area_id: Optional[str], exclude_source: Optional[str]) -> List[int]:
+        rows = []
+        for i, chunk in enumerate(self._chunks or []):
+            if stage_id is not None and chunk["stage_id"] != stage_id:
+                continue
+            # stage-wide content always applies; other areas' content does not
+            if area_id is not None and chunk["area_id"] not in (None, area_id):
+                continue
+            if exclude_source is not None and chunk["source"] == exclude_source:
+                continue
+            rows.append(i)
+        return rows
+
+    def search(
+        self,
+        query: str,
+        stage_id: Optional[str] = None,
+        area_id: Optional[str] = None,
+        k: int = TOP_K,
+        exclude_source: Optional[str] = None,
+    ) -> List[Tuple[float, Chunk]]:
+        """Return up to k (score, chunk) pairs most similar to query, best first."""
+        self.build()
+        rows = self._rows(stage_id, area_id, exclude_source)
+        if not rows or k <= 0:
+            return []
+        embedder = self.get_embedder()
+        if np is not None:
+            query_vector = embedder.embed(query, as_array=True)
+            scores = self._matrix[rows] @ query_vector / (float(np.linalg.norm(query_vector)) or 1.0)
+            top = np.argsort(-scores)[:k] if len(rows) <= k else np.argpartition(-scores, k)[:k]
+            ranked = sorted(((float(scores[j]), rows[j]) for j in top), reverse=True)
+        else:
+            query_vector = _normalize(embedder.embed(query))
+            scored = [(sum(a * b for a, b in zip(self._matrix[i], query_vector)), i) for i in rows]
+            ranked = sorted(scored, reverse=True)[:k]
+        return [(score, self._chunks[i]) for score, i in ranked]
+
+    def context_for(self, target_id: str, answer: str, k: int = TOP_K,
+                    max_chars: int = MAX_CONTEXT_CHARS) -> List[str]:
+        """Snippets to ground the evaluation of an answer to target_id.
+
+        The NPC's own line comes first, followed by the content of its stage
+        and area closest to the answer, until max_chars is reached.
+        """
+        interaction = self._game_data.get_interaction(target_id)
+        if interaction is None:
+            return []
+        snippets: List[str] = []
+        dialogue = interaction.get("dialogue") or {}
+        if isinstance(dialogue, dict) and dialogue.get("text"):
+            speaker = dialogue.get("header") or interaction.get("title") or "Someone"
+            snippets.append(f"{speaker} says: \"{dialogue['text']}\"")
+        hits = self.search(answer, interaction.get("stage_id"), interaction.get("area_id"), k, exclude_source=target_id)
+        used = sum(len(s) for s in snippets)
+        for _, chunk in hits:
+            if used + len(chunk["text"]) > max_chars:
+                break
+            snippets.append(chunk["text"])
+            used += len(chunk["text"])
+        return snippets
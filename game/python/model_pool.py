@@ -0,0 +1,105 @@
+# model_pool.py — grade recorded answers in parallel, one model per worker process
+import multiprocessing
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+# llama.cpp stops scaling well past a handful of threads on a 1B model, so by
+# default the cores are split into workers of this many threads each. This is
+# twice gpt4all's embed_sharded default: a chat model decodes one token at a
+# time and benefits from more threads per process than a small embedding
+# model working through large batches.
+THREADS_PER_WORKER = 4
+
+Answer = Tuple[str, str]
+Verdict = Tuple[bool, str]
+
+
+def plan_workers(processes: Optional[int] = None, cores: Optional[int] = None) -> Tuple[int, int]:
+    """Return (processes, n_threads) so that processes * n_threads <= cores."""
+    if not cores:
+        from gpt4all import available_cores
+
+        cores = available_cores()
+    if processes is None:
+        processes = max(1, cores // THREADS_PER_WORKER)
+    processes = max(1, min(processes, cores))
+    return processes, max(1, cores // processes)
+
+
+def _init_worker(n_threads: int, data_path: Optional[str]) -> None:
+    # Runs once in every worker: load the GGUF and ingest the evaluator
+    # prefix so each task only pays for its own answer. A model that fails to
+    # load is reported per task by evaluate() rather than here, since an
+    # initializer that raises makes the pool respawn workers forever.
+    from python.dialogue_logic import configure, warm_up
+    from python.llm_local_bind import start_loading, wait_for_model
+
+    # Both shared caches are single-writer; workers never touch them. The
+    # indexes were built by the parent, so warm_up() loads them from disk.
+    configure(data_path, verdict_cache=False, embedding_cache=False)
+    start_loading(n_threads=n_threads)
+    if wait_for_model() is not None:
+        warm_up()
+
+
+def _grade(answer: Answer) -> Verdict:
+    from python.dialogue_logic import evaluate
+
+    player_text, target_id = answer
+    return evaluate(player_text, target_id, llm_only=True)
+
+
+class ModelPool:
+    """A process pool in which every worker holds its own copy of the model.
+
+    One LLModel can only run one generation at a time, so offline grading
+    scales by processes instead: each worker loads the model once in its
+    initializer and then takes tasks from the pool's shared queue. Threads
+    per worker are chosen so the pool never uses more threads than cores.
+    Results are returned in submission order. Workers grade against the
+    game content at data_path (the default content if None) and never use
+    the verdict or embedding caches. The semantic references and lore index
+    are embedded once, in this process, before the workers start, so the
+    workers only load them.
+    """
+
+    def __init__(
+        self, processes: Optional[int] = None, n_threads: Optional[int] = None, data_path: Optional[str] = None
+    ) -> None:
+        self.processes, planned_threads = plan_workers(processes)
+        self.n_threads = n_threads or planned_threads
+        self.data_path = data_path
+        from python.dialogue_logic import build_indexes, configure
+
+        # This process is the only one writing the embedding cache.
+        configure(data_path, verdict_cache=False)
+        build_indexes()
+        # spawn, not fork: the parent may already run threads (model loader,
+        # inference worker) that a forked child would inherit in a bad state.
+        context = multiprocessing.get_context("spawn")
+        self._pool = context.Pool(self.processes, initializer=_init_worker, initargs=(self.n_threads, data_path))
+
+    def imap(self, func: Callable, iterable: Iterable, chunksize: int = 1) -> Iterator:
+        """Ordered lazy map of a picklable top-level function over the workers."""
+        return self._pool.imap(func, iterable, chunksize)
+
+    def grade(self, answers: Iterable[Answer], chunksize: int = 1) -> Iterator[Verdict]:
+        """Yield (ok, feedback) for each (player_text, target_id), in order, from the LLM evaluator."""
+        return self.imap(_grade, answers, chunksize)
+
+    def close(self) -> None:
+        """Wait for outstanding tasks, then stop the workers."""
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self) -> None:
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self) -> "ModelPool":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
@@ -0,0 +1,182 @@
+# prefix_cache.py — keep fixed prompt prefixes resident in the model's KV cache
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Optional
+
+# Prompt batch size used when the caller does not pass a tuned one.
+PREFIX_N_BATCH = 128
+# In-memory budget for prefix snapshots. A short prefix on a 1B model is a few MB.
+SNAPSHOT_MEMORY_BYTES = 64 * 2**20
+
+TokenCallback = Callable[[int, str], bool]
+
+
+def _keep_going(token_id: int, response: str) -> bool:
+    return True
+
+
+def snapshot_key(llmodel, prefix: str) -> str:
+    """Identify a prefix state by model file (path, size, mtime), context size and prefix text."""
+    model_path = os.fsdecode(llmodel.model_path)
+    try:
+        stat = os.stat(model_path)
+        file_id = f"{stat.st_size}:{int(stat.st_mtime)}"
+    except OSError:
+        file_id = "missing"
+    digest = hashlib.sha1()
+    for part in (os.path.basename(model_path), file_id, str(llmodel.n_ctx), prefix):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class SnapshotStore:
+    """Prefix state snapshots in a byte-bounded in-memory LRU.
+
+    Snapshots are not persisted: the C API cannot refill the backend's token
+    cache, so restore_state() only succeeds on a context that has already
+    processed a prompt of the snapshot's length. A snapshot from an earlier
+    launch could therefore never be applied to a freshly loaded model.
+    """
+
+    def __init__(self, max_bytes: int = SNAPSHOT_MEMORY_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, object]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: str):
+        state = self._entries.get(key)
+        if state is not None:
+            self._entries.move_to_end(key)
+        return state
+
+    def put(self, key: str, state) -> None:
+        if len(state.data) > state.size:
+            del state.data[state.size:]  # drop the unused tail of the state_size() upper bound
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous.size
+        if state.size > self.max_bytes:
+            return
+        self._entries[key] = state
+        self._bytes += state.size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+
+
+class PrefixCache:
+    """Ingests shared prompt prefixes once and reuses their KV state.
+
+    The first call with a given prefix prompts the model with the prefix alone
+    (n_predict=0) and snapshots the resulting state. Later calls rewind the
+    context to the end of the prefix when it is still resident, or restore
+    its snapshot, and only feed the per-request suffix. The cached token ids
+    are compared against the live context before each reuse, so any other use
+    of the model (a chat session, a context shift) simply triggers a restore
+    or a fresh ingestion instead of producing wrong output.
+    """
+
+    def __init__(self, n_batch: int = PREFIX_N_BATCH, snapshots: Optional[SnapshotStore] = None) -> None:
+        self.n_batch = n_batch
+        self.snapshots = snapshots if snapshots is not None else SnapshotStore()
+        self.lock = threading.RLock()
+        self._prefix: Optional[str] = None
+        self._tokens: List[int] = []
+        self.hits = 0
+        self.restores = 0
+        self.misses = 0
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self._prefix = None
+            self._tokens = []
+
+    def _is_resident(self, llmodel, prefix: str) -> bool:
+        if self._prefix != prefix or not self._tokens:
+            return False
+        n_prefix = len(self._tokens)
+        if llmodel.n_past < n_prefix:
+            return False
+        return llmodel.context_tokens()[:n_prefix] == self._tokens
+
+    def _ingest(self, llmodel, prefix: str, n_batch: int) -> None:
+        llmodel.prompt_model(
+            prefix, "%1%2", _keep_going,
+            n_predict=0, n_batch=n_batch, reset_context=True, special=True,
+        )
+        self._prefix = prefix
+        self._tokens = llmodel.context_tokens()[:llmodel.n_past]
+
+    def _activate(self, llmodel, prefix: str, n_batch: int) -> None:
+        """Make prefix the live context, by rewind, snapshot restore or ingestion."""
+        if self._is_resident(llmodel, prefix):
+            self.hits += 1
+            llmodel.rewind_context(len(self._tokens))
+            return
+        key = snapshot_key(llmodel, prefix)
+        state = self.snapshots.get(key)
+        if state is not None and llmodel.restore_state(state):
+            self.restores += 1
+            self._prefix = prefix
+            self._tokens = list(state.tokens)
+            return
+        self.misses += 1
+        self._ingest(llmodel, prefix, n_batch)
+        self.snapshots.put(key, llmodel.save_state())
+
+    def warm(self, model, prefixes: Iterable[str], n_batch: Optional[int] = None) -> None:
+        """Ensure a snapshot exists for every prefix, ending with the first one live."""
+        prefixes = list(prefixes)
+        with self.lock:
+            for prefix in reversed(prefixes):
+                self._activate(model.model, prefix, n_batch or self.n_batch)
+
+    def generate(
+        self,
+        model,
+        prefix: str,
+        suffix: str,
+        callback: TokenCallback = _keep_going,
+        *,
+        max_tokens: int = 200,
+        temp: float = 0.7,
+        top_k: int = 40,
+        top_p: float = 0.4,
+        min_p: float = 0.0,
+        repeat_penalty: float = 1.18,
+        repeat_last_n: int = 64,
+        n_batch: Optional[int] = None,
+    ) -> str:
+        """Generate a completion of prefix + suffix, reusing the cached prefix state.
+
+        model is a GPT4All instance; prefix and suffix are raw text that may
+        contain the chat template's special tokens. n_batch applies to both
+        the prefix ingestion and the suffix (self.n_batch if None).
+        """
+        n_batch = n_batch or self.n_batch
+        llmodel = model.model
+        chunks: List[str] = []
+
+        def _collect(token_id: int, response: str) -> bool:
+            chunks.append(response)
+            return callback(token_id, response)
+
+        with self.lock:
+            self._activate(llmodel, prefix, n_batch)
+            llmodel.prompt_model(
+                suffix, "%1%2", _collect,
+                n_predict=max_tokens,
+                top_k=top_k,
+                top_p=top_p,
+                min_p=min_p,
+                temp=temp,
+                n_batch=n_batch,
+                repeat_penalty=repeat_penalty,
+                repeat_last_n=repeat_last_n,
+                reset_context=False,
+                special=True,
+            )
+        return "".join(chunks)
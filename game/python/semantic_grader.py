@@ -0,0 +1,231 @@
+# semantic_grader.py — grade answers by embedding similarity to authored references
+import hashlib
+import json
+import math
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from python.game_data import GameData
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; fall back to plain Python vectors
+    np = None
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2.gguf2.f16.gguf"
+# Cosine similarity against the closest reference of the target interaction.
+PASS_THRESHOLD = 0.55
+FAIL_THRESHOLD = 0.25
+# A pass must also be this much closer to a reference than to the NPC's own
+# line, so repeating or paraphrasing the question does not pass.
+BASELINE_MARGIN = 0.1
+
+_FORMAT_VERSION = 2
+
+Verdict = Tuple[bool, str]
+
+
+def _normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+def reference_texts(interaction: Dict[str, object]) -> List[str]:
+    """The texts a passing answer is close to: each keyword and the success feedback."""
+    dialogue = interaction.get("dialogue") or {}
+    if not isinstance(dialogue, dict):
+        return []
+    texts = list(dialogue.get("keywords", []) or [])
+    texts.append(dialogue.get("success_feedback"))
+    return [t.strip() for t in texts if isinstance(t, str) and t.strip()]
+
+
+def baseline_text(interaction: Dict[str, object]) -> Optional[str]:
+    """The NPC's own line, which an answer must beat rather than match."""
+    dialogue = interaction.get("dialogue") or {}
+    text = dialogue.get("text") if isinstance(dialogue, dict) else None
+    return text.strip() if isinstance(text, str) and text.strip() else None
+
+
+class SemanticGrader:
+    """Cosine-similarity grader over precomputed reference embeddings.
+
+    All reference texts of all interactions are embedded in one batch on
+    first use and stored, L2-normalized, as a single matrix together with
+    the row range owned by each interaction. The NPC's line is embedded as a
+    separate baseline row: an answer only passes if it is closer to a
+    reference than to that line by BASELINE_MARGIN. The matrix is persisted
+    next to the other caches and rebuilt only when game content or the
+    embedding model change. Grading an answer is one embedding call plus one
+    matrix-vector product over the target's rows. With embedding_cache_dir
+    every embedding also goes through the shared on-disk embedding cache.
+    """
+
+    def __init__(
+        self,
+        model_dir: str,
+        cache_path: str,
+        game_data: Optional[GameData] = None,
+        model_name: str = EMBEDDING_MODEL_NAME,
+        pass_threshold: float = PASS_THRESHOLD,
+        fail_threshold: float = FAIL_THRESHOLD,
+        embedding_cache_dir: Optional[str] = None,
+    ) -> None:
+        self.model_dir = model_dir
+        self.cache_path = cache_path
+        self.embedding_cache_dir = embedding_cache_dir
+        self.model_name = model_name
+        self.pass_threshold = pass_threshold
+        self.fail_threshold = fail_threshold
+        self._game_data = game_data or GameData()
+        self._lock = threading.Lock()
+        # Separate from _lock, which build() holds while it embeds.
+        self._embedder_lock = threading.Lock()
+        self._embedder = None
+        self._matrix = None
+        self._rows: Dict[str, Tuple[int, int]] = {}
+        self._baselines: Dict[str, int] = {}
+        self._feedback: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+        for interaction in self._game_data.iter_interactions():
+            dialogue = interaction.get("dialogue") or {}
+            if isinstance(dialogue, dict):
+                self._feedback[str(interaction.get("id"))] = (
+                    dialogue.get("success_feedback"),
+                    dialogue.get("failure_feedback"),
+                )
+
+    # ------------------------------------------------------------------
+    # Reference matrix
+    # ------------------------------------------------------------------
+    def get_embedder(self):
+        with self._embedder_lock:
+            if self._embedder is None:
+                from gpt4all import Embed4All, EmbeddingCache
+
+                # Content edits re-embed only the changed texts, and answers
+                # seen before skip the model entirely.
+                cache = EmbeddingCache(self.embedding_cache_dir) if self.embedding_cache_dir else None
+                self._embedder = Embed4All(
+                    self.model_name, model_path=self.model_dir, allow_download=False, cache=cache
+                )
+            return self._embedder
+
+    def _content_key(self) -> str:
+        digest = hashlib.sha1()
+        digest.update(self.model_name.encode("utf-8"))
+        for interaction in self._game_data.iter_interactions():
+            digest.update(str(interaction.get("id")).encode("utf-8"))
+            for text in reference_texts(interaction):
+                digest.update(b"\0" + text.encode("utf-8"))
+            digest.update(b"\1" + (baseline_text(interaction) or "").encode("utf-8"))
+        return digest.hexdigest()
+
+    def _set_matrix(self, vectors, rows: Dict[str, Tuple[int, int]], baselines: Dict[str, int]) -> None:
+        if np is not None:
+            matrix = np.asarray(vectors, dtype=np.float32)
+            if matrix.size:
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                norms[norms == 0.0] = 1.0
+                matrix = matrix / norms
+            self._matrix = matrix
+        else:
+            self._matrix = [_normalize(v) for v in vectors]
+        self._rows = rows
+        self._baselines = baselines
+
+    def _load(self, key: str) -> bool:
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as fh:
+                payload = json.load(fh)
+        except (OSError, ValueError):
+            return False
+        if payload.get("format") != _FORMAT_VERSION or payload.get("key") != key:
+            return False
+        self._set_matrix(
+            payload["vectors"], {k: tuple(v) for k, v in payload["rows"].items()}, payload["baselines"]
+        )
+        return True
+
+    def build(self) -> None:
+        """Embed every reference text (or load them from disk) if not done yet."""
+        with self._lock:
+            if self._matrix is not None:
+                return
+            key = self._content_key()
+            if self._load(key):
+                return
+            texts: List[str] = []
+            rows: Dict[str, Tuple[int, int]] = {}
+            baselines: Dict[str, int] = {}
+            for interaction in self._game_data.iter_interactions():
+                refs = reference_texts(interaction)
+                if refs:
+                    interaction_id = str(interaction.get("id"))
+                    rows[interaction_id] = (len(texts), len(texts) + len(refs))
+                    texts.extend(refs)
+                    baseline = baseline_text(interaction)
+                    if baseline is not None:
+                        baselines[interaction_id] = len(texts)
+                        texts.append(baseline)
+            vectors = []
+            if texts:
+                # One bulk copy into a float32 matrix instead of a list per text.
+                vectors = self.get_embedder().embed(texts, as_array=np is not None)
+            self._set_matrix(vectors, rows, baselines)
+            if np is not None and texts:
+                vectors = vectors.tolist()
+            # Per-process temp name: pool workers may write the file at once.
+            tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+                with open(tmp_path, "w", encoding="utf-8") as fh:
+                    json.dump({"format": _FORMAT_VERSION, "key": key, "rows": rows, "baselines": baselines,
+                               "vectors": vectors}, fh)
+                os.replace(tmp_path, self.cache_path)
+            except OSError as e:
+                print(f"[HOLMES] WARNING: could not write semantic reference cache: {e}")
+
+    # ------------------------------------------------------------------
+    # Grading
+    # ------------------------------------------------------------------
+    def _scores(self, target_id: str, answer: str) -> Optional[Tuple[float, Optional[float]]]:
+        """(best reference similarity, similarity to the NPC line or None) for the answer."""
+        self.build()
+        span = self._rows.get(target_id)
+        if span is None:
+            return None
+        start, end = span
+        baseline_row = self._baselines.get(target_id)
+        if np is not None:
+            query = self.get_embedder().embed(answer, as_array=True)
+            norm = float(np.linalg.norm(query)) or 1.0
+            score = float(np.max(self._matrix[start:end] @ query)) / norm
+            baseline = float(self._matrix[baseline_row] @ query) / norm if baseline_row is not None else None
+            return score, baseline
+        query = _normalize(self.get_embedder().embed(answer))
+        score = max(sum(a * b for a, b in zip(row, query)) for row in self._matrix[start:end])
+        baseline = None
+        if baseline_row is not None:
+            baseline = sum(a * b for a, b in zip(self._matrix[baseline_row], query))
+        return score, baseline
+
+    def similarity(self, target_id: str, answer: str) -> Optional[float]:
+        """Highest cosine similarity between the answer and the target's references."""
+        scores = self._scores(target_id, answer)
+        return scores[0] if scores is not None else None
+
+    def grade(self, target_id: str, answer: str) -> Optional[Verdict]:
+        """Return (ok, feedback) when the similarity is decisive, else None."""
+        scores = self._scores(target_id, answer)
+        if scores is None:
+            return None
+        score, baseline = scores
+        success, failure = self._feedback.get(target_id, (None, None))
+        if score >= self.pass_threshold and success:
+            if baseline is None or score >= baseline + BASELINE_MARGIN:
+                return True, success
+            return None  # as close to the NPC's own line as to any reference
+        if score < self.fail_threshold and failure:
+            return False, failure
+        return None
@@ -0,0 +1,205 @@
+# verdict_cache.py — remember evaluator verdicts for answers we have already graded
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+MEMORY_ENTRIES = 256
+DISK_ENTRIES = 4096
+# How often (seconds) to check whether game_content.json changed on disk.
+CONTENT_CHECK_INTERVAL = 2.0
+
+_FORMAT_VERSION = 1
+_PUNCTUATION = re.compile(r"[^\w\s]+", re.UNICODE)
+_WHITESPACE = re.compile(r"\s+")
+
+Verdict = Tuple[bool, str]
+
+
+def normalize_answer(text: str) -> str:
+    """Case-fold, drop punctuation and collapse whitespace so trivial variants share a key."""
+    text = _PUNCTUATION.sub(" ", (text or "").casefold())
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def _file_digest(path: str) -> Optional[str]:
+    try:
+        with open(path, "rb") as fh:
+            return hashlib.sha1(fh.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def _file_signature(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class VerdictCache:
+    """Two-tier verdict cache: a small in-memory LRU over a JSONL file on disk.
+
+    The file starts with a header line recording the hash of the game content
+    it was built against; when the content changes the whole cache is dropped.
+    New verdicts are appended one per line, and the file is rewritten with the
+    newest DISK_ENTRIES entries once it holds twice that many lines.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        content_path: str,
+        model_name: str,
+        prompt_version: int,
+        memory_entries: int = MEMORY_ENTRIES,
+        disk_entries: int = DISK_ENTRIES,
+    ) -> None:
+        self.path = path
+        self.content_path = content_path
+        self.model_name = model_name
+        self.prompt_version = prompt_version
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Verdict]" = OrderedDict()
+        self._disk: "OrderedDict[str, Verdict]" = OrderedDict()
+        self._disk_lines = 0
+        self._content_hash: Optional[str] = None
+        self._content_signature: Optional[Tuple[int, int]] = None
+        self._checked_at = 0.0
+        self._load()
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    def key(self, target_id: str, answer: str) -> str:
+        raw = "\0".join((str(target_id), normalize_answer(answer), self.model_name, str(self.prompt_version)))
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, target_id: str, answer: str) -> Optional[Verdict]:
+        key = self.key(target_id, answer)
+        with self._lock:
+            self._check_content()
+            verdict = self._memory.get(key)
+            if verdict is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return verdict
+            verdict = self._disk.get(key)
+            if verdict is None:
+                self.misses += 1
+                return None
+            self._remember(key, verdict)
+            self.hits += 1
+            return verdict
+
+    def put(self, target_id: str, answer: str, ok: bool, feedback: str) -> None:
+        key = self.key(target_id, answer)
+        verdict = (bool(ok), feedback)
+        with self._lock:
+            self._check_content()
+            self._remember(key, verdict)
+            self._disk.pop(key, None)
+            self._disk[key] = verdict
+            self._append(key, verdict)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._disk.clear()
+            self._rewrite()
+
+    # ------------------------------------------------------------------
+    # Internal helpers
+    # ------------------------------------------------------------------
+    def _remember(self, key: str, verdict: Verdict) -> None:
+        self._memory[key] = verdict
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _check_content(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < CONTENT_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        signature = _file_signature(self.content_path)
+        if signature == self._content_signature:
+            return
+        self._content_signature = signature
+        digest = _file_digest(self.content_path)
+        if digest != self._content_hash:
+            self._content_hash = digest
+            self._memory.clear()
+            self._disk.clear()
+            self._rewrite()
+
+    def _header(self) -> Dict[str, object]:
+        return {"format": _FORMAT_VERSION, "content_hash": self._content_hash}
+
+    def _load(self) -> None:
+        self._content_signature = _file_signature(self.content_path)
+        self._content_hash = _file_digest(self.content_path)
+        self._checked_at = time.monotonic()
+        try:
+            with open(self.path, "r", encoding="utf-8") as fh:
+                header = json.loads(fh.readline() or "{}")
+                stale = header != self._header()
+                if not stale:
+                    for line in fh:
+                        self._disk_lines += 1
+                        try:
+                            key, ok, feedback = json.loads(line)
+                        except (ValueError, TypeError):
+                            continue
+                        self._disk.pop(key, None)
+                        self._disk[key] = (bool(ok), feedback)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            stale = True
+        if stale:
+            # Built against other game content or unreadable: start over.
+            self._disk.clear()
+            self._rewrite()
+            return
+        while len(self._disk) > self.disk_entries:
+            self._disk.popitem(last=False)
+
+    def _append(self, key: str, verdict: Verdict) -> None:
+        if self._disk_lines + 1 > 2 * self.disk_entries:
+            while len(self._disk) > self.disk_entries:
+                self._disk.popitem(last=False)
+            self._rewrite()
+            return
+        try:
+            if not os.path.exists(self.path):
+                self._rewrite()
+                return
+            with open(self.path, "a", encoding="utf-8") as fh:
+                fh.write(json.dumps([key, verdict[0], verdict[1]], ensure_ascii=False) + "\n")
+            self._disk_lines += 1
+        except OSError as e:
+            print(f"[HOLMES] WARNING: could not append to verdict cache: {e}")
+
+    def _rewrite(self) -> None:
+        # Per-process temp name: several processes may rewrite the file at once.
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                fh.write(json.dumps(self._header()) + "\n")
+                for key, (ok, feedback) in self._disk.items():
+                    fh.write(json.dumps([key, ok, feedback], ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+            self._disk_lines = len(self._disk)
+        except OSError as e:
+            print(f"[HOLMES] WARNING: could not write verdict cache: {e}")